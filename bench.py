@@ -0,0 +1,496 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+Handler benchmarks for bot.py.
+
+Builds a synthetic state (users, catalog, harems, groups, a vote) and drives
+the real handlers through Application.process_update with synthetic Updates,
+against a stand-in Bot whose requests are recorded instead of sent. Reports
+ops/sec, p50/p99 latency and RSS growth per scenario (the peak RSS only once:
+it is process-wide) and writes the results as JSON so runs on different
+commits can be compared.
+Run:
+  python bench.py                                   # small preset, every scenario
+  python bench.py --preset large --scenarios harem,tops_callback
+  python bench.py --compare bench_results/OLD.json --fail-over 10
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+import gc
+from collections import Counter
+from datetime import datetime
+
+from telegram import Update
+from telegram.ext import ExtBot
+from telegram.request import BaseRequest
+
+PRESETS = {
+    # users, catalog cards, cards of the heavy harems, mean harem size of everyone else
+    "small": {"users": 10_000, "cards": 1_000, "harem": 1_000, "harem_avg": 20},
+    "medium": {"users": 100_000, "cards": 10_000, "harem": 5_000, "harem_avg": 10},
+    "large": {"users": 1_000_000, "cards": 100_000, "harem": 10_000, "harem_avg": 5},
+}
+SCENARIOS = ("message_counter", "slime", "harem", "harem_callback", "tops_callback", "shop_callback", "vote_callback")
+USER_BASE = 10_000_000  # synthetic user ids start here
+CHAT_BASE = -1_000_000_000_000  # synthetic group ids
+ADMIN_ID = 1
+BOT_ID = 42
+VOTE_OPTIONS = ["Luffy", "Naruto", "Goku"]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark bot.py handlers with synthetic updates")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="small")
+    parser.add_argument("--users", type=int, help="users in the state (preset)")
+    parser.add_argument("--cards", type=int, help="catalog size (preset)")
+    parser.add_argument("--harem", type=int, help="harem size of the heavy users (preset)")
+    parser.add_argument("--harem-avg", type=float, help="mean harem size of the other users (preset)")
+    parser.add_argument("--heavy", type=int, default=100, help="users with a full --harem (the harem scenarios use them)")
+    parser.add_argument("--groups", type=int, default=1_000)
+    parser.add_argument("--ops", type=int, default=2_000, help="measured operations per scenario")
+    parser.add_argument("--warmup", type=int, default=100, help="unmeasured operations before each scenario")
+    parser.add_argument("--concurrency", type=int, default=1, help="updates in flight at once")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated subset of: " + ", ".join(SCENARIOS))
+    parser.add_argument("--backend", choices=("json", "sqlite"), default="json")
+    parser.add_argument("--no-journal", action="store_true", help="run without the journal (no fsync per command)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="results file (default bench_results/<commit>-<time>.json)")
+    parser.add_argument("--compare", metavar="RESULTS", help="earlier results to compare against")
+    parser.add_argument("--fail-over", type=float, metavar="PCT",
+                        help="with --compare: exit 1 if ops/sec drops or p99 grows by more than PCT percent")
+    args = parser.parse_args(argv)
+    for name, value in PRESETS[args.preset].items():
+        if getattr(args, name) is None:
+            setattr(args, name, value)
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    return args
+
+
+def prepare_env(args, workdir: str):
+    """Settings for bot.py; they must be in place before it is imported."""
+    os.environ.update({
+        "DATA_FILE": os.path.join(workdir, "data.db" if args.backend == "sqlite" else "data.json"),
+        "STORAGE_BACKEND": args.backend,
+        "JOURNAL": "false" if args.no_journal else "true",
+        "ADMIN_IDS": str(ADMIN_ID),
+        "BACKUP_DIR": os.path.join(workdir, "backups"),
+        "BACKUP_INTERVAL": "0",
+        "METRICS_PORT": "0",
+        "SLOW_UPDATE_MS": "0",
+        "LAZY_LOAD": "false",
+        "SHARDS": "1",
+        "DEBUG": "false",  # a DEBUG=true .env would log every request and skew the timings
+    })
+    os.environ.pop("SHARD_INDEX", None)
+
+
+# ----------------- STAND-IN BOT -----------------
+class RecordingRequest(BaseRequest):
+    """Answers every Bot API call with a plausible result; counts calls and payload bytes per method."""
+
+    def __init__(self):
+        self.calls = Counter()
+        self.bytes = Counter()
+        self.message_id = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def result(self, method: str, params: dict):
+        chat_id = params.get("chat_id", ADMIN_ID)
+        if method == "getMe":
+            return {"id": BOT_ID, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        if method == "getChat":
+            return {"id": chat_id, "type": "private", "first_name": f"User {chat_id}"}
+        if method.startswith(("send", "edit", "copy", "forward")):
+            self.message_id += 1
+            return {
+                "message_id": params.get("message_id", self.message_id),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private" if int(chat_id) > 0 else "group"},
+                "from": {"id": BOT_ID, "is_bot": True, "first_name": "Bench"},
+                "text": params.get("text", ""),
+            }
+        return True
+
+    async def do_request(self, url, method, request_data=None, **timeouts):
+        name = url.rsplit("/", 1)[-1]
+        params = {}
+        if request_data is not None:
+            # encode the payload as HTTPXRequest would, so its cost stays in the numbers
+            self.bytes[name] += len(request_data.json_payload)
+            params = request_data.parameters
+        self.calls[name] += 1
+        return 200, json.dumps({"ok": True, "result": self.result(name, params)}).encode()
+
+
+def recording_bot():
+    """An ExtBot whose Bot API requests are recorded and answered locally; returns (bot, its request)."""
+    request = RecordingRequest()
+    return ExtBot("123456:BENCH", request=request, get_updates_request=RecordingRequest()), request
+
+
+# ----------------- SYNTHETIC STATE -----------------
+def populate(bot, args, rng):
+    """Fill bot.data with the synthetic state; returns the keys of the heavy users."""
+    data = bot.data
+    rarities = list(bot.RARITIES)
+    movies = [f"Movie {i}" for i in range(max(1, args.cards // 20))]
+    data["cards"] = [
+        {
+            "id": f"card_{i}",
+            "name": f"Character {i}",
+            "movie": rng.choice(movies),
+            "rarity": rng.choice(rarities),
+            "photo": f"AgACAgUAAxkBAAI{i:010d}",
+        }
+        for i in range(1, args.cards + 1)
+    ]
+    data["next_card"] = args.cards + 1
+    card_ids = [sys.intern(card["id"]) for card in data["cards"]]
+
+    serial = bot.SERIAL_START
+    users = data["users"]
+    now = int(time.time())
+    heavy = []
+    for i in range(args.users):
+        user_key = str(USER_BASE + i)
+        size = args.harem if i < args.heavy else min(args.harem, int(rng.expovariate(1 / args.harem_avg)))
+        harem = []
+        for card_id in rng.choices(card_ids, k=size):
+            harem.append([card_id, serial, now])
+            serial += 1
+        users[user_key] = {
+            "coins": rng.randint(0, 1_000_000),
+            "cards": [],
+            "harem": harem,
+            "fav_card": None,
+            "last_daily": None,
+            "last_slime": None,
+        }
+        if i < args.heavy:
+            heavy.append(user_key)
+    data["next_serial"] = serial
+
+    for i in range(args.groups):
+        chat_id = str(CHAT_BASE - i)
+        data["groups"][chat_id] = {"name": f"Group {i}", "joined": datetime.now().isoformat()}
+        data["group_messages"][chat_id] = rng.randrange(data.get("drop_count", bot.DROP_COUNT))
+
+    data["vote_options"] = list(VOTE_OPTIONS)
+    data["votes"] = {option: [] for option in VOTE_OPTIONS}
+    bot.mark_dirty()
+    return heavy
+
+
+# ----------------- UPDATES -----------------
+class Updates:
+    """Synthetic Update payloads, decoded against the stand-in bot."""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.update_id = 0
+        self.message_id = 0
+
+    def _next(self):
+        self.update_id += 1
+        self.message_id += 1
+        return self.update_id, self.message_id
+
+    @staticmethod
+    def _user(user_id: int):
+        return {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"}
+
+    @staticmethod
+    def _chat(chat_id: int):
+        if chat_id > 0:
+            return {"id": chat_id, "type": "private", "first_name": f"User {chat_id}"}
+        return {"id": chat_id, "type": "supergroup", "title": f"Group {chat_id}"}
+
+    def message(self, user_id: int, chat_id: int, text: str):
+        update_id, message_id = self._next()
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": self._chat(chat_id),
+            "from": self._user(user_id),
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return Update.de_json({"update_id": update_id, "message": message}, self.bot)
+
+    def callback(self, user_id: int, chat_id: int, payload: str):
+        update_id, message_id = self._next()
+        query = {
+            "id": str(update_id),
+            "from": self._user(user_id),
+            "chat_instance": str(chat_id),
+            "data": payload,
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": self._chat(chat_id),
+                "from": {"id": BOT_ID, "is_bot": True, "first_name": "Bench"},
+                "text": "…",
+            },
+        }
+        return Update.de_json({"update_id": update_id, "callback_query": query}, self.bot)
+
+
+# ----------------- SCENARIOS -----------------
+class Scenarios:
+    """
+    Each scenario returns (prepare, update) for its n-th operation. `prepare`
+    runs before the timer starts (setting up a drop, a balance change, ...).
+    Users are taken round-robin so cooldowns do not kick in until --ops
+    exceeds the number of users.
+    """
+
+    def __init__(self, bot, args, rng, updates, heavy):
+        self.bot = bot
+        self.args = args
+        self.rng = rng
+        self.updates = updates
+        self.heavy = heavy
+        self.user_ids = [USER_BASE + i for i in range(args.users)]
+        self.chat_ids = [CHAT_BASE - i for i in range(args.groups)]
+        self.cards = bot.data["cards"]
+
+    def _user(self, n: int) -> int:
+        return self.user_ids[n % len(self.user_ids)]
+
+    def _heavy(self, n: int) -> int:
+        return int(self.heavy[n % len(self.heavy)]) if self.heavy else self._user(n)
+
+    def _pages(self, user_id: int) -> int:
+        return max(1, (len(self.bot.data["users"][str(user_id)]["harem"]) + 4) // 5)
+
+    def message_counter(self, n):
+        return None, self.updates.message(self._user(n), self.rng.choice(self.chat_ids), "hello there")
+
+    def slime(self, n):
+        chat_id = self.chat_ids[n % len(self.chat_ids)]
+        picked = self.rng.choice(self.cards)
+
+        def prepare():
+            card = dict(picked, id=f"{picked['id']}_{self.rng.randint(1000, 9999)}", card_id=picked["id"])
+            self.bot._op_drop(str(chat_id), card)
+
+        return prepare, self.updates.message(self._user(n), chat_id, f"/slime {picked['name']}")
+
+    def harem(self, n):
+        user_id = self._heavy(n)
+        page = self.rng.randrange(self._pages(user_id)) + 1
+        return None, self.updates.message(user_id, user_id, f"/harem {page}")
+
+    def harem_callback(self, n):
+        user_id = self._heavy(n)
+        page = self.rng.randrange(self._pages(user_id))
+        return None, self.updates.callback(user_id, user_id, f"harem_{page}")
+
+    def tops_callback(self, n):
+        user_key = str(self._user(n * 7919))
+
+        def prepare():
+            # keep the boards moving so rendered pages are not always cached
+            user = self.bot.data["users"][user_key]
+            user["coins"] += self.rng.randint(0, 50_000)
+            self.bot.rank_user(user_key, user)
+
+        board = "tops_coins" if n % 2 else "tops_cards"
+        return prepare, self.updates.callback(self._user(n), self._user(n), board)
+
+    def shop_callback(self, n):
+        user_id = self._user(n)
+        if n % 2:
+            pages = max(1, (len(self.cards) + self.bot.SHOP_PAGE_SIZE - 1) // self.bot.SHOP_PAGE_SIZE)
+            payload = self.bot.shop_data(self.rng.randrange(pages), None, None, None)
+        else:
+            payload = f"buy_{self.rng.choice(self.cards)['id']}"
+        return None, self.updates.callback(user_id, user_id, payload)
+
+    def vote_callback(self, n):
+        user_id = self._user(n)
+        return None, self.updates.callback(user_id, user_id, f"vote_{VOTE_OPTIONS[n % len(VOTE_OPTIONS)]}")
+
+
+# ----------------- RUNNER -----------------
+def percentile(ordered, fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+async def run_scenario(application, make, ops: int, warmup: int, concurrency: int, request):
+    async def one(n, latencies):
+        prepare, update = make(n)
+        if prepare is not None:
+            prepare()
+        started = time.perf_counter()
+        await application.process_update(update)
+        if latencies is not None:
+            latencies.append(time.perf_counter() - started)
+
+    for n in range(warmup):
+        await one(n, None)
+    gc.collect()
+    calls_before = sum(request.calls.values())
+    bytes_before = sum(request.bytes.values())
+    latencies = []
+    started = time.perf_counter()
+    if concurrency <= 1:
+        for n in range(warmup, warmup + ops):
+            await one(n, latencies)
+    else:
+        limit = asyncio.Semaphore(concurrency)
+
+        async def bounded(n):
+            async with limit:
+                await one(n, latencies)
+
+        await asyncio.gather(*(bounded(n) for n in range(warmup, warmup + ops)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "ops": ops,
+        "seconds": round(elapsed, 4),
+        "ops_per_sec": round(ops / elapsed, 1) if elapsed else None,
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 4),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 4),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 4),
+        "max_ms": round(latencies[-1] * 1000, 4),
+        "api_calls_per_op": round((sum(request.calls.values()) - calls_before) / ops, 3),
+        "api_bytes_per_op": round((sum(request.bytes.values()) - bytes_before) / ops, 1),
+    }
+
+
+def mb(size):
+    return round(size / (1 << 20), 1) if size is not None else None
+
+
+def commit_id() -> str:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def benchmark(args):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import bot
+
+    random.seed(args.seed)  # drops and slots draw from the module-level generator
+    rng = random.Random(args.seed)
+    stand_in, request = recording_bot()
+    results = {
+        "commit": commit_id(),
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {name: value for name, value in vars(args).items() if name not in ("output", "compare", "fail_over")},
+        "setup": {},
+        "scenarios": {},
+    }
+
+    started = time.perf_counter()
+    heavy = populate(bot, args, rng)
+    results["setup"]["populate_seconds"] = round(time.perf_counter() - started, 3)
+    application = bot.build_application(stand_in)
+    await application.initialize()
+    await bot.on_startup(application)
+    started = time.perf_counter()
+    await bot.persistence.flush()  # the first full save of the synthetic state
+    results["setup"]["save_seconds"] = round(time.perf_counter() - started, 3)
+    current, _ = bot.memory_usage()
+    results["setup"]["rss_mb"] = mb(current)
+
+    scenarios = Scenarios(bot, args, rng, Updates(stand_in), heavy)
+    try:
+        for name in args.scenarios:
+            before, _ = bot.memory_usage()
+            result = await run_scenario(application, getattr(scenarios, name), args.ops, args.warmup,
+                                        args.concurrency, request)
+            # the peak (ru_maxrss) is process-wide and scenarios share the process: per scenario
+            # only the current RSS and what the scenario added to it mean anything
+            current, _ = bot.memory_usage()
+            result["rss_mb"] = mb(current)
+            result["rss_growth_mb"] = mb(current - before) if current and before else None
+            results["scenarios"][name] = result
+            growth = f"{result['rss_growth_mb']:+8,.1f} MB" if result["rss_growth_mb"] is not None else "n/a"
+            print(f"{name:<16}{result['ops_per_sec']:>12,.1f} ops/s  p50 {result['p50_ms']:>9.3f} ms  "
+                  f"p99 {result['p99_ms']:>9.3f} ms  RSS {growth}", flush=True)
+    finally:
+        await application.shutdown()
+        await bot.on_shutdown(application)
+    results["requests"] = dict(request.calls)
+    results["process_peak_rss_mb"] = mb(bot.memory_usage()[1])
+    return results
+
+
+def compare(old, new, fail_over=None) -> bool:
+    """Print old -> new per scenario; False when a change exceeds `fail_over` percent."""
+    ok = True
+    print(f"\nvs {old.get('commit', '?')} ({old.get('created', '?')})")
+    differing = sorted(name for name, value in new["params"].items() if old.get("params", {}).get(name) != value)
+    if differing:
+        print(f"note: parameters differ ({', '.join(differing)}); the numbers are not like for like")
+    for name, result in new["scenarios"].items():
+        before = old.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        speed = (result["ops_per_sec"] / before["ops_per_sec"] - 1) * 100 if before["ops_per_sec"] else 0.0
+        tail = (result["p99_ms"] / before["p99_ms"] - 1) * 100 if before["p99_ms"] else 0.0
+        flag = ""
+        if fail_over is not None and (speed < -fail_over or tail > fail_over):
+            ok = False
+            flag = "  REGRESSION"
+        print(f"{name:<16}ops/s {before['ops_per_sec']:>10,.1f} -> {result['ops_per_sec']:>10,.1f} ({speed:+6.1f}%)  "
+              f"p99 {before['p99_ms']:>8.3f} -> {result['p99_ms']:>8.3f} ms ({tail:+6.1f}%){flag}")
+    return ok
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix="bot-bench-")
+    prepare_env(args, workdir)
+    try:
+        results = asyncio.run(benchmark(args))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "bench_results",
+        f"{results['commit']}-{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"results: {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            if not compare(json.load(f), results, args.fail_over):
+                raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
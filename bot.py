@@ -14,23 +14,58 @@ Create by : @Enoch_777 (fixed version)
 """
 
 import os
+import re
+import sys
+import zlib
+import gc
+import gzip
+import shutil
+import hashlib
 import json
+import codecs
+import csv
+import io
+import zipfile
+import heapq
+import bisect
 import random
+import sqlite3
 import logging
+import signal
 import asyncio
+import argparse
+import subprocess
+import functools
+import contextlib
+import contextvars
+import threading
+import tracemalloc
+import resource
+import types
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, Counter
+from collections.abc import MutableMapping
 from datetime import datetime, timedelta
 from html import escape
 
 from dotenv import load_dotenv
 
 # Telegram imports (v20+)
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import (
+    Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultCachedPhoto, InputMediaPhoto,
+)
 from telegram.constants import ParseMode
+from telegram.error import RetryAfter
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     Application,
+    SimpleUpdateProcessor,
     CommandHandler,
     CallbackQueryHandler,
+    InlineQueryHandler,
     MessageHandler,
+    TypeHandler,
     ContextTypes,
     filters,
 )
@@ -43,6 +78,68 @@ BOT_TOKEN = os.getenv("BOT_TOKEN", "")
 ADMIN_IDS = [int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip()]
 DROP_COUNT = int(os.getenv("DROP_COUNT", 10))
 DEBUG = os.getenv("DEBUG", "false").lower() == "true"
+FLUSH_INTERVAL = float(os.getenv("FLUSH_INTERVAL", 5))  # max seconds a change waits before hitting disk
+FLUSH_THRESHOLD = int(os.getenv("FLUSH_THRESHOLD", 200))  # dirty marks that trigger an early flush
+JOURNAL_ENABLED = os.getenv("JOURNAL", "true").lower() == "true"  # append-only op log between snapshots
+JOURNAL_SYNC_MS = float(os.getenv("JOURNAL_SYNC_MS", 5))  # group-commit window before each fsync
+# "json" or "sqlite"; defaults to sqlite when DATA_FILE looks like a database
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "").lower() or (
+    "sqlite" if DATA_FILE.endswith((".db", ".sqlite", ".sqlite3")) else "json"
+)
+NAME_TTL = int(os.getenv("NAME_TTL", 86400))  # seconds before a cached display name is re-fetched
+NAME_FETCH_CONCURRENCY = int(os.getenv("NAME_FETCH_CONCURRENCY", 5))  # parallel get_chat calls for cold names
+NAME_CACHE_SIZE = int(os.getenv("NAME_CACHE_SIZE", 50000))  # names kept for people without a user record
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", 25))  # sends per second (Telegram allows about 30)
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", 8))  # concurrent sends in flight
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", 32))  # updates handled at once (1 = sequential)
+LOCK_STRIPES = int(os.getenv("LOCK_STRIPES", 1024))  # per-user/per-chat lock pool size
+# webhook mode (instead of polling) when WEBHOOK_URL, the public base URL, is set
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8443))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", 40))
+LAZY_LOAD = os.getenv("LAZY_LOAD", "false").lower() == "true"  # json backend: index data.json, load users on demand
+# drop odds per rarity, e.g. "Common:50,Rare:30"; rarities left out never drop
+RARITY_WEIGHTS = {
+    name.strip(): float(weight)
+    for name, weight in (
+        pair.split(":") for pair in os.getenv("RARITY_WEIGHTS", "Common:50,Rare:30,Epic:12,Legendary:6,Mythic:2").split(",")
+        if pair.strip()
+    )
+}
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", 300))  # seconds Telegram may cache an inline catalog answer
+INLINE_HAREM_CACHE_TIME = int(os.getenv("INLINE_HAREM_CACHE_TIME", 10))  # same, for personal harem answers
+SHARDS = int(os.getenv("SHARDS", 1))  # worker processes; more than 1 starts a routing front process
+SHARD_INDEX = int(os.environ["SHARD_INDEX"]) if os.getenv("SHARD_INDEX") else None  # set on workers by the front
+SHARD_RPC_TIMEOUT = float(os.getenv("SHARD_RPC_TIMEOUT", 10))  # seconds to wait for another shard
+
+
+def shard_file(index: int) -> str:
+    """data.json -> data.shard<index>.json: where a worker keeps its partition."""
+    root, ext = os.path.splitext(SHARD_BASE)
+    return f"{root}.shard{index}{ext}"
+
+
+SHARD_BASE = DATA_FILE  # the single-process data file
+if SHARD_INDEX is not None:
+    DATA_FILE = shard_file(SHARD_INDEX)
+
+# compressed backups with a manifest chain (full + deltas); workers use BACKUP_DIR/shard<N>
+BACKUP_DIR = os.getenv("BACKUP_DIR", os.path.join(os.path.dirname(SHARD_BASE) or ".", "backups"))
+if SHARD_INDEX is not None:
+    BACKUP_DIR = os.path.join(BACKUP_DIR, f"shard{SHARD_INDEX}")
+BACKUP_INTERVAL = float(os.getenv("BACKUP_INTERVAL", 3600))  # seconds between automatic backups (0 = off)
+BACKUP_FULL_EVERY = int(os.getenv("BACKUP_FULL_EVERY", 24))  # deltas before the next full backup
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", 7))  # full backups (with their deltas) kept
+
+# Prometheus scrape endpoint (0 = off); workers listen on METRICS_PORT + 1 + SHARD_INDEX
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+if SHARD_INDEX is not None and METRICS_PORT:
+    METRICS_PORT += 1 + SHARD_INDEX
+SLOW_UPDATE_MS = float(os.getenv("SLOW_UPDATE_MS", 2000))  # log updates slower than this with their timings (0 = off)
 
 # ----------------- LOGGING -----------------
 logging.basicConfig(
@@ -51,24 +148,1499 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# ----------------- GLOBAL STATE -----------------
-data_lock = asyncio.Lock()  # used to serialize writes
+# ----------------- METRICS -----------------
+# Counters and latency histograms kept in memory and rendered in the
+# Prometheus text format on METRICS_LISTEN:METRICS_PORT/metrics. Handlers,
+# Bot API calls and persistence record into the `metrics` registry below;
+# gauges are read when scraped.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Metrics:
+    """
+    A minimal Prometheus registry. Series are keyed by metric name and a
+    tuple of (label, value) pairs. Everything is recorded from the event
+    loop, so no locking is needed.
+    """
+
+    def __init__(self):
+        self.meta = {}  # name -> (type, help)
+        self.buckets = {}  # histogram name -> upper bounds
+        self.series = {}  # name -> {labels: value, or [per-bucket counts..., sum, count] for histograms}
+        self.gauges = {}  # name -> callable returning a number or {labels: value}
+
+    def counter(self, name: str, help: str):
+        self.meta[name] = ("counter", help)
+        self.series.setdefault(name, {})
+
+    def histogram(self, name: str, help: str, buckets=LATENCY_BUCKETS):
+        self.meta[name] = ("histogram", help)
+        self.buckets[name] = tuple(buckets)
+        self.series.setdefault(name, {})
+
+    def gauge(self, name: str, help: str, read):
+        self.meta[name] = ("gauge", help)
+        self.gauges[name] = read
+
+    def inc(self, name: str, amount=1, **labels):
+        series = self.series[name]
+        key = tuple(labels.items())
+        series[key] = series.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels):
+        buckets = self.buckets[name]
+        series = self.series[name]
+        key = tuple(labels.items())
+        counts = series.get(key)
+        if counts is None:
+            counts = series[key] = [0] * (len(buckets) + 3)  # +Inf bucket, sum, count
+        counts[bisect.bisect_left(buckets, value)] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+    @staticmethod
+    def _labels(labels, extra=()) -> str:
+        pairs = tuple(labels) + tuple(extra)
+        if not pairs:
+            return ""
+        quoted = []
+        for name, value in pairs:
+            value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            quoted.append(f'{name}="{value}"')
+        return "{" + ",".join(quoted) + "}"
+
+    def render(self) -> str:
+        lines = []
+        for name, (kind, help) in self.meta.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "gauge":
+                try:
+                    value = self.gauges[name]()
+                except Exception:
+                    logger.exception("Metric %s failed", name)
+                    continue
+                values = value.items() if isinstance(value, dict) else [((), value)]
+                for labels, number in values:
+                    lines.append(f"{name}{self._labels(labels)} {number}")
+            elif kind == "counter":
+                for labels, number in self.series[name].items():
+                    lines.append(f"{name}{self._labels(labels)} {number}")
+            else:
+                bounds = self.buckets[name] + ("+Inf",)
+                for labels, counts in self.series[name].items():
+                    total = 0
+                    for bound, count in zip(bounds, counts):
+                        total += count
+                        lines.append(f"{name}_bucket{self._labels(labels, [('le', bound)])} {total}")
+                    lines.append(f"{name}_sum{self._labels(labels)} {counts[-2]:.6f}")
+                    lines.append(f"{name}_count{self._labels(labels)} {counts[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+metrics.histogram("bot_handler_seconds", "Handler callback latency by kind (command, callback, ...) and handler.")
+metrics.counter("bot_handler_errors_total", "Handler callbacks that raised, by kind and handler.")
+metrics.histogram("bot_update_seconds", "Time from an update getting a processing slot to all its handlers finishing.")
+metrics.counter("bot_updates_total", "Updates processed, by update type.")
+metrics.histogram("bot_api_seconds", "Bot API call latency by method.")
+metrics.counter("bot_api_calls_total", "Bot API calls by method and outcome (ok, retry_after, error).")
+metrics.histogram("bot_save_seconds", "Storage write time on the persistence thread, by mode (full, delta).")
+metrics.histogram("bot_snapshot_seconds", "Time the event loop spent snapshotting dirty state for a save.")
+metrics.counter("bot_save_bytes_total", "Bytes written by storage saves.")
+metrics.counter("bot_save_failures_total", "Storage saves that raised.")
+metrics.counter("bot_journal_failures_total", "Journal commits whose write or fsync raised.")
+metrics.histogram("bot_flush_seconds", "Write-behind flush time, including the data_lock wait and journal compaction.")
+metrics.counter("bot_drops_total", "Cards dropped, by chat.")
+metrics.counter("bot_claims_total", "Dropped cards claimed with /slime, by chat.")
+
+HANDLER_KINDS = {
+    CommandHandler: "command",
+    CallbackQueryHandler: "callback",
+    InlineQueryHandler: "inline",
+    MessageHandler: "message",
+    TypeHandler: "type",
+}
+
+
+def update_type(update) -> str:
+    if isinstance(update, Update):
+        for kind in ("message", "edited_message", "callback_query", "inline_query", "my_chat_member"):
+            if getattr(update, kind) is not None:
+                return kind
+    return "other"
 
 
-def load_data():
-    """Load JSON data from disk (synchronous)."""
-    if os.path.exists(DATA_FILE):
+def timed(kind: str, name: str, callback):
+    """Wrap a handler callback so its latency (and failures) are recorded."""
+
+    @functools.wraps(callback)
+    async def run(update, context):
+        started = time.perf_counter()
         try:
-            with open(DATA_FILE, "r", encoding="utf-8") as f:
-                obj = json.load(f)
-        except Exception as e:
-            logger.exception("Failed to load data file, starting with defaults: %s", e)
-            obj = {}
+            return await callback(update, context)
+        except Exception:
+            metrics.inc("bot_handler_errors_total", kind=kind, handler=name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.observe("bot_handler_seconds", elapsed, kind=kind, handler=name)
+            slow_updates.note(f"{kind} {name}", started, elapsed)
+
+    return run
+
+
+class UpdateQueue(asyncio.Queue):
+    """Application.update_queue that counts the updates put on it (for the backlog gauge)."""
+
+    def __init__(self):
+        super().__init__()
+        self.received = 0
+
+    def _put(self, item):
+        if isinstance(item, Update):
+            self.received += 1
+        super()._put(item)
+
+
+class MeteredProcessor(SimpleUpdateProcessor):
+    """Default update processor that times each update and tracks how many are in flight."""
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self.started = 0
+        self.finished = 0
+
+    async def do_process_update(self, update, coroutine):
+        self.started += 1
+        started = time.perf_counter()
+        record = slow_updates.begin(update)
+        try:
+            await coroutine
+        finally:
+            slow_updates.end(record)
+            self.finished += 1
+            kind = update_type(update)
+            metrics.observe("bot_update_seconds", time.perf_counter() - started, type=kind)
+            metrics.inc("bot_updates_total", type=kind)
+
+
+class MeteredRequest(HTTPXRequest):
+    """HTTPXRequest that counts and times every Bot API call by method."""
+
+    async def _timed(self, method: str, call):
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            return await call
+        except RetryAfter:
+            outcome = "retry_after"
+            raise
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.observe("bot_api_seconds", elapsed, method=method)
+            slow_updates.note(f"api {method} ({outcome})", started, elapsed)
+            metrics.inc("bot_api_calls_total", method=method, outcome=outcome)
+
+    async def post(self, url, *args, **kwargs):
+        return await self._timed(url.rsplit("/", 1)[-1], super().post(url, *args, **kwargs))
+
+    async def retrieve(self, url, *args, **kwargs):
+        return await self._timed("download", super().retrieve(url, *args, **kwargs))
+
+
+def instrument(application: Application):
+    """Time every registered handler and expose the update backlog as gauges."""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            kind = HANDLER_KINDS.get(type(handler), "other")
+            if isinstance(handler, CommandHandler):
+                name = min(handler.commands)
+            else:
+                name = handler.callback.__name__
+            handler.callback = timed(kind, name, handler.callback)
+    queue, processor = application.update_queue, application.update_processor
+    if isinstance(queue, UpdateQueue) and isinstance(processor, MeteredProcessor):
+        metrics.gauge(
+            "bot_update_queue_depth",
+            "Updates received but not yet being handled (queued or waiting for a processing slot).",
+            lambda: queue.received - processor.started,
+        )
+        metrics.gauge(
+            "bot_updates_in_flight", "Updates being handled right now.",
+            lambda: processor.started - processor.finished,
+        )
+
+
+async def metrics_route(headers, body):
+    return 200, metrics.render()
+
+
+metrics_server = None
+
+
+async def start_metrics(application: Application):
+    """Serve /metrics (and /healthz) on METRICS_LISTEN:METRICS_PORT when METRICS_PORT is set."""
+    global metrics_server
+    if not METRICS_PORT or metrics_server is not None:
+        return
+    metrics_server = WebhookServer(application, METRICS_LISTEN, METRICS_PORT)
+    metrics_server.route("GET", "/metrics", metrics_route)
+    await metrics_server.start()
+
+
+async def stop_metrics():
+    global metrics_server
+    server, metrics_server = metrics_server, None
+    if server is not None:
+        await server.stop()
+
+
+# ----------------- PROFILING -----------------
+# A sampling profiler for the running process (/profile) and a watchdog that
+# logs updates slower than SLOW_UPDATE_MS. Both read sys._current_frames()
+# from a helper thread, so the handlers themselves are never traced.
+PROFILE_INTERVAL = 0.005  # seconds between /profile samples
+PROFILE_MAX_SECONDS = 120
+PROFILE_TOP = 15  # functions listed in the /profile report
+# leaf frames of a thread that is waiting, not working
+IDLE_FRAMES = ("selectors.py:", "threading.py:", "queue.py:", "thread.py:_worker")
+
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    # co_qualname (Class.method) is 3.11+; 3.10 only has the bare name
+    return f"{os.path.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def fold(frame, limit: int = 128):
+    """A frame's call stack as labels, outermost first."""
+    labels = []
+    while frame is not None and len(labels) < limit:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+def is_idle(labels) -> bool:
+    return not labels or labels[-1].startswith(IDLE_FRAMES)
+
+
+def sample_threads(seconds: float, interval: float = PROFILE_INTERVAL):
+    """
+    Sample every other thread's stack for `seconds` (runs on a helper thread).
+    Returns ({"thread;frame;...;frame": samples}, number of sampling rounds).
+    """
+    me = threading.get_ident()
+    stacks = Counter()
+    rounds = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident != me:
+                stacks[";".join([names.get(ident, str(ident))] + fold(frame))] += 1
+        rounds += 1
+        time.sleep(interval)
+    return stacks, rounds
+
+
+def profile_report(stacks, rounds: int, interval: float = PROFILE_INTERVAL, top: int = PROFILE_TOP):
+    """Busy share per thread plus the hottest functions (self and inclusive) over the busy samples."""
+    busy = Counter()
+    total = Counter()
+    own = Counter()
+    inclusive = Counter()
+    for stack, count in stacks.items():
+        thread, *labels = stack.split(";")
+        total[thread] += count
+        if is_idle(labels):
+            continue
+        busy[thread] += count
+        own[labels[-1]] += count
+        for label in set(labels):
+            inclusive[label] += count
+    lines = [f"{rounds} samples, {interval * 1000:g} ms apart"]
+    for thread, count in total.most_common():
+        lines.append(f"{thread}: busy {busy[thread] * 100 / count:.0f}% (~{busy[thread] * interval:.2f} s)")
+    samples = sum(busy.values()) or 1
+    lines.append("")
+    lines.append("self    total   function")
+    for label, count in own.most_common(top):
+        lines.append(f"{count * 100 / samples:5.1f}%  {inclusive[label] * 100 / samples:5.1f}%  {label}")
+    return "\n".join(lines)
+
+
+class SlowUpdates:
+    """
+    Log updates whose handling takes longer than `threshold` seconds.
+
+    While an update is in flight its handlers, Bot API calls, journal commits
+    and flushes note their timings on it (through a context variable). A
+    watchdog thread samples the event-loop thread's stack every `interval`
+    seconds while an update has been running for over half the threshold, so
+    the log shows where a slow update spent its time: in Python code on the
+    loop, or waiting (an idle loop means the update was awaiting I/O or a lock).
+    """
+
+    def __init__(self, threshold: float, interval: float = 0.01):
+        self.threshold = threshold
+        self.interval = interval
+        self.active = {}  # id(record) -> record of an update in flight
+        self.current = contextvars.ContextVar("slow_update", default=None)
+        self.loop_thread = None
+        self.tick = threading.Event()  # never set; waiting on it reads as idle in /profile
+        self.logged = 0
+
+    def begin(self, update):
+        if self.threshold <= 0:
+            return None
+        if self.loop_thread is None:
+            self.loop_thread = threading.get_ident()
+            threading.Thread(target=self._watch, name="slow-update-watchdog", daemon=True).start()
+        record = {"update": update, "started": time.perf_counter(), "events": [], "samples": Counter()}
+        self.active[id(record)] = record
+        record["token"] = self.current.set(record)
+        return record
+
+    def note(self, label: str, started: float, elapsed: float):
+        record = self.current.get()
+        if record is not None:
+            record["events"].append((started - record["started"], elapsed, label))
+
+    def end(self, record):
+        if record is None:
+            return
+        self.active.pop(id(record), None)
+        self.current.reset(record["token"])
+        elapsed = time.perf_counter() - record["started"]
+        if elapsed >= self.threshold:
+            self.logged += 1
+            logger.warning("Slow update %s took %.0f ms\n%s", describe_update(record["update"]), elapsed * 1000,
+                           self.timeline(record))
+
+    def timeline(self, record, top: int = 5, depth: int = 12) -> str:
+        lines = [f"  +{offset * 1000:7.1f} ms  {elapsed * 1000:8.1f} ms  {label}"
+                 for offset, elapsed, label in sorted(record["events"])]
+        samples = dict(record["samples"])
+        if samples:
+            lines.append(f"  event loop while slow ({sum(samples.values())} samples, {self.interval * 1000:g} ms apart):")
+            for stack, count in sorted(samples.items(), key=lambda item: -item[1])[:top]:
+                labels = stack.split(";")
+                where = "idle (awaiting I/O or a lock)" if is_idle(labels) else " > ".join(labels[-depth:])
+                lines.append(f"  ~{count * self.interval * 1000:7.0f} ms  {where}")
+        return "\n".join(lines)
+
+    def _watch(self):
+        while True:
+            now = time.perf_counter()
+            suspects = [record for record in list(self.active.values())
+                        if now - record["started"] >= self.threshold / 2]
+            if not suspects:
+                self.tick.wait(min(self.threshold / 4, 0.05))
+                continue
+            frame = sys._current_frames().get(self.loop_thread)
+            stack = ";".join(fold(frame)) if frame is not None else ""
+            del frame
+            for record in suspects:
+                record["samples"][stack] += 1
+            self.tick.wait(self.interval)
+
+
+def describe_update(update) -> str:
+    """One-line summary of an update for logs."""
+    if not isinstance(update, Update):
+        return repr(update)[:80]
+    kind = update_type(update)
+    user = update.effective_user.id if update.effective_user else "-"
+    chat = update.effective_chat.id if update.effective_chat else "-"
+    if update.callback_query:
+        what = update.callback_query.data
+    elif update.inline_query:
+        what = update.inline_query.query
     else:
+        what = update.effective_message.text if update.effective_message else ""
+    return f"{update.update_id} ({kind} {(what or '')[:40]!r}, user {user}, chat {chat})"
+
+
+slow_updates = SlowUpdates(SLOW_UPDATE_MS / 1000)
+
+
+# ----------------- MEMORY -----------------
+# Approximate deep sizes of the in-memory state for /memory, plus optional
+# tracemalloc snapshots whose differences point at growing allocation sites.
+MEMORY_TOP_USERS = 10
+MEMORY_TRACE_FRAMES = 1  # frames kept per traced allocation (1 = group by line)
+MEMORY_TOP_DIFFS = 10
+# never part of the state being measured (and they reach far beyond it)
+UNSIZED = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType,
+           types.CodeType, types.FrameType)
+INDEX_NAMES = ("catalog_search", "catalog_ids", "catalog_movies", "drops", "harem_movies", "harem_ids",
+               "inline_results", "tops_pages", "name_cache")
+
+
+def deep_size(obj, seen) -> int:
+    """Bytes reachable from `obj` that are not in `seen` (object ids); adds what it counts to `seen`."""
+    size = 0
+    pending = [obj]
+    while pending:
+        item = pending.pop()
+        if id(item) in seen or isinstance(item, UNSIZED):
+            continue
+        seen.add(id(item))
+        size += sys.getsizeof(item)
+        pending.extend(gc.get_referents(item))
+    return size
+
+
+def memory_usage():
+    """(current RSS or None where /proc is unavailable, peak RSS) in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE"), peak
+    except (OSError, ValueError, IndexError):
+        return None, peak
+
+
+async def memory_breakdown(top: int = MEMORY_TOP_USERS, chunk: int = 2000):
+    """
+    Size every top-level key of `data`, the derived indexes and the biggest
+    users. An object shared by several rows is counted once, in the first
+    one. Walks on the event loop and yields every `chunk` entries; entries
+    are collected first, so a change made meanwhile is seen or missed but
+    never breaks the walk. Lazy users count only the records in memory.
+    """
+    seen = set()
+    sizes = {}
+    users = []  # heap of (size, user_key)
+    for kind in list(data):
+        value = data[kind]
+        if isinstance(value, LazyUsers):
+            entries = value.loaded_items()
+        elif isinstance(value, dict):
+            entries = list(value.items())
+        elif isinstance(value, list):
+            entries = [(None, item) for item in value]
+        else:
+            sizes[kind] = deep_size(value, seen)
+            continue
+        total = sys.getsizeof(value) if not isinstance(value, LazyUsers) else 0
+        seen.add(id(value))
+        for i, (key, entry) in enumerate(entries):
+            size = deep_size(entry, seen) + (deep_size(key, seen) if key is not None else 0)
+            total += size
+            if kind == "users":
+                if len(users) < top:
+                    heapq.heappush(users, (size, key))
+                elif size > users[0][0]:
+                    heapq.heapreplace(users, (size, key))
+            if i % chunk == chunk - 1:
+                await asyncio.sleep(0)
+        sizes[kind] = total
+    for name in INDEX_NAMES:
+        sizes[f"index:{name}"] = deep_size(globals()[name], seen)
+        await asyncio.sleep(0)
+    return sizes, sorted(users, reverse=True)
+
+
+class MemoryTrace:
+    """tracemalloc on demand: start(), then diff() against the previous snapshot, stop()."""
+
+    def __init__(self):
+        self.snapshot = None
+        self.taken_at = None
+
+    @property
+    def active(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    @staticmethod
+    def _take():
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        ))
+
+    async def start(self, frames: int = MEMORY_TRACE_FRAMES):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self.snapshot = await asyncio.to_thread(self._take)
+        self.taken_at = time.time()
+
+    async def diff(self, top: int = MEMORY_TOP_DIFFS):
+        """(seconds since the previous snapshot, total bytes diff, top StatisticDiffs); the new snapshot replaces it."""
+        current = await asyncio.to_thread(self._take)
+        stats = await asyncio.to_thread(current.compare_to, self.snapshot, "lineno")
+        since = time.time() - self.taken_at
+        self.snapshot, self.taken_at = current, time.time()
+        return since, sum(stat.size_diff for stat in stats), stats[:top]
+
+    def stop(self):
+        self.snapshot = self.taken_at = None
+        tracemalloc.stop()
+
+
+memory_trace = MemoryTrace()
+
+
+# ----------------- STORAGE -----------------
+# top-level keys whose entries are saved (and snapshotted) one by one
+KEYED_KINDS = ("users", "groups", "group_messages", "dropped_cards")
+
+
+def freeze(value):
+    """Deep copy of JSON-like data; much cheaper than copy.deepcopy for dicts and lists."""
+    if isinstance(value, dict):
+        return {k: freeze(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [freeze(v) for v in value]
+    return value
+
+
+_json_decoder = json.JSONDecoder()
+_JSON_WS = re.compile(r"[ \t\n\r]*")
+
+
+def _utf8_len(s: str) -> int:
+    return len(s) if s.isascii() else len(s.encode("utf-8"))
+
+
+def scan_json(path: str, nested=("users",), on_entry=None, chunk_size: int = 1 << 22):
+    """
+    Stream the top-level object of a JSON file with bounded memory.
+
+    Returns {key: (start, end)} byte spans of every top-level value. For the
+    objects named in `nested`, on_entry(kind, key, start, end, value) is called
+    for each entry instead of materializing the whole object. Values are parsed
+    by the C decoder one at a time; raises ValueError on malformed input.
+    """
+    spans = {}
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    buf = ""
+    pos = 0
+    mark_i = mark_b = 0  # buf[mark_i] sits at byte offset mark_b
+    eof = False
+
+    def offset(i):
+        nonlocal mark_i, mark_b
+        if i < mark_i:
+            return mark_b - _utf8_len(buf[i:mark_i])
+        mark_b += _utf8_len(buf[mark_i:i])
+        mark_i = i
+        return mark_b
+
+    def more():
+        nonlocal buf, pos, eof, mark_i, mark_b
+        if eof:
+            raise ValueError("unexpected end of JSON document")
+        chunk = f.read(chunk_size)
+        if not chunk:
+            eof = True
+            buf += decoder.decode(b"", final=True)
+            return
+        mark_b = offset(pos)
+        buf = buf[pos:] + decoder.decode(chunk)
+        pos = mark_i = 0
+
+    def peek():
+        nonlocal pos
+        while True:
+            pos = _JSON_WS.match(buf, pos).end()
+            if pos < len(buf):
+                return buf[pos]
+            if eof:
+                raise ValueError("unexpected end of JSON document")
+            more()
+
+    def expect(ch):
+        nonlocal pos
+        if peek() != ch:
+            raise ValueError(f"expected {ch!r} at byte {offset(pos)}")
+        pos += 1
+
+    def read_key():
+        nonlocal pos
+        if peek() != '"':
+            raise ValueError(f"expected a key at byte {offset(pos)}")
+        while True:
+            try:
+                key, pos = json.decoder.scanstring(buf, pos + 1)
+                break
+            except json.JSONDecodeError:
+                if eof:
+                    raise ValueError(f"unterminated key at byte {offset(pos)}")
+                more()
+        expect(":")
+        peek()
+        return key
+
+    def read_value():
+        while True:
+            try:
+                value, end = _json_decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError as e:
+                if eof:
+                    raise ValueError(f"invalid value at byte {offset(pos)}: {e.msg}")
+                more()
+                continue
+            if end == len(buf) and not eof:
+                more()  # a trailing number may continue in the next chunk
+                continue
+            return value, end
+
+    def read_members(handle):
+        nonlocal pos
+        expect("{")
+        if peek() == "}":
+            pos += 1
+            return
+        while True:
+            handle(read_key())
+            if peek() == ",":
+                pos += 1
+                continue
+            expect("}")
+            return
+
+    def entry(kind):
+        def handle(key):
+            nonlocal pos
+            value, end = read_value()
+            start = offset(pos)
+            stop = start + _utf8_len(buf[pos:end])
+            pos = end
+            if on_entry is not None:
+                on_entry(kind, key, start, stop, value)
+        return handle
+
+    def top_level(kind):
+        nonlocal pos
+        start = offset(pos)
+        if kind in nested and buf[pos] == "{":
+            read_members(entry(kind))
+        else:
+            _, pos = read_value()
+        spans[kind] = (start, offset(pos))
+
+    def expect_end():
+        nonlocal pos
+        while True:
+            pos = _JSON_WS.match(buf, pos).end()
+            if pos < len(buf):
+                raise ValueError(f"unexpected data after the document at byte {offset(pos)}")
+            if eof:
+                return
+            more()
+
+    with open(path, "rb") as f:
+        read_members(top_level)
+        expect_end()
+    return spans
+
+
+def validate_json(path: str, limit: int = 100):
+    """Check a data.json with bounded memory; returns a list of problems (empty if fine)."""
+    problems = []
+    users = 0
+
+    def check_user(kind, key, start, end, user):
+        nonlocal users
+        users += 1
+        ok = isinstance(user, dict) and isinstance(user.get("coins", 0), int) and isinstance(user.get("harem", []), list)
+        if not ok and len(problems) < limit:
+            problems.append(f"user {key} at byte {start}: unexpected record shape")
+
+    try:
+        spans = scan_json(path, on_entry=check_user)
+    except (OSError, ValueError) as e:
+        return [str(e)]
+    if "users" not in spans:
+        problems.append("missing top-level 'users' object")
+    if "cards" in spans:
+        start, end = spans["cards"]
+        with open(path, "rb") as f:
+            f.seek(start)
+            cards = json.loads(f.read(end - start))
+        if not isinstance(cards, list) or not all(isinstance(card, dict) and "id" in card for card in cards):
+            problems.append("'cards' is not a list of cards")
+    logger.info("Checked %s: %d users, %d top-level keys, %d problems", path, users, len(spans), len(problems))
+    return problems
+
+
+class JsonStorage:
+    """
+    Whole-document storage: the classic data.json file.
+
+    Every entity is kept as an encoded fragment, so a save only re-encodes what
+    changed and then streams the fragments into a fresh file. In lazy mode user
+    fragments are (offset << 32 | length) references into the current file,
+    kept in a sidecar index so a restart only reads the keys it needs.
+    """
+
+    name = "json"
+    SIDECAR_EVERY = 60  # seconds between sidecar index refreshes while running
+
+    def __init__(self, path: str, lazy: bool = False):
+        self.path = path
+        self.lazy = lazy
+        self._fragments = {}  # kind -> encoded JSON, or {key: encoded JSON | packed ref} for keyed kinds
+        self._view = (None, {})  # (reader on the loop thread, user index) of the current file
+        self._view_lock = threading.Lock()  # a reader is only closed once no read is using it
+        self._sidecar_at = 0.0
+        self._spans = {}
+
+    @staticmethod
+    def _encode_kind(kind, value):
+        if kind in KEYED_KINDS and isinstance(value, dict):
+            return {k: json.dumps(v, ensure_ascii=False) for k, v in value.items()}
+        return json.dumps(value, ensure_ascii=False)
+
+    def load(self):
+        self._fragments = {}
+        self._publish((None, {}))
+        if not os.path.exists(self.path):
+            return {}
+        if self.lazy:
+            return self._load_lazy()
+        # one user at a time rather than one json.load() call, so a load on a
+        # worker thread (restore) lets the event loop run in between
+        users = {}
+        spans = scan_json(self.path, on_entry=lambda kind, key, start, end, value: users.__setitem__(key, value))
+        obj = {}
+        with open(self.path, "rb") as f:
+            for kind, (start, end) in spans.items():
+                if kind == "users":
+                    obj[kind] = users
+                else:
+                    f.seek(start)
+                    obj[kind] = json.loads(f.read(end - start))
+        self._fragments = {kind: self._encode_kind(kind, value) for kind, value in obj.items()}
+        return obj
+
+    def _load_lazy(self):
+        index, spans = self._read_sidecar()
+        if index is None:
+            index = {}
+
+            def remember(kind, key, start, end, value):
+                index[key] = (start << 32) | (end - start)
+
+            spans = scan_json(self.path, on_entry=remember)
+            self._write_sidecar(index, spans)
+        self._publish((open(self.path, "rb"), index))
+        self._spans = spans
         obj = {}
+        with open(self.path, "rb") as f:
+            for kind, (start, end) in spans.items():
+                if kind == "users":
+                    obj[kind] = LazyUsers(self)
+                    self._fragments[kind] = index
+                    continue
+                f.seek(start)
+                obj[kind] = json.loads(f.read(end - start))
+                self._fragments[kind] = self._encode_kind(kind, obj[kind])
+        logger.info("Indexed %d users in %s; records load on first access", len(index), self.path)
+        return obj
+
+    def _read_sidecar(self):
+        try:
+            with open(self.path + ".idx", "r", encoding="utf-8") as f:
+                header = json.loads(f.readline())
+                st = os.stat(self.path)
+                if header.get("size") != st.st_size or header.get("mtime_ns") != st.st_mtime_ns:
+                    return None, None
+                index = {}
+                for line in f:
+                    key, packed = line.rstrip("\n").rsplit("\t", 1)
+                    index[json.loads(key)] = int(packed)
+            return index, {k: tuple(v) for k, v in header["spans"].items()}
+        except (OSError, ValueError, KeyError):
+            return None, None
+
+    def _write_sidecar(self, index, spans):
+        st = os.stat(self.path)
+        tmp = self.path + ".idx.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"size": st.st_size, "mtime_ns": st.st_mtime_ns, "spans": spans}) + "\n")
+            f.writelines(f"{json.dumps(key)}\t{packed}\n" for key, packed in index.items())
+        os.replace(tmp, self.path + ".idx")
+        self._sidecar_at = time.monotonic()
+
+    def adopt(self, obj):
+        """Pick up top-level keys that load_data() filled in with defaults."""
+        for kind, value in obj.items():
+            if kind not in self._fragments:
+                self._fragments[kind] = {} if isinstance(value, LazyUsers) else self._encode_kind(kind, value)
+
+    def new_users(self):
+        return LazyUsers(self, backed=False) if self.lazy else {}
+
+    # --- lazy user access (event loop thread) ---
+    def has_user(self, user_key: str) -> bool:
+        return user_key in self._view[1]
+
+    def user_keys(self):
+        return list(self._view[1])
+
+    def count_users(self) -> int:
+        return len(self._view[1])
+
+    def load_user(self, user_key: str):
+        with self._view_lock:
+            reader, index = self._view
+            packed = index.get(user_key)
+            if packed is None:
+                return None
+            reader.seek(packed >> 32)
+            raw = reader.read(packed & 0xFFFFFFFF)
+        return json.loads(raw)
+
+    def _publish(self, view):
+        """Switch the loop's reads to `view` and close the reader it replaces."""
+        with self._view_lock:
+            old, self._view = self._view[0], view
+        if old is not None:
+            old.close()
+
+    def load_name(self, user_key: str):
+        # the record is one fragment: it is decoded, but not kept
+        user = self.load_user(user_key)
+        return None if user is None else (user.get("name"), user.get("name_at"))
+
+    # --- writes (persistence thread only) ---
+    def save(self, snapshot, dirty, full=False):
+        """
+        Apply a snapshot (see take_snapshot) and atomically rewrite the file.
+        Returns the number of bytes written.
+        """
+        if full:
+            self._fragments = {k: v for k, v in self._fragments.items() if k in snapshot}
+        for kind, value in snapshot.items():
+            if kind in KEYED_KINDS:
+                frags = self._fragments.get(kind)
+                if dirty[kind] is None or not isinstance(frags, dict):
+                    frags = {}
+                elif self.lazy and kind == "users":
+                    frags = dict(frags)  # the published index is read by the loop; never mutate it
+                for key, entry in value.items():
+                    if entry is None:
+                        frags.pop(key, None)
+                    else:
+                        frags[key] = json.dumps(entry, ensure_ascii=False)
+                self._fragments[kind] = frags
+            else:
+                self._fragments[kind] = json.dumps(value, ensure_ascii=False)
+
+        tmp = self.path + ".tmp"
+        src = open(self.path, "rb") if self.lazy and os.path.exists(self.path) else None
+        index, spans = {}, {}
+        try:
+            with open(tmp, "wb") as out:
+                out.write(b"{")
+                for i, (kind, frag) in enumerate(self._fragments.items()):
+                    out.write((",\n" if i else "").encode() + json.dumps(kind).encode() + b": ")
+                    start = out.tell()
+                    if isinstance(frag, dict):
+                        out.write(b"{")
+                        for j, (key, entry) in enumerate(frag.items()):
+                            out.write((",\n" if j else "\n").encode() + json.dumps(key).encode() + b": ")
+                            at = out.tell()
+                            if isinstance(entry, int):
+                                src.seek(entry >> 32)
+                                out.write(src.read(entry & 0xFFFFFFFF))
+                            else:
+                                out.write(entry.encode("utf-8"))
+                            if kind == "users":
+                                index[key] = (at << 32) | (out.tell() - at)
+                        out.write(b"\n}")
+                    else:
+                        out.write(frag.encode("utf-8"))
+                    spans[kind] = (start, out.tell())
+                out.write(b"}\n")
+                out.flush()
+                # the journal is pruned once this returns, so the snapshot must be on disk
+                os.fsync(out.fileno())
+                written = out.tell()
+            os.replace(tmp, self.path)
+        except Exception:
+            try:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+            except Exception:
+                pass
+            raise
+        finally:
+            if src is not None:
+                src.close()
+        if self.lazy:
+            self._fragments["users"] = index
+            self._publish((open(self.path, "rb"), index))
+            if time.monotonic() - self._sidecar_at >= self.SIDECAR_EVERY:
+                self._write_sidecar(index, spans)
+            self._spans = spans
+        return written
+
+    def close(self):
+        """Leave a fresh sidecar index behind for the next (lazy) start."""
+        if self.lazy and os.path.exists(self.path) and "users" in self._fragments:
+            self._write_sidecar(self._fragments["users"], self._spans)
+        self._publish((None, self._view[1]))
+
+    def export_json(self):
+        """Return the path of a JSON document holding the stored state."""
+        return self.path
+
+    def restore_file(self, path: str):
+        """Replace the stored state with the JSON document at `path`."""
+        os.replace(path, self.path)
+
+    def stage_restore(self, path: str):
+        """Parse the document at `path` with a storage of its own; this one is left alone."""
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path + ".idx")  # never trust an index left by an earlier attempt
+        staged = JsonStorage(path, self.lazy)
+        return staged.load(), staged
+
+    def install_restore(self, path: str, staged, obj):
+        """restore_file() for a document loaded by stage_restore(): take over its parsed state too."""
+        os.replace(path, self.path)
+        # the staged reader keeps pointing at the same file under its new name
+        self._fragments, self._spans = staged._fragments, staged._spans
+        self._publish(staged._view)
+        self._sidecar_at = 0.0  # the staged sidecar went by the old name: rewrite it on the next save
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path + ".idx")
+        if isinstance(obj.get("users"), LazyUsers):
+            obj["users"].store = self
+
+    def top_users(self, users, by: str, limit: int):
+        key = (lambda u: u.get("coins", 0)) if by == "coins" else (lambda u: len(u.get("harem", [])))
+        items = ((k, users.peek(k)) for k in users) if isinstance(users, LazyUsers) else users.items()
+        best = heapq.nlargest(limit, items, key=lambda kv: key(kv[1]))
+        return [(user_key, key(user)) for user_key, user in best]
+
+
+class LazyUsers(MutableMapping):
+    """
+    Lazy view of the stored users (SQLite table or indexed data.json). Records
+    are read on first access and then cached; the cache is the source of truth
+    until the next save. `backed=False` means the stored users are about to be
+    replaced wholesale (allclear).
+    """
+
+    def __init__(self, store, backed: bool = True):
+        self.store = store
+        self.backed = backed
+        self._cache = {}
+        self._new = set()  # cached keys that have no row yet
+        self._deleted = set()
+
+    def cached(self, key):
+        return self._cache.get(key)
+
+    def peek(self, key):
+        """Read a record without caching it (for whole-table scans)."""
+        if key in self._cache:
+            return self._cache[key]
+        return self.store.load_user(key)
+
+    def loaded_keys(self):
+        return set(self._cache) | self._deleted
+
+    def loaded_items(self):
+        return list(self._cache.items())
+
+    def name_of(self, key):
+        """(name, name_at) of a user without caching the record, or None when there is no such user."""
+        if key in self._cache:
+            user = self._cache[key]
+            return user.get("name"), user.get("name_at")
+        if not self.backed or key in self._deleted:
+            return None
+        return self.store.load_name(key)
+
+    def saved(self, keys):
+        """Bookkeeping after a save of `keys` (None: the whole table was replaced)."""
+        if keys is None:
+            self.backed = True
+            self._new.clear()
+        else:
+            self._new.difference_update(keys)
+
+    def __getitem__(self, key):
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        user = self.store.load_user(key) if self.backed and key not in self._deleted else None
+        if user is None:
+            raise KeyError(key)
+        self._cache[key] = user
+        return user
+
+    def __setitem__(self, key, value):
+        if key not in self._cache and not (self.backed and self.store.has_user(key)):
+            self._new.add(key)
+        self._deleted.discard(key)
+        self._cache[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._cache.pop(key, None)
+        self._new.discard(key)
+        self._deleted.add(key)
+
+    def __contains__(self, key):
+        if key in self._cache:
+            return True
+        return self.backed and key not in self._deleted and self.store.has_user(key)
+
+    def __iter__(self):
+        yield from list(self._cache)
+        if self.backed:
+            for key in self.store.user_keys():
+                if key not in self._cache and key not in self._deleted:
+                    yield key
+
+    def __len__(self):
+        stored = self.store.count_users() - len(self._deleted) if self.backed else 0
+        return stored + len(self._new)
+
+
+class SqliteStorage:
+    """
+    Per-entity SQLite storage in WAL mode. Saves only touch the rows in the
+    snapshot, in one transaction, with parameterized (cached) statements.
+    """
+
+    name = "sqlite"
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        coins INTEGER NOT NULL DEFAULT 0,
+        harem_size INTEGER NOT NULL DEFAULT 0,
+        harem_digest INTEGER,
+        fav_card TEXT,
+        last_daily TEXT,
+        last_slime TEXT,
+        extra TEXT NOT NULL DEFAULT '{}'
+    );
+    CREATE INDEX IF NOT EXISTS users_by_coins ON users(coins DESC);
+    CREATE INDEX IF NOT EXISTS users_by_harem_size ON users(harem_size DESC);
+    CREATE TABLE IF NOT EXISTS harem (
+        user_id INTEGER NOT NULL,
+        pos INTEGER NOT NULL,
+        instance_id TEXT,
+        body TEXT NOT NULL,
+        PRIMARY KEY (user_id, pos)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS harem_by_instance ON harem(instance_id);
+    CREATE TABLE IF NOT EXISTS cards (
+        pos INTEGER PRIMARY KEY,
+        id TEXT NOT NULL,
+        name TEXT,
+        movie TEXT,
+        rarity TEXT,
+        photo TEXT,
+        extra TEXT NOT NULL DEFAULT '{}'
+    );
+    CREATE INDEX IF NOT EXISTS cards_by_id ON cards(id);
+    CREATE INDEX IF NOT EXISTS cards_by_movie ON cards(movie);
+    CREATE INDEX IF NOT EXISTS cards_by_rarity ON cards(rarity);
+    CREATE TABLE IF NOT EXISTS groups (chat_id TEXT PRIMARY KEY, body TEXT NOT NULL);
+    CREATE TABLE IF NOT EXISTS group_messages (chat_id TEXT PRIMARY KEY, count INTEGER NOT NULL);
+    CREATE TABLE IF NOT EXISTS dropped_cards (chat_id TEXT PRIMARY KEY, body TEXT NOT NULL);
+    CREATE TABLE IF NOT EXISTS votes (
+        option TEXT NOT NULL,
+        pos INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        PRIMARY KEY (option, pos)
+    );
+    CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+    """
+    USER_COLUMNS = ("coins", "harem", "fav_card", "last_daily", "last_slime")
+    CARD_COLUMNS = ("id", "name", "movie", "rarity", "photo")
+
+    def __init__(self, path: str):
+        self.path = path
+        # the event loop reads through `conn`; the persistence thread writes through `writer`
+        self.writer = self._connect("FULL")
+        self.writer.executescript(self.SCHEMA)
+        if "harem_digest" not in {row[1] for row in self.writer.execute("PRAGMA table_info(users)")}:
+            # databases created before harem rows were appended in place; NULL means "rewrite once"
+            self.writer.execute("ALTER TABLE users ADD COLUMN harem_digest INTEGER")
+        self.conn = self._connect("NORMAL")
+
+    def _connect(self, synchronous: str):
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # FULL on the writer: the operation journal is pruned as soon as a save commits
+        conn.execute(f"PRAGMA synchronous={synchronous}")
+        return conn
+
+    # --- reads ---
+    def load(self):
+        return self._load(self.conn)
+
+    def _load(self, c):
+        obj = {"users": LazyUsers(self)}
+        obj["cards"] = [self._card_from_row(r) for r in c.execute(
+            "SELECT id, name, movie, rarity, photo, extra FROM cards ORDER BY pos")]
+        obj["groups"] = {k: json.loads(v) for k, v in c.execute("SELECT chat_id, body FROM groups")}
+        obj["group_messages"] = dict(c.execute("SELECT chat_id, count FROM group_messages"))
+        obj["dropped_cards"] = {k: json.loads(v) for k, v in c.execute("SELECT chat_id, body FROM dropped_cards")}
+        votes = {}
+        for option, user_id in c.execute("SELECT option, user_id FROM votes ORDER BY option, pos"):
+            votes.setdefault(option, []).append(user_id)
+        obj["votes"] = votes
+        for key, value in c.execute("SELECT key, value FROM settings"):
+            obj[key] = json.loads(value)
+        # options with no voters yet still need their (empty) list
+        for option in obj.get("vote_options", []):
+            votes.setdefault(option, [])
+        return obj
+
+    def adopt(self, obj):
+        """Defaults filled in by load_data() are written with the next save that touches them."""
+
+    def new_users(self):
+        return LazyUsers(self, backed=False)
+
+    def has_user(self, user_key: str) -> bool:
+        return self.conn.execute("SELECT 1 FROM users WHERE user_id = ?", (int(user_key),)).fetchone() is not None
+
+    def user_keys(self):
+        return [str(r[0]) for r in self.conn.execute("SELECT user_id FROM users")]
+
+    def count_users(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def load_user(self, user_key: str, conn=None):
+        c = conn or self.conn
+        row = c.execute(
+            "SELECT coins, fav_card, last_daily, last_slime, extra FROM users WHERE user_id = ?",
+            (int(user_key),),
+        ).fetchone()
+        if row is None:
+            return None
+        coins, fav_card, last_daily, last_slime, extra = row
+        user = json.loads(extra)
+        user.update({"coins": coins, "fav_card": fav_card, "last_daily": last_daily, "last_slime": last_slime})
+        user["harem"] = [json.loads(body) for (body,) in c.execute(
+            "SELECT body FROM harem WHERE user_id = ? ORDER BY pos", (int(user_key),))]
+        return user
+
+    def load_name(self, user_key: str):
+        row = self.conn.execute(
+            "SELECT json_extract(extra, '$.name'), json_extract(extra, '$.name_at') FROM users WHERE user_id = ?",
+            (int(user_key),),
+        ).fetchone()
+        return None if row is None else tuple(row)
+
+    def top_users(self, users, by: str, limit: int):
+        column = "coins" if by == "coins" else "harem_size"
+        return [(str(user_id), value) for user_id, value in self.conn.execute(
+            f"SELECT user_id, {column} FROM users ORDER BY {column} DESC LIMIT ?", (limit,))]
+
+    @classmethod
+    def _card_from_row(cls, row):
+        card = json.loads(row[-1])
+        card.update(zip(cls.CARD_COLUMNS, row[:-1]))
+        return card
+
+    # --- writes (persistence thread only) ---
+    def save(self, snapshot, dirty, full=False):
+        """
+        Write a snapshot (see take_snapshot) in one transaction. Keyed kinds hold
+        {key: entry | None}; a None key set in `dirty` replaces the whole table.
+        Returns the number of encoded bytes written.
+        """
+        c = self.writer
+        self._written = 0
+        c.execute("BEGIN")
+        try:
+            for kind, value in snapshot.items():
+                self._save_kind(kind, value, dirty[kind] is None)
+            c.execute("COMMIT")
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
+        return self._written
+
+    def _save_kind(self, kind, value, replace):
+        if kind == "users":
+            self._save_users(value, replace)
+        elif kind == "cards":
+            self._save_cards(value)
+        elif kind == "votes":
+            self._save_votes(value)
+        elif kind in ("groups", "dropped_cards"):
+            self._save_rows(kind, value, replace, lambda v: self._encode(v))
+        elif kind == "group_messages":
+            self._save_rows(kind, value, replace, int)
+        else:
+            self.writer.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (kind, self._encode(value)))
+
+    def _encode(self, value):
+        text = json.dumps(value, ensure_ascii=False)
+        self._written += len(text)
+        return text
+
+    def _save_users(self, users, replace):
+        c = self.writer
+        if replace:
+            c.execute("DELETE FROM harem")
+            c.execute("DELETE FROM users")
+        for user_key, user in users.items():
+            if user is None:
+                c.execute("DELETE FROM harem WHERE user_id = ?", (int(user_key),))
+                c.execute("DELETE FROM users WHERE user_id = ?", (int(user_key),))
+            else:
+                self._write_user(user_key, user)
+
+    def _write_user(self, user_key, user):
+        """
+        Write one user. Harems mostly grow at the end, so the stored rows are
+        kept when they are still a prefix of the new harem (checked against a
+        digest of the stored rows) and only the new positions are inserted; a
+        coin change touches the users row alone.
+        """
+        c = self.writer
+        user_id = int(user_key)
+        harem = user.get("harem", [])
+        stored = c.execute("SELECT harem_size, harem_digest FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        bodies = [json.dumps(card, ensure_ascii=False) for card in harem]
+        digest, prefix = hashlib.blake2b(digest_size=8), None
+        for pos, body in enumerate(bodies):
+            if stored and pos == stored[0]:
+                prefix = digest.copy()
+            digest.update(body.encode("utf-8") + b"\n")
+        if stored and stored[0] == len(bodies):
+            prefix = digest
+        keep = stored[0] if stored and prefix is not None and stored[1] == self._digest_value(prefix) else 0
+        extra = {k: v for k, v in user.items() if k not in self.USER_COLUMNS}
+        c.execute(
+            "INSERT OR REPLACE INTO users (user_id, coins, harem_size, harem_digest, fav_card, last_daily, last_slime, extra) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (user_id, int(user.get("coins", 0)), len(harem), self._digest_value(digest), user.get("fav_card"),
+             user.get("last_daily"), user.get("last_slime"), self._encode(extra)),
+        )
+        if not keep and stored:
+            c.execute("DELETE FROM harem WHERE user_id = ?", (user_id,))
+        self._written += sum(len(body) for body in bodies[keep:])
+        c.executemany(
+            "INSERT INTO harem (user_id, pos, instance_id, body) VALUES (?, ?, ?, ?)",
+            [(user_id, pos, instance_id(harem[pos]), bodies[pos]) for pos in range(keep, len(harem))],
+        )
+
+    @staticmethod
+    def _digest_value(digest):
+        return int.from_bytes(digest.digest(), "big", signed=True)  # fits an SQLite INTEGER
+
+    def _save_cards(self, cards):
+        c = self.writer
+        c.execute("DELETE FROM cards")
+        c.executemany(
+            "INSERT INTO cards (pos, id, name, movie, rarity, photo, extra) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (pos, *(card.get(col) for col in self.CARD_COLUMNS),
+                 self._encode({k: v for k, v in card.items() if k not in self.CARD_COLUMNS}))
+                for pos, card in enumerate(cards)
+            ],
+        )
+
+    def _save_votes(self, votes):
+        c = self.writer
+        c.execute("DELETE FROM votes")
+        c.executemany(
+            "INSERT INTO votes (option, pos, user_id) VALUES (?, ?, ?)",
+            [(option, pos, int(uid)) for option, voters in votes.items() for pos, uid in enumerate(voters)],
+        )
+
+    def _save_rows(self, table, rows, replace, encode):
+        c = self.writer
+        column = "count" if table == "group_messages" else "body"
+        if replace:
+            c.execute(f"DELETE FROM {table}")
+        for key, value in rows.items():
+            if value is None:
+                c.execute(f"DELETE FROM {table} WHERE chat_id = ?", (key,))
+            else:
+                c.execute(f"INSERT OR REPLACE INTO {table} (chat_id, {column}) VALUES (?, ?)", (key, encode(value)))
+
+    def export_json(self):
+        """Dump the database to a JSON file next to it and return that path (persistence thread)."""
+        path = self.path + ".export.json"
+        obj = self._load(self.writer)
+        obj.pop("users")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write('{"users": {')
+            for i, (user_id,) in enumerate(self.writer.execute("SELECT user_id FROM users").fetchall()):
+                user = self.load_user(str(user_id), self.writer)
+                f.write(("," if i else "") + json.dumps(str(user_id)) + ": " + json.dumps(user, ensure_ascii=False))
+            f.write("}")
+            for key, value in obj.items():
+                f.write(", " + json.dumps(key) + ": " + json.dumps(value, ensure_ascii=False))
+            f.write("}")
+        return path
+
+    def import_file(self, path: str, batch: int = 1000):
+        """
+        Replace everything stored with the JSON document at `path`, streaming
+        users in batches so memory stays bounded. Returns the user count.
+        """
+        c = self.writer
+        self._written = 0
+        pending = {}
+        count = 0
+
+        def add_user(kind, key, start, end, user):
+            nonlocal count
+            pending[key] = user
+            count += 1
+            if len(pending) >= batch:
+                self._save_users(pending, False)
+                pending.clear()
+
+        c.execute("BEGIN")
+        try:
+            c.execute("DELETE FROM harem")
+            c.execute("DELETE FROM users")
+            c.execute("DELETE FROM settings")
+            spans = scan_json(path, on_entry=add_user)
+            self._save_users(pending, False)
+            with open(path, "rb") as f:
+                for kind, (start, end) in spans.items():
+                    if kind == "users":
+                        continue
+                    f.seek(start)
+                    self._save_kind(kind, json.loads(f.read(end - start)), True)
+            c.execute("COMMIT")
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
+        return count
+
+    def restore_file(self, path: str):
+        self.import_file(path)
+        os.remove(path)
+
+    def stage_restore(self, path: str):
+        """Parse the JSON document at `path` without touching the database."""
+        staged = JsonStorage(path)
+        return staged.load(), staged
+
+    def install_restore(self, path: str, staged, obj):
+        """restore_file() for a document loaded by stage_restore(); users are read back lazily."""
+        self.restore_file(path)
+        # the parsed records are already in the table: on the loop they are read through `conn`
+        obj["users"] = LazyUsers(self)
+
+    def close(self):
+        self.conn.close()
+        self.writer.close()
+
+
+def open_storage():
+    if STORAGE_BACKEND == "sqlite":
+        return SqliteStorage(DATA_FILE)
+    return JsonStorage(DATA_FILE, lazy=LAZY_LOAD)
+
+
+def migrate_json_to_sqlite(json_path: str, db_path: str):
+    """One-shot import of a legacy data.json into a SQLite database."""
+    store = SqliteStorage(db_path)
+    count = store.import_file(json_path)
+    store.close()
+    logger.info("Migrated %d users from %s to %s", count, json_path, db_path)
+
+
+# ----------------- GLOBAL STATE -----------------
+data_lock = asyncio.Lock()  # used to serialize writes
+storage = open_storage()
+# single worker: encoding, file writes and the SQLite writer connection stay on one thread
+persist_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="persist")
+persist_stats = {"saves": 0, "snapshot_ms": 0.0, "write_ms": 0.0, "bytes": 0, "total_write_ms": 0.0}
+
+
+CHAT_KINDS = ("group_messages", "dropped_cards")
+
+
+class ChatCheckpoint:
+    """
+    Per-chat message counters and active drops, saved apart from the main data.
+
+    They change on every group message, so instead of going through the
+    write-behind snapshot (and a rewrite of data.json) they are dumped as one
+    small file, without fsync, at most once per flush interval. A crash costs
+    a few counted messages or an unclaimed drop, never user data.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.dirty = False
+
+    def load(self, obj):
+        """Replace the chat kinds in a freshly loaded `obj` with the checkpoint, if any."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            # first start (or after a restore): adopt what the main data had
+            self.dirty = True
+            return
+        except ValueError:
+            logger.warning("Ignoring unreadable chat checkpoint %s", self.path)
+            self.dirty = True
+            return
+        for kind in CHAT_KINDS:
+            obj[kind] = saved.get(kind, {})
+
+    def discard(self):
+        """Forget the checkpoint so the next load_data() takes the main data's copy."""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def mark(self):
+        self.dirty = True
+
+    async def save(self):
+        if not self.dirty:
+            return
+        self.dirty = False
+        # counters are ints and drops are replaced, never edited: shallow copies suffice
+        snapshot = {kind: dict(data.get(kind, {})) for kind in CHAT_KINDS}
+        try:
+            await asyncio.get_running_loop().run_in_executor(persist_executor, self._write, snapshot)
+        except Exception:
+            self.dirty = True
+            logger.exception("Failed to checkpoint chat counters")
+
+    def _write(self, snapshot):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
 
-    default = {
-        "users": {},  # keys are strings of user_id
+chat_checkpoint = ChatCheckpoint(DATA_FILE + ".chats")
+
+
+SERIAL_START = 10_000  # first harem instance serial; older ids used random 1000-9999
+
+
+def default_data():
+    return {
+        "users": storage.new_users(),  # keys are strings of user_id
         "groups": {},  # keys are strings of chat_id
         "cards": [],  # list of card dicts
         "sudos": [],  # list of ints
@@ -77,9 +1649,43 @@ def load_data():
         "vote_options": [],
         "votes": {},
         "dropped_cards": {},
+        "retired_cards": {},  # card id -> metadata of deleted cards still owned
+        "next_serial": SERIAL_START,  # instance serial allocator
+        "next_card": 1,  # catalog id allocator (card_<n>)
+        "broadcast": None,  # state of a running /broadcast
     }
 
-    for k, v in default.items():
+
+def load_data(strict: bool = False):
+    """Load state through the storage backend (synchronous). `strict` raises instead of starting empty."""
+    try:
+        obj = bulk_load(storage.load)
+    except Exception as e:
+        if strict:
+            raise
+        logger.exception("Failed to load data file, starting with defaults: %s", e)
+        obj = {}
+
+    fill_defaults(obj)
+    chat_checkpoint.load(obj)
+    storage.adopt(obj)
+    return obj
+
+
+def bulk_load(load, *args):
+    # millions of new objects would trigger repeated full collections, each
+    # holding the GIL (on a restore, the event loop) for a walk of the heap
+    gc.disable()
+    try:
+        obj = load(*args)
+        gc.freeze()  # the loaded state is long-lived: keep it out of later collections too
+    finally:
+        gc.enable()
+    return obj
+
+
+def fill_defaults(obj):
+    for k, v in default_data().items():
         if k not in obj:
             obj[k] = v
 
@@ -93,30 +1699,433 @@ def load_data():
     if "drop_count" not in obj or not isinstance(obj.get("drop_count"), int):
         obj["drop_count"] = DROP_COUNT
 
-    return obj
 
+# the stored state is loaded by main(): the one-shot CLI modes never read it
+data = default_data()
+
+
+def take_snapshot(dirty):
+    """
+    Copy the dirty parts of `data` on the event loop so the persistence thread
+    never reads live objects. Cost is proportional to the change.
+    Returns (snapshot, dirty, full) with `dirty` normalized to {kind: keys | None}.
+    """
+    full = dirty is None
+    if full:
+        # chat counters and drops live in their own checkpoint
+        dirty = dict.fromkeys(kind for kind in data if kind not in CHAT_KINDS)
+    snapshot = {}
+    normalized = {}
+    for kind, keys in dirty.items():
+        if kind not in data:
+            continue
+        value = data[kind]
+        if kind in KEYED_KINDS:
+            if keys is None and isinstance(value, LazyUsers) and value.backed:
+                # rows that were never loaded cannot differ from the table
+                keys = value.loaded_keys()
+            if keys is None:
+                snapshot[kind] = {k: freeze(v) for k, v in value.items()}
+            else:
+                snapshot[kind] = {k: freeze(value.get(k)) for k in keys}
+        else:
+            snapshot[kind] = freeze(value)
+        normalized[kind] = keys
+    return snapshot, normalized, full
+
+
+async def save_data_safe(dirty=None):
+    """
+    Persist `data` (or its dirty parts) without blocking the event loop. The
+    loop only takes the snapshot; encoding and disk I/O run on the persistence
+    thread. Caller must hold data_lock. Returns True on success.
+    """
+    started = time.perf_counter()
+    users = data["users"]
+    snapshot, dirty, full = take_snapshot(dirty)
+    handoff = time.perf_counter() - started
+    try:
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        written = await loop.run_in_executor(persist_executor, storage.save, snapshot, dirty, full)
+        elapsed = time.perf_counter() - started
+    except Exception:
+        logger.exception("Failed to save data to disk")
+        metrics.inc("bot_save_failures_total")
+        return False
+    if isinstance(users, LazyUsers) and "users" in dirty:
+        users.saved(dirty["users"])
+    metrics.observe("bot_snapshot_seconds", handoff)
+    metrics.observe("bot_save_seconds", elapsed, mode="full" if full else "delta")
+    metrics.inc("bot_save_bytes_total", written)
+    persist_stats["saves"] += 1
+    persist_stats["snapshot_ms"] = handoff * 1000
+    persist_stats["write_ms"] = elapsed * 1000
+    persist_stats["total_write_ms"] += elapsed * 1000
+    persist_stats["bytes"] = written
+    logger.debug("Saved %d bytes: snapshot %.1f ms on loop, write %.1f ms off loop",
+                 written, handoff * 1000, elapsed * 1000)
+    return True
+
+
+class WriteBehind:
+    """
+    Coalesce state changes and write them from a background task.
+
+    Handlers call mark_dirty() instead of saving. The flusher writes at most
+    every `interval` seconds (the durability window), or earlier once
+    `threshold` changes have piled up. stop() forces a final flush.
+    With the journal enabled each flush is also its compaction point.
+    """
+
+    def __init__(self, interval: float, threshold: int):
+        self.interval = max(0.1, interval)
+        self.threshold = max(1, threshold)
+        self.dirty = 0
+        self.pending = {}  # kind -> set of keys, or None for the whole kind
+        self.everything = False
+        self._wake = None
+        self._task = None
+
+    def mark(self, kind=None, key=None):
+        self.dirty += 1
+        if kind is None:
+            self.everything = True
+        elif key is None:
+            self.pending[kind] = None
+        else:
+            keys = self.pending.setdefault(kind, set())
+            if keys is not None:
+                keys.add(key)
+        if self._wake is not None and self.dirty >= self.threshold:
+            self._wake.set()
+
+    def discard(self):
+        """Forget pending changes (the state they refer to was replaced)."""
+        self.dirty = 0
+        self.pending = {}
+        self.everything = False
+
+    def _restore(self, count, pending):
+        """Put the changes of a failed flush back so the next one retries them."""
+        self.dirty += count
+        if pending is None:
+            self.everything = True
+            return
+        for kind, keys in pending.items():
+            if keys is None:
+                self.pending[kind] = None
+            else:
+                current = self.pending.setdefault(kind, set())
+                if current is not None:
+                    current.update(keys)
+
+    async def flush(self):
+        """Write pending changes now (no-op when nothing is dirty)."""
+        if not self.dirty:
+            return True
+        started = time.perf_counter()
+        try:
+            return await self._flush()
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.observe("bot_flush_seconds", elapsed)
+            slow_updates.note("flush", started, elapsed)
+
+    async def _flush(self):
+        async with data_lock:
+            # taken under the lock so the dirty set, snapshot and journal_seq agree
+            if not self.dirty:
+                return True
+            count, pending = self.dirty, (None if self.everything else self.pending)
+            self.discard()
+            # the snapshot covers every journal record applied so far
+            upto = data["journal_seq"] = journal.seq
+            if pending is not None:
+                pending["journal_seq"] = None
+            ok = await save_data_safe(pending)
+            if not ok:
+                self._restore(count, pending)
+                return ok
+            await journal.compact(upto)
+            return ok
+
+    async def _run(self):
+        # checked as well as cancel(): wait_for() can swallow a cancellation that
+        # races with the wake-up event, and the loop must still end
+        while self._task is not None:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+                await chat_checkpoint.save()
+            except Exception:
+                logger.exception("Background flush failed")
+
+    def start(self):
+        if self._task is None:
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
 
-data = load_data()
+    async def stop(self):
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+        await chat_checkpoint.save()
 
 
-async def save_data_safe():
-    """Async-safe write to JSON file using a lock."""
-    global data
-    async with data_lock:
-        tmp = DATA_FILE + ".tmp"
+persistence = WriteBehind(FLUSH_INTERVAL, FLUSH_THRESHOLD)
+
+
+def mark_dirty(kind=None, key=None):
+    """
+    Record that `data` changed; the background flusher will persist it.
+    `kind` is the top-level key and `key` the entry inside it (user id, chat id).
+    Without arguments everything is considered dirty.
+    """
+    if kind is None or kind in CHAT_KINDS:
+        chat_checkpoint.mark()
+        if kind is not None:
+            backups.mark(kind, key)  # not in the saves of the data file, but in every backup
+            return
+    persistence.mark(kind, key)
+    backups.mark(kind, key)
+
+
+# ----------------- BACKUPS -----------------
+class Backups:
+    """
+    Gzipped backups in a directory, chained by manifest.json.
+
+    A full backup is the compressed data file. A delta holds only what changed
+    since the previous backup: {"backup": "delta", "set": {kind: {key: value,
+    null when deleted}}, "replace": {kind: value}}, built from the same
+    mark_dirty() notifications as the write-behind. A chain is one full backup
+    and the deltas after it; a new chain starts every `full_every` deltas, on
+    the first backup of a process and whenever a change cannot be expressed
+    as a delta (restore, allclear). Only the newest `keep` chains are kept.
+    rebuild() replays a chain into a plain data document.
+    """
+
+    def __init__(self, directory: str, interval: float, full_every: int, keep: int):
+        self.directory = directory
+        self.interval = interval
+        self.full_every = max(0, full_every)
+        self.keep = max(1, keep)
+        self.pending = {}  # kind -> set of keys, or None for the whole kind
+        self.everything = True  # changes made before this process started are unknown
+        self.lock = asyncio.Lock()
+        self._task = None
+
+    def mark(self, kind=None, key=None):
+        if kind is None:
+            self.everything = True
+        elif key is None:
+            self.pending[kind] = None
+        else:
+            keys = self.pending.setdefault(kind, set())
+            if keys is not None:
+                keys.add(key)
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.directory, "manifest.json")
+
+    def entries(self):
         try:
-            with open(tmp, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            os.replace(tmp, DATA_FILE)
-        except Exception:
-            logger.exception("Failed to save data to disk")
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)["backups"]
+        except FileNotFoundError:
+            return []
+
+    def _save_manifest(self, entries):
+        tmp = self.manifest_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"backups": entries}, f, indent=1)
+        os.replace(tmp, self.manifest_path)
+
+    def _store(self, kind: str, write):
+        """Write a backup file with `write(stream)` and append it to the manifest (persistence thread)."""
+        os.makedirs(self.directory, exist_ok=True)
+        entries = self.entries()
+        name = f"{datetime.now():%Y%m%d-%H%M%S-%f}-{kind}.json.gz"
+        path = os.path.join(self.directory, name)
+        with gzip.open(path + ".tmp", "wb", compresslevel=6) as out:
+            write(out)
+        os.replace(path + ".tmp", path)
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        parent = entries[-1] if entries and kind == "delta" else None
+        entry = {
+            "file": name,
+            "type": kind,
+            "base": parent["base"] if parent else name,
+            "parent": parent["file"] if parent else None,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "bytes": os.path.getsize(path),
+            "sha256": digest.hexdigest(),
+        }
+        entries.append(entry)
+        entries = self._prune(entries)
+        self._save_manifest(entries)
+        return dict(entry, path=path)
+
+    def _prune(self, entries):
+        bases = list(dict.fromkeys(entry["base"] for entry in entries))
+        dropped = set(bases[:-self.keep])
+        for entry in entries:
+            if entry["base"] in dropped:
+                try:
+                    os.remove(os.path.join(self.directory, entry["file"]))
+                except FileNotFoundError:
+                    pass
+        return [entry for entry in entries if entry["base"] not in dropped]
+
+    def _write_full(self):
+        source = storage.export_json()
+        with open(source, "rb") as f:
+            return self._store("full", lambda out: shutil.copyfileobj(f, out, 1 << 20))
+
+    def _write_delta(self, snapshot, dirty):
+        delta = {"backup": "delta", "set": {}, "replace": {}}
+        for kind, value in snapshot.items():
+            delta["set" if dirty[kind] is not None else "replace"][kind] = value
+        return self._store("delta", lambda out: out.write(json.dumps(delta, ensure_ascii=False).encode("utf-8")))
+
+    async def backup(self, full: bool = False):
+        """
+        Take a backup (a delta when possible) and return its manifest entry
+        plus "path", or None when nothing changed since the last one.
+        """
+        loop = asyncio.get_running_loop()
+        async with self.lock:
+            everything, pending = self.everything, self.pending
+            self.everything, self.pending = False, {}
             try:
-                if os.path.exists(tmp):
-                    os.remove(tmp)
+                entries = await loop.run_in_executor(persist_executor, self.entries)
+                base = entries[-1]["base"] if entries else None
+                chain = [entry for entry in entries if entry["base"] == base]
+                full = (
+                    full or everything or not entries or len(chain) > self.full_every
+                    or any(keys is None for kind, keys in pending.items() if kind in KEYED_KINDS)
+                )
+                if full:
+                    await persistence.flush()
+                    # saves leave chat counters and drops to their checkpoint: write the current ones
+                    # into the data file as well, so the export carries the drop progress
+                    for kind in CHAT_KINDS:
+                        persistence.mark(kind)
+                    await persistence.flush()
+                    return await loop.run_in_executor(persist_executor, self._write_full)
+                pending.pop("journal_seq", None)
+                if not pending:
+                    return None
+                snapshot, dirty, _ = take_snapshot(pending)
+                return await loop.run_in_executor(persist_executor, self._write_delta, snapshot, dirty)
+            except BaseException:
+                self.everything = True  # the next backup starts a new chain
+                raise
+
+    def rebuild(self, upto=None):
+        """The data document as of backup `upto` (a file name; default the newest)."""
+        entries = {entry["file"]: entry for entry in self.entries()}
+        if not entries:
+            raise ValueError(f"no backups in {self.directory}")
+        name = upto or list(entries)[-1]
+        chain = []
+        while name is not None:
+            if name not in entries:
+                raise ValueError(f"backup {name} is not in the manifest")
+            chain.append(entries[name])
+            name = entries[name]["parent"]
+        state = None
+        for entry in reversed(chain):
+            path = os.path.join(self.directory, entry["file"])
+            digest = hashlib.sha256()
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+            if digest.hexdigest() != entry["sha256"]:
+                raise ValueError(f"backup {entry['file']} is damaged (checksum mismatch)")
+            with gzip.open(path, "rb") as f:
+                doc = json.load(f)
+            if state is None:
+                state = doc
+                continue
+            for kind, changes in doc["set"].items():
+                target = state.setdefault(kind, {})
+                for key, value in changes.items():
+                    if value is None:
+                        target.pop(key, None)
+                    else:
+                        target[key] = value
+            state.update(doc["replace"])
+        return state
+
+    async def _run(self):
+        while self._task is not None:
+            await asyncio.sleep(self.interval)
+            try:
+                entry = await self.backup()
+                if entry:
+                    logger.info("Backup %s (%s, %d bytes)", entry["file"], entry["type"], entry["bytes"])
             except Exception:
+                logger.exception("Scheduled backup failed")
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
                 pass
 
 
+backups = Backups(BACKUP_DIR, BACKUP_INTERVAL, BACKUP_FULL_EVERY, BACKUP_KEEP)
+
+
+def unpack_backup(path: str):
+    """Decompress a gzipped full backup in place; refuse deltas (persistence thread)."""
+    with open(path, "rb") as f:
+        compressed = f.read(2) == b"\x1f\x8b"
+    if compressed:
+        with gzip.open(path, "rb") as src, open(path + ".json", "wb") as out:
+            shutil.copyfileobj(src, out, 1 << 20)
+        os.replace(path + ".json", path)
+    with open(path, "rb") as f:
+        if f.read(64).replace(b" ", b"").startswith(b'{"backup":"delta"'):
+            raise ValueError("a delta backup needs its base; restore it with --restore-backup")
+
+
+def restore_backup(upto=None):
+    """--restore-backup: rebuild a backup chain into the storage (bot stopped)."""
+    state = backups.rebuild(upto)
+    path = DATA_FILE + ".restore"
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    storage.restore_file(path)
+    storage.close()
+    # the restored state is authoritative: drop records and counters of the replaced one
+    journal.discard()
+    chat_checkpoint.discard()
+    logger.info("Restored %s from %s", DATA_FILE, BACKUP_DIR)
+
+
 # ----------------- RARITY -----------------
 RARITIES = {
     "Common": {"emoji": "🟤", "price": 5000},
@@ -127,6 +2136,108 @@ RARITIES = {
 }
 
 
+class DropEngine:
+    """
+    Rarity-weighted card sampler.
+
+    Cards are bucketed by rarity and an alias table (Vose) picks the rarity,
+    so a draw is O(1) whatever the catalog size: one table lookup, then a
+    uniform pick inside the bucket. add()/remove() keep the buckets in step
+    with /upload and /delete (swap-remove via a position index); only the
+    tiny table over rarities is rebuilt when a bucket empties or fills.
+    Like MovieCounts it rebuilds by itself when data["cards"] is replaced.
+    """
+
+    def __init__(self, weights):
+        self.weights = weights
+        self._cards = None
+        self._size = 0
+        self.buckets = {}  # rarity -> [card]
+        self._where = {}  # id(card) -> index in its bucket
+        self._rarities = []
+        self._prob = []
+        self._alias = []
+
+    def of(self, cards):
+        if cards is not self._cards or len(cards) != self._size:
+            self.buckets, self._where = {}, {}
+            for card in cards:
+                self._insert(card)
+            self._cards, self._size = cards, len(cards)
+            self._build()
+        return self
+
+    def _insert(self, card):
+        bucket = self.buckets.setdefault(card.get("rarity", "Common"), [])
+        self._where[id(card)] = len(bucket)
+        bucket.append(card)
+        return len(bucket) == 1
+
+    def added(self, cards, card):
+        if cards is self._cards and len(cards) == self._size + 1:
+            self._size += 1
+            if self._insert(card):
+                self._build()
+
+    def removed(self, cards, card):
+        if cards is not self._cards or len(cards) != self._size - 1:
+            return
+        self._size -= 1
+        rarity = card.get("rarity", "Common")
+        bucket = self.buckets[rarity]
+        index = self._where.pop(id(card))
+        last = bucket.pop()
+        if last is not card:
+            bucket[index] = last
+            self._where[id(last)] = index
+        if not bucket:
+            del self.buckets[rarity]
+            self._build()
+
+    def _build(self):
+        rarities = [r for r in self.buckets if self.weights.get(r, 0) > 0]
+        if not rarities:
+            # no weighted rarity present: fall back to a uniform pick over rarities
+            rarities = list(self.buckets)
+            weights = [1.0] * len(rarities)
+        else:
+            weights = [float(self.weights[r]) for r in rarities]
+        n = len(rarities)
+        total = sum(weights)
+        scaled = [w * n / total for w in weights] if n else []
+        prob, alias = [0.0] * n, [0] * n
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            s_i, l_i = small.pop(), large.pop()
+            prob[s_i], alias[s_i] = scaled[s_i], l_i
+            scaled[l_i] -= 1 - scaled[s_i]
+            (small if scaled[l_i] < 1 else large).append(l_i)
+        for i in small + large:
+            prob[i] = 1.0
+        self._rarities, self._prob, self._alias = rarities, prob, alias
+
+    def rarity(self):
+        i = random.randrange(len(self._rarities))
+        return self._rarities[i] if random.random() < self._prob[i] else self._rarities[self._alias[i]]
+
+    def sample(self):
+        """One catalog card (not a copy), or None when the catalog is empty."""
+        self.of(data.get("cards", []))
+        if not self._rarities:
+            return None
+        return random.choice(self.buckets[self.rarity()])
+
+    def sample_many(self, count: int):
+        self.of(data.get("cards", []))
+        if not self._rarities:
+            return []
+        return [random.choice(self.buckets[self.rarity()]) for _ in range(count)]
+
+
+drops = DropEngine(RARITY_WEIGHTS)
+
+
 # ----------------- HELPERS -----------------
 def uid_str(user_id):
     return str(int(user_id))
@@ -135,8 +2246,9 @@ def uid_str(user_id):
 def get_user(user_id: int):
     """Return user dict, create default if missing. Note: does NOT auto-save."""
     user_key = uid_str(user_id)
-    if user_key not in data["users"]:
-        data["users"][user_key] = {
+    user = data["users"].get(user_key)
+    if user is None:
+        user = data["users"][user_key] = {
             "coins": 10_000,
             "cards": [],  # legacy field
             "harem": [],
@@ -144,7 +2256,10 @@ def get_user(user_id: int):
             "last_daily": None,
             "last_slime": None,
         }
-    return data["users"][user_key]
+        rank_user(user_key, user)
+    else:
+        compact_harem(user_key, user)
+    return user
 
 
 def is_admin(user_id: int) -> bool:
@@ -177,19 +2292,1066 @@ def check_cooldown(user_id: int, action: str, cooldown_seconds: int):
     return True, 0
 
 
+async def top_users(by: str, limit: int):
+    """Return [(user_key, value)] ordered by coins or harem size (`by` = "coins" | "harem")."""
+    if storage.name == "sqlite":
+        # the table answers the query from its index once pending rows are written
+        await persistence.flush()
+    return storage.top_users(data["users"], by, limit)
+
+
 def get_rarity_weight():
-    """Return a random rarity based on weights."""
-    weights = {"Common": 50, "Rare": 30, "Epic": 12, "Legendary": 6, "Mythic": 2}
-    rarities = list(weights.keys())
-    weights_list = list(weights.values())
-    return random.choices(rarities, weights=weights_list)[0]
+    """Return a random rarity based on RARITY_WEIGHTS (among rarities in the catalog)."""
+    if drops.of(data.get("cards", [])).buckets:
+        return drops.rarity()
+    return random.choices(list(RARITY_WEIGHTS), weights=list(RARITY_WEIGHTS.values()))[0]
+
+
+# ----------------- LOCKING -----------------
+class LockStripes:
+    """
+    A fixed pool of asyncio locks that users and chats hash onto.
+
+    Handlers that read and then update state hold the stripes of every party
+    they touch (see serialized()), which keeps checks such as "enough coins?"
+    valid across awaits once updates are processed concurrently.
+
+    Each kind of key has its own pool and stripes are taken in one order:
+    users before chats, then by index. With shards, a chat is only locked on
+    the shard that owns it (claim_scope, take_drop), so every wait follows
+    the global order (kind, shard, stripe): a handler waiting on another
+    shard holds only user stripes and waits for a chat stripe there.
+    """
+
+    KINDS = ("user", "chat", "votes")  # acquisition order
+
+    def __init__(self, count: int):
+        self._locks = {kind: [asyncio.Lock() for _ in range(count)] for kind in self.KINDS}
+
+    def stripes(self, keys):
+        """(kind, index) of the stripes `keys` map to, in acquisition order."""
+        return sorted({(self.KINDS.index(key[0]), hash(key) % len(self._locks[key[0]])) for key in keys})
+
+    @contextlib.asynccontextmanager
+    async def hold(self, *keys):
+        taken = []
+        try:
+            for kind, index in self.stripes(keys):
+                lock = self._locks[self.KINDS[kind]][index]
+                await lock.acquire()
+                taken.append(lock)
+            yield
+        finally:
+            for lock in reversed(taken):
+                lock.release()
+
+
+stripes = LockStripes(LOCK_STRIPES)
+
+
+def serialized(scope):
+    """Run a handler while holding the stripes of the keys `scope(update, context)` names."""
+    def wrap(handler):
+        @functools.wraps(handler)
+        async def run(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            async with stripes.hold(*scope(update, context)):
+                return await handler(update, context)
+        return run
+    return wrap
+
+
+def user_scope(update, context):
+    return [("user", update.effective_user.id)] if update.effective_user else []
+
+
+def chat_scope(update, context):
+    return [("chat", update.effective_chat.id)] if update.effective_chat else []
+
+
+def claim_scope(update, context):
+    chat = update.effective_chat
+    # a chat owned by another shard is locked there, by take_drop; holding a
+    # local stripe for it while waiting on that shard could close a cycle
+    local = chat_scope(update, context) if chat and owns(chat.id) else []
+    return local + user_scope(update, context)
+
+
+def votes_scope(update, context):
+    return [("votes",)]
+
+
+def transfer_scope(target_arg: int):
+    """The caller plus the target user: the replied-to sender, else context.args[target_arg]."""
+    def scope(update, context):
+        keys = user_scope(update, context)
+        reply = update.message.reply_to_message if update.message else None
+        if reply and reply.from_user:
+            keys.append(("user", reply.from_user.id))
+        elif context.args and len(context.args) > target_arg:
+            try:
+                keys.append(("user", int(context.args[target_arg])))
+            except ValueError:
+                pass
+        return keys
+    return scope
+
+
+# ----------------- NAMES -----------------
+name_cache = OrderedDict()  # user_key -> (name, seen_at) for people without a user record, least recent first
+name_fetch_slots = asyncio.Semaphore(NAME_FETCH_CONCURRENCY)
+
+
+def _name_entry(user_key: str):
+    """(name, seen_at datetime) known for `user_key`, or None."""
+    users = data["users"]
+    if isinstance(users, LazyUsers):
+        # just the name: loading (and caching) every sender's whole record would fill the user cache
+        stored = users.name_of(user_key)
+    else:
+        user = users.get(user_key)
+        stored = None if user is None else (user.get("name"), user.get("name_at"))
+    if stored is not None and stored[1]:
+        try:
+            return stored[0], datetime.fromisoformat(stored[1])
+        except (TypeError, ValueError):
+            return None
+    entry = name_cache.get(user_key)
+    if entry is not None:
+        name_cache.move_to_end(user_key)
+    return entry
+
+
+def _cache_name(user_key: str, name, seen_at):
+    name_cache[user_key] = (name, seen_at)
+    name_cache.move_to_end(user_key)
+    if len(name_cache) > NAME_CACHE_SIZE:
+        name_cache.popitem(last=False)
+
+
+def remember_name(user_id: int, name):
+    """Record a display name; the user record is only rewritten when it changed or aged."""
+    user_key = uid_str(user_id)
+    now = datetime.now()
+    known = _name_entry(user_key)
+    if known and known[0] == name and (now - known[1]).total_seconds() < NAME_TTL / 2:
+        return
+    user = data["users"].get(user_key) if user_key in data["users"] else None
+    if user is None:
+        _cache_name(user_key, name, now)
+        return
+    name_cache.pop(user_key, None)
+    user["name"] = name
+    user["name_at"] = now.isoformat()
+    mark_dirty("users", user_key)
+
+
+async def track_names(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Runs before every handler: keep the name directory fresh for free."""
+    user = update.effective_user
+    if user and not user.is_bot:
+        remember_name(user.id, user.first_name)
+
+
+async def display_names(bot, user_ids):
+    """
+    {user_key: first name} for `user_ids`, from the directory where possible.
+    Missing or expired entries are fetched with get_chat, a few at a time;
+    a stale name is still better than "Unknown" when that fails.
+    """
+    names, cold = {}, []
+    now = datetime.now()
+    for user_id in user_ids:
+        user_key = uid_str(user_id)
+        known = _name_entry(user_key)
+        if known:
+            names[user_key] = known[0] or "Unknown"
+        if not known or (now - known[1]).total_seconds() >= NAME_TTL:
+            cold.append(user_key)
+
+    async def fetch(user_key):
+        async with name_fetch_slots:
+            try:
+                chat = await bot.get_chat(int(user_key))
+            except Exception:
+                if user_key not in names:
+                    # remember the miss too, so a deleted account is not retried on every render
+                    _cache_name(user_key, None, datetime.now())
+                    names[user_key] = "Unknown"
+                return
+        remember_name(int(user_key), chat.first_name)
+        names[user_key] = chat.first_name or "Unknown"
+
+    await asyncio.gather(*(fetch(user_key) for user_key in cold))
+    return names
+
+
+# ----------------- INDEXES -----------------
+class MovieCounts:
+    """
+    movie -> number of cards in one list of cards (a harem or the catalog);
+    `movie_of` reads the movie of one entry.
+
+    Built on first use and kept in step by added()/removed(); it rebuilds by
+    itself when the list is replaced (restore, allclear) or changed behind its
+    back, which shows up as a different list object or length.
+    """
+
+    def __init__(self, movie_of=lambda card: card.get("movie")):
+        self.movie_of = movie_of
+        self._cards = None
+        self._size = 0
+        self.counts = {}
+
+    def of(self, cards):
+        if cards is not self._cards or len(cards) != self._size:
+            counts = {}
+            for card in cards:
+                movie = self.movie_of(card)
+                counts[movie] = counts.get(movie, 0) + 1
+            self._cards, self._size, self.counts = cards, len(cards), counts
+        return self.counts
+
+    def added(self, cards, card):
+        if cards is self._cards and len(cards) == self._size + 1:
+            movie = self.movie_of(card)
+            self.counts[movie] = self.counts.get(movie, 0) + 1
+            self._size += 1
+
+    def removed(self, cards, card):
+        if cards is self._cards and len(cards) == self._size - 1:
+            movie = self.movie_of(card)
+            self.counts[movie] -= 1
+            self._size -= 1
+
+
+class IdIndex:
+    """
+    id -> entry of one list (the catalog or a harem), with the same
+    self-rebuilding contract as MovieCounts. The first entry with an id wins,
+    like the linear scans it replaces.
+    """
+
+    def __init__(self, id_of):
+        self.id_of = id_of
+        self._items = None
+        self._size = 0
+        self.by_id = {}
+
+    def of(self, items):
+        if items is not self._items or len(items) != self._size:
+            by_id = {}
+            for item in items:
+                by_id.setdefault(self.id_of(item), item)
+            self._items, self._size, self.by_id = items, len(items), by_id
+        return self.by_id
+
+    def added(self, items, item):
+        if items is self._items and len(items) == self._size + 1:
+            self.by_id.setdefault(self.id_of(item), item)
+            self._size += 1
+
+    def removed(self, items, item):
+        if items is self._items and len(items) == self._size - 1:
+            if self.by_id.get(self.id_of(item)) is item:
+                del self.by_id[self.id_of(item)]
+            self._size -= 1
+
+
+def normalize(text) -> str:
+    """Search key: case-folded, single-spaced."""
+    return " ".join(str(text or "").casefold().split())
+
+
+class CatalogSearch:
+    """
+    Catalog lookups by rarity, by normalized movie and by normalized name
+    prefix. The prefix index is a sorted list of (key, card id) with one key
+    per word of the name, so "luf" finds "Monkey D. Luffy" with a bisect.
+    Same self-rebuilding contract as MovieCounts; upload and delete keep it in
+    step through added()/removed().
+    """
+
+    def __init__(self):
+        self._cards = None
+        self._size = 0
+        self.by_rarity = {}  # rarity -> {card id: card}
+        self.by_movie = {}  # normalized movie -> {card id: card}
+        self.by_key = {}  # (normalized name, normalized movie) -> card, for duplicate checks
+        self.prefixes = []
+        self.version = 0  # bumped on every change, for caches of search results
+
+    @staticmethod
+    def key_of(card):
+        return normalize(card.get("name")), normalize(card.get("movie"))
+
+    @staticmethod
+    def _keys(card):
+        words = normalize(card.get("name")).split(" ")
+        return [(" ".join(words[i:]), card.get("id")) for i in range(len(words))]
+
+    def _add(self, card):
+        self.by_rarity.setdefault(card.get("rarity"), {})[card.get("id")] = card
+        self.by_movie.setdefault(normalize(card.get("movie")), {})[card.get("id")] = card
+        self.by_key.setdefault(self.key_of(card), card)
+
+    def of(self, cards):
+        if cards is not self._cards or len(cards) != self._size:
+            self.by_rarity, self.by_movie, self.by_key = {}, {}, {}
+            for card in cards:
+                self._add(card)
+            self.prefixes = sorted(key for card in cards for key in self._keys(card))
+            self._cards, self._size = cards, len(cards)
+            self.version += 1
+        return self
+
+    def added(self, cards, card):
+        if cards is self._cards and len(cards) == self._size + 1:
+            self._add(card)
+            for key in self._keys(card):
+                bisect.insort(self.prefixes, key)
+            self._size += 1
+            self.version += 1
+
+    def removed(self, cards, card):
+        if cards is self._cards and len(cards) == self._size - 1:
+            for index in (self.by_rarity.get(card.get("rarity")), self.by_movie.get(normalize(card.get("movie")))):
+                if index is not None:
+                    index.pop(card.get("id"), None)
+            if self.by_key.get(self.key_of(card)) is card:
+                del self.by_key[self.key_of(card)]
+            for key in self._keys(card):
+                at = bisect.bisect_left(self.prefixes, key)
+                if at < len(self.prefixes) and self.prefixes[at] == key:
+                    del self.prefixes[at]
+            self._size -= 1
+            self.version += 1
+
+    def named(self, prefix: str):
+        """Card ids whose name has a word starting with `prefix`, best match first."""
+        prefix = normalize(prefix)
+        ids = {}
+        at = bisect.bisect_left(self.prefixes, (prefix,))
+        while at < len(self.prefixes) and self.prefixes[at][0].startswith(prefix):
+            ids.setdefault(self.prefixes[at][1], None)
+            at += 1
+        return list(ids)
+
+    def search(self, rarity=None, movie=None, name=None):
+        """Catalog cards matching every given filter."""
+        if name:
+            by_id = catalog_ids.of(self._cards)
+            found = [by_id[card_id] for card_id in self.named(name) if card_id in by_id]
+        elif movie:
+            found = list(self.by_movie.get(normalize(movie), {}).values())
+        elif rarity:
+            return list(self.by_rarity.get(rarity, {}).values())
+        else:
+            return self._cards
+        if movie:
+            movie = normalize(movie)
+            found = [card for card in found if normalize(card.get("movie")) == movie]
+        if rarity:
+            found = [card for card in found if card.get("rarity") == rarity]
+        return found
+
+
+catalog_search = CatalogSearch()
+
+
+HAREM_INDEX_SIZE = 5000  # users whose harem indexes stay cached
+harem_movies = OrderedDict()  # user_key -> MovieCounts, least recently viewed first
+harem_ids = OrderedDict()  # user_key -> IdIndex by instance id, least recently used first
+catalog_movies = MovieCounts()
+
+
+def _harem_index(cache, user_key: str, make):
+    index = cache.get(user_key)
+    if index is None:
+        index = cache[user_key] = make()
+        if len(cache) > HAREM_INDEX_SIZE:
+            cache.popitem(last=False)
+    else:
+        cache.move_to_end(user_key)
+    return index
+
+
+def owned_movies(user_key: str, user):
+    """movie -> cards owned, for harem rendering."""
+    return _harem_index(harem_movies, user_key, lambda: MovieCounts(card_movie)).of(user["harem"])
+
+
+def find_instance(user_key: str, user, iid: str):
+    """The harem entry whose instance id is `iid`, or None."""
+    return _harem_index(harem_ids, user_key, lambda: IdIndex(instance_id)).of(user["harem"]).get(iid)
+
+
+def harem_added(user_key: str, user, card):
+    for cache in (harem_movies, harem_ids):
+        index = cache.get(user_key)
+        if index is not None:
+            index.added(user["harem"], card)
+
+
+class Leaderboard:
+    """
+    Incrementally maintained top-K of users by coins or harem size.
+
+    Keeps a small candidate set (a few times K) with exact values, plus
+    `outside_max`, an upper bound for every user outside it. Ops report
+    changes through update(); the full table is only rescanned when too few
+    candidates stay above that bound. `version` changes only when the top-K
+    itself changes, so rendered pages can be cached on it.
+    """
+
+    def __init__(self, by: str, size: int, spare: int = 4):
+        self.by = by
+        self.size = size
+        self.capacity = size * spare
+        self.version = 0
+        self._users = None  # the data["users"] mapping the candidates describe
+        self._entries = {}  # user_key -> value
+        self._outside_max = 0
+        self._listeners = []  # {user_key: value} of each running rebuild, for updates that race with it
+        self._rebuilding = None  # future of the running rebuild, shared by every caller
+        self._top = []
+
+    def value(self, user):
+        return user.get("coins", 0) if self.by == "coins" else len(user.get("harem", []))
+
+    def update(self, user_key: str, user):
+        if self._listeners:
+            value = self.value(user)
+            for pending in self._listeners:
+                pending[user_key] = value
+        if self._users is not data["users"]:
+            return
+        self._set(user_key, self.value(user))
+
+    def _set(self, user_key, value):
+        entries = self._entries
+        if user_key in entries or value > self._outside_max or len(entries) < self.capacity:
+            entries[user_key] = value
+            if len(entries) > self.capacity:
+                evicted = min(entries, key=entries.get)
+                self._outside_max = max(self._outside_max, entries.pop(evicted))
+
+    async def _rebuild(self):
+        """Rescan the table; a caller arriving while a rescan runs waits for that one."""
+        if self._rebuilding is None:
+            self._rebuilding = asyncio.ensure_future(self._scan())
+        # shielded: one cancelled caller must not cancel the scan the others wait on
+        await asyncio.shield(self._rebuilding)
+
+    async def _scan(self):
+        users = data["users"]
+        pending = {}
+        self._listeners.append(pending)
+        try:
+            best = await top_users(self.by, self.capacity)
+        finally:
+            self._listeners.remove(pending)
+            self._rebuilding = None
+        if users is not data["users"]:
+            return
+        self._users = users
+        self._entries = dict(best)
+        # fewer rows than asked for: nobody is left outside
+        self._outside_max = best[-1][1] if len(best) >= self.capacity else -1
+        for user_key, value in pending.items():
+            self._set(user_key, value)
+
+    def _ranked(self):
+        return sorted(self._entries.items(), key=lambda kv: kv[1], reverse=True)[:self.size]
+
+    def _exact(self, ranked):
+        if self._users is not data["users"]:
+            return False
+        return self._outside_max < 0 or len(ranked) == self.size and ranked[-1][1] >= self._outside_max
+
+    async def top(self):
+        """[(user_key, value)] of the K best users, highest first."""
+        ranked = self._ranked()
+        for _ in range(3):
+            if self._exact(ranked):
+                break
+            await self._rebuild()
+            ranked = self._ranked()
+        if ranked != self._top:
+            self._top = ranked
+            self.version += 1
+        return ranked
+
+
+LEADERBOARD_SIZE = 10
+leaderboards = {"coins": Leaderboard("coins", LEADERBOARD_SIZE), "harem": Leaderboard("harem", LEADERBOARD_SIZE)}
+
+
+def rank_user(user_key: str, user):
+    """Report a change to a user's coins or harem size to the leaderboards."""
+    for board in leaderboards.values():
+        board.update(user_key, user)
+
+
+# ----------------- HAREM RECORDS -----------------
+# A harem entry is [card_id, serial, acquired_at]: a reference to a catalog
+# card, the suffix that makes its instance id unique and an epoch second (None
+# for migrated entries). Name, movie, rarity and photo are read from the
+# catalog, or from data["retired_cards"] once the card has been deleted.
+# Harems written by older versions held full card dicts; compact_harem()
+# converts them the first time the user is read.
+CARD_FIELDS = ("name", "movie", "rarity", "photo")
+
+
+catalog_ids = IdIndex(lambda card: card.get("id"))
+
+
+def card_info(card_id):
+    """Catalog (or retired) card for `card_id`, None if unknown."""
+    card = catalog_ids.of(data.get("cards", [])).get(card_id)
+    if card is None:
+        card = data.get("retired_cards", {}).get(card_id)
+    return card
+
+
+def allocate_serial() -> int:
+    """
+    Next instance serial from data["next_serial"]. Shard workers interleave
+    (serial % SHARDS == SHARD_INDEX), so serials are unique across processes.
+    The counter is not journaled; replaying a journaled record moves it past
+    that record's serial (see note_serial).
+    """
+    step, own = max(SHARDS, 1), SHARD_INDEX or 0
+    serial = max(data.get("next_serial", 0), SERIAL_START)
+    serial += (own - serial) % step
+    data["next_serial"] = serial + step
+    mark_dirty("next_serial")
+    return serial
+
+
+def note_serial(serial):
+    if isinstance(serial, int) and serial >= data.get("next_serial", 0):
+        data["next_serial"] = serial + 1
+        mark_dirty("next_serial")
+
+
+def new_record(card_id, serial=None):
+    if serial is None:
+        serial = allocate_serial()
+    return [sys.intern(card_id), serial, int(time.time())]
+
+
+def instance_id(item) -> str:
+    if isinstance(item, dict):
+        return item.get("id")
+    card_id, serial = item[0], item[1]
+    return card_id if serial is None else f"{card_id}_{serial}"
+
+
+def resolve(item):
+    """Card dict for rendering one harem entry; "id" is the instance id."""
+    if isinstance(item, dict):
+        return item
+    card = card_info(item[0]) or {"name": "?", "movie": "?", "rarity": "Common"}
+    return dict(card, id=instance_id(item))
+
+
+def card_movie(item):
+    if isinstance(item, dict):
+        return item.get("movie")
+    return (card_info(item[0]) or {}).get("movie")
+
+
+def retire_card(card_id, card):
+    """Keep the metadata of a card that owned instances may still reference."""
+    retired = data.setdefault("retired_cards", {})
+    if card_id not in retired:
+        retired[card_id] = {k: card.get(k) for k in CARD_FIELDS}
+        mark_dirty("retired_cards")
+
+
+def _serial(text):
+    return int(text) if text.isdigit() and str(int(text)) == text else text
+
+
+def compact_card(card):
+    """Record for an old-style copied card dict (instance id "<card id>_<suffix>")."""
+    full = str(card.get("id", ""))
+    parts = full.split("_")
+    for cut in range(len(parts) - 1, 0, -1):
+        base = "_".join(parts[:cut])
+        known = card_info(base)
+        if known is not None and known.get("name") == card.get("name"):
+            return [sys.intern(base), _serial("_".join(parts[cut:])), None]
+    m = re.match(r"(card_\d+)_(.+)$", full)
+    if m and card_info(m.group(1)) is None:
+        # deleted before retired_cards existed: recover its metadata from the copy
+        retire_card(m.group(1), card)
+        return [sys.intern(m.group(1)), _serial(m.group(2)), None]
+    # no usable base id (or it now names another card): the whole id is the reference
+    retire_card(full, card)
+    return [full, None, None]
+
+
+def compact_harem(user_key: str, user):
+    harem = user.get("harem")
+    if harem and (isinstance(harem[0], dict) or isinstance(harem[-1], dict)):
+        user["harem"] = [compact_card(item) if isinstance(item, dict) else item for item in harem]
+        mark_dirty("users", user_key)
+
+
+def migrate_harems():
+    """Compact every harem of an in-memory user table; lazy tables migrate on access."""
+    users = data["users"]
+    if isinstance(users, LazyUsers):
+        return
+    for user_key, user in users.items():
+        compact_harem(user_key, user)
+
+
+# ----------------- JOURNAL -----------------
+class Journal:
+    """
+    Append-only operation log with group commit.
+
+    apply_op() mutates `data` and appends a compact record; commit() waits until
+    every record appended so far is fsynced, batching concurrent callers into one
+    write. Snapshots (the write-behind flush) record the last sequence number
+    they contain, after which compact() drops the covered segment files.
+    """
+
+    def __init__(self, prefix: str, enabled: bool, sync_delay: float):
+        self.prefix = prefix
+        self.enabled = enabled
+        self.sync_delay = sync_delay
+        self.seq = 0  # last sequence number handed out
+        self.synced = 0  # last sequence number known to be on disk
+        self._buffer = []
+        self._sync_task = None
+        self._io_lock = threading.Lock()
+        self._fh = None
+        self._current = None  # [path, last_seq] of the open segment
+        self._closed = []  # [path, last_seq] of sealed segments
+
+    def segments(self):
+        directory = os.path.dirname(os.path.abspath(self.prefix))
+        base = os.path.basename(self.prefix) + "."
+        names = sorted(n for n in os.listdir(directory) if n.startswith(base) and n[len(base):].isdigit())
+        return [os.path.join(directory, n) for n in names]
+
+    def replay(self, after_seq: int, apply):
+        """Apply every record newer than `after_seq` (the snapshot's); returns the count."""
+        applied = 0
+        newest = after_seq  # a failed write may have left records that its retry wrote again
+        # a compaction waits: it must neither delete a segment being read nor miss one not yet listed
+        with self._io_lock:
+            self.seq = max(self.seq, after_seq)
+            for path in self.segments():
+                last = 0
+                with open(path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            seq, op, *args = json.loads(line)
+                        except ValueError:
+                            # a torn final line from a crash mid-write was never acknowledged
+                            logger.warning("Skipping unreadable journal record in %s", path)
+                            continue
+                        last = max(last, seq)
+                        if seq > newest:
+                            apply(op, *args)
+                            applied += 1
+                            newest = seq
+                self.seq = max(self.seq, last)
+                self._closed.append([path, last])
+            self.synced = self.seq
+        return applied
+
+    def append(self, op: str, args):
+        if not self.enabled:
+            return
+        self.seq += 1
+        self._buffer.append(json.dumps([self.seq, op, *args], ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    async def commit(self):
+        """Wait until everything appended so far is durable."""
+        target = self.seq
+        while self.synced < target:
+            if self._sync_task is None:
+                self._sync_task = asyncio.create_task(self._sync())
+            await asyncio.shield(self._sync_task)
+
+    async def _sync(self):
+        try:
+            # give concurrent handlers a moment to join this batch
+            await asyncio.sleep(self.sync_delay)
+            lines, upto = self._buffer, self.seq
+            self._buffer = []
+            try:
+                await asyncio.to_thread(self._write, lines, upto)
+            except Exception:
+                self._buffer[:0] = lines
+                raise
+            self.synced = upto
+        finally:
+            self._sync_task = None
+
+    def _write(self, lines, upto):
+        if not lines:
+            return
+        with self._io_lock:
+            fresh = self._fh is None
+            if fresh:
+                first = json.loads(lines[0])[0] if lines else upto
+                path = f"{self.prefix}.{first:012d}"
+                self._fh = open(path, "a", encoding="utf-8")
+                self._current = [path, 0]
+            try:
+                self._fh.write("".join(lines))
+                self._fh.flush()
+                os.fsync(self._fh.fileno())
+            except Exception:
+                self._abandon(fresh, upto)
+                raise
+            self._current[1] = upto
+
+    def _abandon(self, fresh: bool, upto: int):
+        # how much of a failed write reached the file is unknown, and appending
+        # the retry after a torn line would garble it: the retry starts a new
+        # segment. A segment holding only this batch goes; an older one is
+        # kept (replay skips the records the retry repeats).
+        path = self._current[0]
+        with contextlib.suppress(OSError):
+            self._fh.close()
+        self._fh = None
+        if fresh:
+            with contextlib.suppress(OSError):
+                os.remove(path)
+        else:
+            self._current[1] = upto
+            self._closed.append(self._current)
+        self._current = None
+
+    def _seal(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._closed.append(self._current)
+            self._fh = None
+            self._current = None
+
+    def _prune(self, upto: int):
+        with self._io_lock:
+            # start a fresh segment on the next write so the current one can be dropped
+            self._seal()
+            keep = []
+            for path, last in self._closed:
+                if last <= upto:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                else:
+                    keep.append([path, last])
+            self._closed = keep
+
+    def discard(self):
+        """Drop every segment: the state they apply to was replaced wholesale (restore)."""
+        with self._io_lock:
+            self._seal()
+            for path in self.segments():
+                os.remove(path)
+            self._closed = []
+
+    async def compact(self, upto: int):
+        """Drop log segments fully covered by a snapshot taken at `upto`."""
+        if self.enabled:
+            await asyncio.to_thread(self._prune, upto)
+
+
+journal = Journal(DATA_FILE + ".journal", JOURNAL_ENABLED, JOURNAL_SYNC_MS / 1000)
+JOURNAL_OPS = {}
+
+
+def journal_op(name):
+    """Register a replayable mutation under `name`."""
+    def register(fn):
+        JOURNAL_OPS[name] = fn
+        return fn
+    return register
+
+
+@journal_op("coins")
+def _op_coins(user_key, delta):
+    user = get_user(user_key)
+    user["coins"] += delta
+    rank_user(user_key, user)
+    mark_dirty("users", user_key)
+
+
+@journal_op("harem")
+def _op_harem(user_key, card):
+    if isinstance(card, dict):  # journaled by an older version
+        card = compact_card(card)
+    note_serial(card[1])
+    user = get_user(user_key)
+    user["harem"].append(card)
+    harem_added(user_key, user, card)
+    rank_user(user_key, user)
+    mark_dirty("users", user_key)
+
+
+@journal_op("fav")
+def _op_fav(user_key, card_id):
+    get_user(user_key)["fav_card"] = card_id
+    mark_dirty("users", user_key)
+
+
+@journal_op("touch")
+def _op_touch(user_key, action, when):
+    get_user(user_key)[f"last_{action}"] = when
+    mark_dirty("users", user_key)
+
+
+@journal_op("vote")
+def _op_vote(user_id, option):
+    for opt, voters in data.get("votes", {}).items():
+        if user_id in voters:
+            try:
+                voters.remove(user_id)
+            except ValueError:
+                pass
+    data["votes"].setdefault(option, []).append(user_id)
+    mark_dirty("votes")
+
+
+@journal_op("drop")  # records written by older versions; drops are no longer journaled
+def _op_drop(chat_id, card):
+    data["group_messages"][chat_id] = 0
+    data.setdefault("dropped_cards", {})[chat_id] = card
+    mark_dirty("group_messages", chat_id)
+    mark_dirty("dropped_cards", chat_id)
+
+
+@journal_op("claim")
+def _op_claim(chat_id, user_key, card, when):
+    if isinstance(card, dict):  # journaled by an older version
+        card = compact_card(card)
+    note_serial(card[1])
+    data.get("dropped_cards", {}).pop(chat_id, None)
+    user = get_user(user_key)
+    user["harem"].append(card)
+    harem_added(user_key, user, card)
+    rank_user(user_key, user)
+    user["last_slime"] = when
+    mark_dirty("dropped_cards", chat_id)
+    mark_dirty("users", user_key)
+
+
+@journal_op("undrop")
+def _op_undrop(chat_id):
+    data.get("dropped_cards", {}).pop(chat_id, None)
+    mark_dirty("dropped_cards", chat_id)
+
+
+def apply_op(op: str, *args):
+    """Apply a mutation to `data`, mark it dirty and append it to the journal."""
+    JOURNAL_OPS[op](*args)
+    journal.append(op, args)
+
+
+async def commit() -> bool:
+    """
+    Make every applied operation durable before acknowledging it. A failed
+    journal write is logged and returns False instead of raising: the change
+    is already in `data` and marked dirty, so the write-behind flush still
+    saves it, only without the journal's crash guarantee until then. Callers
+    that promise durability to another shard check the result.
+    """
+    started = time.perf_counter()
+    try:
+        await journal.commit()
+    except Exception:
+        logger.exception("Journal commit failed; the change is kept for the next flush")
+        metrics.inc("bot_journal_failures_total")
+        return False
+    finally:
+        slow_updates.note("journal commit", started, time.perf_counter() - started)
+    return True
+
+
+def replay_journal():
+    """Bring `data` up to date with log records newer than the loaded snapshot."""
+    applied = journal.replay(int(data.get("journal_seq", 0)), lambda op, *args: JOURNAL_OPS[op](*args))
+    if applied:
+        logger.info("Replayed %d journal records", applied)
+
+
+# ----------------- BROADCAST -----------------
+class TokenBucket:
+    """Async token bucket: `rate` sends per second with bursts of up to `burst`."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.stamp = time.monotonic()
+        self.resume_at = 0.0
+
+    def pause(self, seconds: float):
+        """Stop handing out tokens for `seconds` (Telegram's RetryAfter)."""
+        self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.resume_at:
+                await asyncio.sleep(self.resume_at - now)
+                continue
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class BroadcastJob:
+    """
+    Background broadcast to every tracked group.
+
+    The job state lives in data["broadcast"] so it is persisted with
+    everything else: the targets, a cursor below which every group is done
+    and the counters. A restart resumes from the cursor; at most the
+    `BROADCAST_WORKERS` sends that were in flight are repeated. Each chat gets
+    a single message, so pacing the global rate also keeps every chat far
+    below its own limit.
+    """
+
+    PROGRESS_EVERY = 5  # seconds between edits of the admin's progress message
+    CHECKPOINT_EVERY = 50  # completed sends between checkpoints
+
+    def __init__(self, bot, state):
+        self.bot = bot
+        self.state = state
+        self.bucket = TokenBucket(BROADCAST_RATE, max(1, int(BROADCAST_RATE)))
+        self.done = {}  # index -> ok, for sends finished above the cursor
+        self.task = None
+
+    @classmethod
+    def create(cls, bot, targets, text, photo, admin_chat, progress_msg):
+        state = {
+            "text": text,
+            "photo": photo,
+            "admin_chat": admin_chat,
+            "progress_msg": progress_msg,
+            "targets": targets,
+            "cursor": 0,
+            "success": 0,
+            "failed": 0,
+        }
+        data["broadcast"] = state
+        mark_dirty("broadcast")
+        return cls(bot, state)
+
+    @property
+    def alive(self):
+        # restore and allclear replace data; the old job must not write into the new state
+        return data.get("broadcast") is self.state
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+        return self
+
+    async def _send(self, chat_id):
+        state = self.state
+        while True:
+            await self.bucket.acquire()
+            try:
+                if state["photo"]:
+                    await self.bot.send_photo(chat_id=chat_id, photo=state["photo"], caption=state["text"])
+                else:
+                    await self.bot.send_message(chat_id=chat_id, text=state["text"])
+                return True
+            except RetryAfter as e:
+                self.bucket.pause(float(e.retry_after))
+            except Exception:
+                return False
+
+    def _finished(self, index, ok):
+        # results are only counted once the cursor passes them, so a resumed
+        # job never counts a re-sent group twice
+        state = self.state
+        self.done[index] = ok
+        while state["cursor"] in self.done:
+            state["success" if self.done.pop(state["cursor"]) else "failed"] += 1
+            state["cursor"] += 1
+            if state["cursor"] % self.CHECKPOINT_EVERY == 0:
+                mark_dirty("broadcast")
+
+    async def run(self):
+        state = self.state
+        queue = iter(range(state["cursor"], len(state["targets"])))
+
+        async def worker():
+            for index in queue:
+                if not self.alive:
+                    return
+                ok = await self._send(int(state["targets"][index]))
+                if self.alive:
+                    self._finished(index, ok)
+
+        workers = [asyncio.create_task(worker()) for _ in range(BROADCAST_WORKERS)]
+        try:
+            while not all(w.done() for w in workers):
+                await asyncio.wait(workers, timeout=self.PROGRESS_EVERY)
+                if self.alive:
+                    await self._report(final=False)
+        except asyncio.CancelledError:
+            for w in workers:
+                w.cancel()
+            raise
+        if not self.alive:
+            return
+        await self._report(final=True)
+        data["broadcast"] = None
+        mark_dirty("broadcast")
+
+    async def _report(self, final: bool):
+        state = self.state
+        if final:
+            text = f"📢 <b>Broadcast ပြီးပါပြီ!</b>\n\n✅ အောင်မြင်: {state['success']}\n❌ မအောင်မြင်: {state['failed']}"
+        else:
+            text = (
+                f"📢 <b>Broadcast ပို့နေပါသည်...</b>\n\n"
+                f"📨 {state['success'] + state['failed']}/{len(state['targets'])}\n"
+                f"✅ အောင်မြင်: {state['success']}\n❌ မအောင်မြင်: {state['failed']}"
+            )
+        try:
+            await self.bot.edit_message_text(
+                text, chat_id=state["admin_chat"], message_id=state["progress_msg"], parse_mode=ParseMode.HTML
+            )
+        except Exception:
+            # unchanged text, deleted message...: progress is best effort
+            logger.debug("Could not update broadcast progress", exc_info=True)
+
+
+broadcast_job = None
+
+
+def resume_broadcast(bot):
+    """Continue a broadcast that was interrupted by a restart."""
+    global broadcast_job
+    state = data.get("broadcast")
+    if state:
+        logger.info("Resuming broadcast at %d/%d", state["cursor"], len(state["targets"]))
+        broadcast_job = BroadcastJob(bot, state).start()
 
 
 # ----------------- COMMAND HANDLERS -----------------
+@serialized(user_scope)
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     get_user(user.id)  # initialize if needed
-    await save_data_safe()
+    mark_dirty("users", uid_str(user.id))
 
     welcome_text = (
         f"👋 <b>ကြိုဆိုပါတယ် {safe_name(user.first_name)}!</b>\n\n"
@@ -197,7 +3359,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "🎮 <b>ဂိမ်းနည်းလမ်း:</b>\n"
         "• /slime - ကဒ်များကောက်ယူပါ\n"
         "• /harem - သင့် collection ကြည့်ပါ\n"
-        "• /shop - ဆိုင်\n"
+        "• /shop [rarity] [name] - ဆိုင်\n"
         "• /daily - နေ့စဉ်ဆု\n\n"
         "💰 ဂိမ်း: /slots <amount>, /basket <amount>\n\n"
         "━━━━━━━━━━━━━━━━\nCreate by : @Enoch_777"
@@ -208,6 +3370,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 # --------- SLIME (claim dropped card) ----------
+@serialized(claim_scope)
 async def slime(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message:
         return
@@ -219,13 +3382,12 @@ async def slime(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     chat_id = str(update.effective_chat.id)
-    dropped_cards = data.get("dropped_cards", {})
-    if chat_id not in dropped_cards:
+    # the chat's drop lives on the chat's shard, which may not be this one
+    dropped_card = await shard_rpc(shard_of(chat_id), "drop", chat_id)
+    if not dropped_card:
         await update.message.reply_text("❌ လောလောဆယ် card ကျထားတာမရှိပါဘူး!")
         return
 
-    dropped_card = dropped_cards[chat_id]
-
     if not context.args:
         await update.message.reply_text("❌ Character အမည်ရေးပါ!\nဥပမာ: /slime <character name>")
         return
@@ -235,19 +3397,19 @@ async def slime(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(f"❌ မှားပါတယ်! {safe_name(update.effective_user.first_name)}")
         return
 
-    user = get_user(user_id)
-    new_card = dropped_card.copy()
-    new_card["id"] = f"{dropped_card['id']}_{random.randint(1000,9999)}"
-
-    user["harem"].append(new_card)
-    user["last_slime"] = datetime.now().isoformat()
-
-    try:
-        del data["dropped_cards"][chat_id]
-    except KeyError:
-        pass
+    # drops made by older versions carry no card_id
+    new_card = new_record(dropped_card.get("card_id") or compact_card(dropped_card)[0])
 
-    await save_data_safe()
+    if owns(chat_id):
+        apply_op("claim", chat_id, uid_str(user_id), new_card, datetime.now().isoformat())
+    else:
+        if not await shard_rpc(shard_of(chat_id), "take_drop", chat_id, dropped_card["id"]):
+            await update.message.reply_text("❌ လောလောဆယ် card ကျထားတာမရှိပါဘူး!")
+            return
+        apply_op("harem", uid_str(user_id), new_card)
+        apply_op("touch", uid_str(user_id), "slime", datetime.now().isoformat())
+    await commit()
+    metrics.inc("bot_claims_total", chat=chat_id)
 
     rarity_emoji = RARITIES.get(dropped_card.get("rarity", "Common"), {}).get("emoji", "")
     await update.message.reply_text(
@@ -255,7 +3417,7 @@ async def slime(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"🎉 <b>အောင်မြင်ပါပြီ {safe_name(update.effective_user.first_name)}!</b>\n\n"
             f"{rarity_emoji} <b>{safe_name(dropped_card['name'])}</b>\n"
             f"🎬 {safe_name(dropped_card['movie'])}\n"
-            f"🆔 <code>{safe_name(new_card['id'])}</code>\n"
+            f"🆔 <code>{safe_name(instance_id(new_card))}</code>\n"
             f"✨ {safe_name(dropped_card['rarity'])}\n\n"
             f"သင့် harem ထဲသို့ ထည့်ပြီးပါပြီ! ✨"
         ),
@@ -293,10 +3455,12 @@ async def harem(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message = f"🎴 <b>{safe_name(update.effective_user.first_name)} ရဲ့ Collection</b>\n\n"
     message += f"💎 Total Cards: {len(all_cards)}\n\n"
 
-    for card in all_cards[start_idx:end_idx]:
+    owned = owned_movies(uid_str(user_id), user)
+    catalog = catalog_movies.of(data.get("cards", []))
+    for card in map(resolve, all_cards[start_idx:end_idx]):
         rarity_emoji = RARITIES.get(card.get("rarity", "Common"), {}).get("emoji", "")
-        movie_cards_owned = len([c for c in all_cards if c.get("movie") == card.get("movie")])
-        total_movie_cards = len([c for c in data.get("cards", []) if c.get("movie") == card.get("movie")])
+        movie_cards_owned = owned.get(card.get("movie"), 0)
+        total_movie_cards = catalog.get(card.get("movie"), 0)
         message += (
             f"{rarity_emoji} <b>{safe_name(card.get('name'))}</b>\n"
             f"🎬 {safe_name(card.get('movie'))} (own: {movie_cards_owned}/{total_movie_cards})\n"
@@ -344,10 +3508,12 @@ async def harem_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message = f"🎴 <b>{safe_name(query.from_user.first_name)} ရဲ့ Collection</b>\n\n"
     message += f"💎 Total Cards: {len(all_cards)}\n\n"
 
-    for card in all_cards[start_idx:end_idx]:
+    owned = owned_movies(uid_str(user_id), user)
+    catalog = catalog_movies.of(data.get("cards", []))
+    for card in map(resolve, all_cards[start_idx:end_idx]):
         rarity_emoji = RARITIES.get(card.get("rarity", "Common"), {}).get("emoji", "")
-        movie_cards_owned = len([c for c in all_cards if c.get("movie") == card.get("movie")])
-        total_movie_cards = len([c for c in data.get("cards", []) if c.get("movie") == card.get("movie")])
+        movie_cards_owned = owned.get(card.get("movie"), 0)
+        total_movie_cards = catalog.get(card.get("movie"), 0)
         message += (
             f"{rarity_emoji} <b>{safe_name(card.get('name'))}</b>\n"
             f"🎬 {safe_name(card.get('movie'))} (own: {movie_cards_owned}/{total_movie_cards})\n"
@@ -370,6 +3536,7 @@ async def harem_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 # --------- Set favorite card ----------
+@serialized(user_scope)
 async def set_fav(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message:
         return
@@ -382,13 +3549,14 @@ async def set_fav(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     card_id = context.args[0]
-    card = next((c for c in user["harem"] if c.get("id") == card_id), None)
-    if not card:
+    item = find_instance(uid_str(user_id), user, card_id)
+    if not item:
         await update.message.reply_text("❌ သင့် harem မှာ ဒီ card မရှိပါဘူး!")
         return
+    card = resolve(item)
 
-    user["fav_card"] = card_id
-    await save_data_safe()
+    apply_op("fav", uid_str(user_id), card_id)
+    await commit()
 
     rarity_emoji = RARITIES.get(card.get("rarity", "Common"), {}).get("emoji", "")
     await update.message.reply_text(
@@ -402,6 +3570,7 @@ async def set_fav(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 # --------- SLOTS ----------
+@serialized(user_scope)
 async def slots(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message:
         return
@@ -422,7 +3591,7 @@ async def slots(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(f"❌ Coins မလောက်ပါဘူး!\n💰 လက်ကျန်: {user['coins']} coins")
         return
 
-    user["coins"] -= bet
+    apply_op("coins", uid_str(user_id), -bet)
 
     symbols = ["🍒", "🍋", "🍊", "🍇", "⭐", "💎"]
     result = [random.choice(symbols) for _ in range(3)]
@@ -436,7 +3605,7 @@ async def slots(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if multiplier > 0:
         winnings = bet * multiplier
-        user["coins"] += winnings
+        apply_op("coins", uid_str(user_id), winnings)
         message = (
             f"🎰 <b>SLOT MACHINE</b> 🎰\n\n"
             f"{''.join(result)}\n\n"
@@ -453,11 +3622,12 @@ async def slots(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"💵 လက်ကျန်: {user['coins']} coins"
         )
 
-    await save_data_safe()
+    await commit()
     await update.message.reply_text(message, parse_mode=ParseMode.HTML)
 
 
 # --------- BASKET ----------
+@serialized(user_scope)
 async def basket(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message:
         return
@@ -478,7 +3648,7 @@ async def basket(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(f"❌ Coins မလောက်ပါဘူး!\n💰 လက်ကျန်: {user['coins']} coins")
         return
 
-    user["coins"] -= bet
+    apply_op("coins", uid_str(user_id), -bet)
 
     dice = await update.message.reply_dice(emoji="🏀")
     await asyncio.sleep(1.5)
@@ -492,7 +3662,7 @@ async def basket(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if value in [4, 5]:
         multiplier = 3 if value == 5 else 2
         winnings = bet * multiplier
-        user["coins"] += winnings
+        apply_op("coins", uid_str(user_id), winnings)
         message = (
             f"🏀 <b>BASKETBALL GAME</b> 🏀\n\n"
             f"🎯 <b>ဝင်ပါတယ်!</b>\n"
@@ -507,11 +3677,12 @@ async def basket(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"💵 လက်ကျန်: {user['coins']} coins"
         )
 
-    await save_data_safe()
+    await commit()
     await update.message.reply_text(message, parse_mode=ParseMode.HTML)
 
 
 # --------- GIVE COIN ----------
+@serialized(transfer_scope(0))
 async def givecoin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message:
         return
@@ -555,11 +3726,27 @@ async def givecoin(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ မိမိကိုယ်ကို coins မပို့နိုင်ပါဘူး!")
         return
 
-    receiver = get_user(target_user_id)
-    sender["coins"] -= amount
-    receiver["coins"] += amount
-
-    await save_data_safe()
+    apply_op("coins", uid_str(sender_id), -amount)
+    if not owns(uid_str(target_user_id)) and not await commit():
+        # the debit must be durable before another shard credits the target
+        apply_op("coins", uid_str(sender_id), amount)
+        await update.message.reply_text("❌ Coins ပို့ရန် မအောင်မြင်ပါ! ပြန်လည်ထည့်ပေးပြီးပါပြီ။")
+        return
+    try:
+        await deliver(uid_str(target_user_id), [["coins", amount]])
+    except ShardUnreachable:
+        logger.exception("Transfer to %s failed; refunding", target_user_id)
+        apply_op("coins", uid_str(sender_id), amount)
+        await commit()
+        await update.message.reply_text("❌ Coins ပို့ရန် မအောင်မြင်ပါ! ပြန်လည်ထည့်ပေးပြီးပါပြီ။")
+        return
+    except Exception:
+        # the target's shard may still apply the credit: a refund could create the coins twice
+        logger.exception("Transfer of %d coins from %s to %s has an unknown outcome; not refunded",
+                         amount, sender_id, target_user_id)
+        await update.message.reply_text("⚠️ Coins ပို့မှု အခြေအနေ မသေချာပါ! Admin ကို ဆက်သွယ်ပါ။")
+        return
+    await commit()
     await update.message.reply_text(
         (
             f"✅ <b>အောင်မြင်ပါတယ်!</b>\n\n"
@@ -586,6 +3773,7 @@ async def balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 # --------- DAILY ----------
+@serialized(user_scope)
 async def daily(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message:
         return
@@ -609,9 +3797,9 @@ async def daily(update: Update, context: ContextTypes.DEFAULT_TYPE):
             pass
 
     bonus = random.randint(5000, 50000)
-    user["coins"] += bonus
-    user["last_daily"] = datetime.now().isoformat()
-    await save_data_safe()
+    apply_op("coins", uid_str(user_id), bonus)
+    apply_op("touch", uid_str(user_id), "daily", datetime.now().isoformat())
+    await commit()
 
     await update.message.reply_text(
         (
@@ -625,44 +3813,121 @@ async def daily(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 # --------- SHOP & Shop callback ----------
+SHOP_PAGE_SIZE = 5
+
+
+def shop_filters(args):
+    """/shop [rarity] [movie <movie> | <name prefix>] -> (rarity, movie, name)."""
+    args = list(args)
+    rarity = movie = name = None
+    if args and args[0].title() in RARITIES:
+        rarity = args.pop(0).title()
+    if args and args[0].lower() == "movie":
+        movie = " ".join(args[1:]) or None
+    elif args:
+        name = " ".join(args)
+    return rarity, movie, name
+
+
+def movie_tag(movie) -> str:
+    return format(zlib.crc32(normalize(movie).encode()), "08x")
+
+
+def shop_data(page: int, rarity, movie, name) -> str:
+    """
+    Callback data for a shop page: shop_<page>_<rarity index>_<m tag | n prefix>.
+    Movies travel as a crc32 tag (callback data is capped at 64 bytes); a long
+    name prefix is cut, which only widens the match.
+    """
+    head = f"shop_{page}_{list(RARITIES).index(rarity) if rarity in RARITIES else ''}_"
+    if movie:
+        return head + "m" + movie_tag(movie)
+    if name:
+        return head + ("n" + name).encode()[:64 - len(head)].decode("utf-8", "ignore")
+    return head
+
+
+def parse_shop_data(payload: str):
+    """Inverse of shop_data (without the "shop_" prefix) -> (page, rarity, movie, name)."""
+    parts = payload.split("_", 2)
+    page = int(parts[0])
+    if len(parts) < 3:  # shop_<card index> buttons from older versions
+        return page // SHOP_PAGE_SIZE, None, None, None
+    rarity = list(RARITIES)[int(parts[1])] if parts[1].isdigit() and int(parts[1]) < len(RARITIES) else None
+    kind, text = parts[2][:1], parts[2][1:]
+    movie = name = None
+    if kind == "m":
+        movie = text
+        for key, cards in catalog_search.of(data.get("cards", [])).by_movie.items():
+            if cards and movie_tag(key) == text:
+                movie = next(iter(cards.values())).get("movie")
+                break
+    elif kind == "n":
+        name = text
+    return page, rarity, movie, name
+
+
+def shop_page(page: int, rarity=None, movie=None, name=None):
+    """(message, reply_markup) for one page of the filtered catalog."""
+    cards = catalog_search.of(data.get("cards", [])).search(rarity, movie, name)
+    filters = " · ".join(
+        f for f in (
+            rarity and f"✨ {safe_name(rarity)}",
+            movie and f"🎬 {safe_name(movie)}",
+            name and f"🔎 {safe_name(name)}",
+        ) if f
+    )
+    if not cards:
+        return (
+            f"🏪 <b>CHARACTER SHOP</b>\n\n{filters}\n\n❌ ရှာမတွေ့ပါဘူး!\n"
+            f"💡 /shop [rarity] [name] သို့မဟုတ် /shop [rarity] movie &lt;movie&gt;"
+        ), None
+    total_pages = (len(cards) + SHOP_PAGE_SIZE - 1) // SHOP_PAGE_SIZE
+    page = page if 0 <= page < total_pages else 0
+
+    message = "🏪 <b>CHARACTER SHOP</b>\n\n"
+    if filters:
+        message += f"{filters}\n\n"
+    buy_buttons = []
+    for n, card in enumerate(cards[page * SHOP_PAGE_SIZE:(page + 1) * SHOP_PAGE_SIZE], 1):
+        rarity_info = RARITIES.get(card.get("rarity", "Common"), {})
+        message += (
+            f"{n}. {rarity_info.get('emoji', '')} <b>{safe_name(card.get('name'))}</b>\n"
+            f"🎬 {safe_name(card.get('movie'))} · ✨ {safe_name(card.get('rarity'))}\n"
+            f"💰 ဈေးနှုန်း: <b>{rarity_info.get('price', 0):,} coins</b>\n\n"
+        )
+        buy_buttons.append(InlineKeyboardButton(f"✅ {n}", callback_data=f"buy_{card.get('id')}"))
+    message += f"📦 Cards: {len(cards)}"
+
+    nav_buttons = []
+    if page > 0:
+        nav_buttons.append(InlineKeyboardButton("⬅️ Prev", callback_data=shop_data(page - 1, rarity, movie, name)))
+    nav_buttons.append(InlineKeyboardButton(f"📄 {page+1}/{total_pages}", callback_data="page_info"))
+    if page < total_pages - 1:
+        nav_buttons.append(InlineKeyboardButton("➡️ Next", callback_data=shop_data(page + 1, rarity, movie, name)))
+    return message, InlineKeyboardMarkup([buy_buttons, nav_buttons])
+
+
 async def shop(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message:
         return
     if not data.get("cards"):
         await update.message.reply_text("❌ ဆိုင်မှာ card များမရှိသေးပါဘူး!")
         return
-
-    idx = 0
-    card = data["cards"][idx]
-    rarity_emoji = RARITIES.get(card.get("rarity", "Common"), {}).get("emoji", "")
-    price = RARITIES.get(card.get("rarity", "Common"), {}).get("price", 0)
-
-    message = (
-        f"🏪 <b>CHARACTER SHOP</b>\n\n"
-        f"{rarity_emoji} <b>{safe_name(card.get('name'))}</b>\n"
-        f"🎬 {safe_name(card.get('movie'))}\n"
-        f"✨ {safe_name(card.get('rarity'))}\n"
-        f"💰 ဈေးနှုန်း: <b>{price:,} coins</b>\n\n"
-        f"📦 Card {idx+1}/{len(data['cards'])}"
-    )
-
-    keyboard = [
-        [
-            InlineKeyboardButton("✅ ဝယ်မယ်", callback_data=f"buy_{idx}"),
-            InlineKeyboardButton("➡️ Next", callback_data=f"shop_{(idx+1)%len(data['cards'])}")
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+
+    message, reply_markup = shop_page(0, *shop_filters(context.args or []))
     await update.message.reply_text(message, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
 
 
+@serialized(user_scope)
 async def shop_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
     try:
-        action, idx = query.data.split("_")
-        idx = int(idx)
+        action, payload = query.data.split("_", 1)
+        if action == "shop":
+            page, rarity, movie, name = parse_shop_data(payload)
     except Exception:
         await query.answer("Invalid action", show_alert=True)
         return
@@ -670,22 +3935,25 @@ async def shop_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if action == "buy":
         user_id = query.from_user.id
         user = get_user(user_id)
-        if idx < 0 or idx >= len(data["cards"]):
+        if payload.isdigit():  # buy_<card index> buttons from older versions
+            cards = data.get("cards", [])
+            card = cards[int(payload)] if int(payload) < len(cards) else None
+        else:
+            card = catalog_ids.of(data.get("cards", [])).get(payload)
+        if card is None:
             await query.answer("Card not found", show_alert=True)
             return
-        card = data["cards"][idx]
         price = RARITIES.get(card.get("rarity", "Common"), {}).get("price", 0)
 
         if user["coins"] < price:
             await query.answer(f"❌ Coins မလောက်ပါဘူး! လိုအပ်တယ်: {price:,} coins", show_alert=True)
             return
 
-        new_card = card.copy()
-        new_card["id"] = f"{card['id']}_{random.randint(1000,9999)}"
+        new_card = new_record(card["id"])
 
-        user["coins"] -= price
-        user["harem"].append(new_card)
-        await save_data_safe()
+        apply_op("coins", uid_str(user_id), -price)
+        apply_op("harem", uid_str(user_id), new_card)
+        await commit()
 
         rarity_emoji = RARITIES.get(card.get("rarity", "Common"), {}).get("emoji", "")
         await query.edit_message_text(
@@ -701,32 +3969,92 @@ async def shop_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     elif action == "shop":
-        if idx < 0 or not data.get("cards"):
-            idx = 0
-        else:
-            idx = idx % len(data["cards"])
+        message, reply_markup = shop_page(page, rarity, movie, name)
+        await query.edit_message_text(message, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
 
-        card = data["cards"][idx]
-        rarity_emoji = RARITIES.get(card.get("rarity", "Common"), {}).get("emoji", "")
-        price = RARITIES.get(card.get("rarity", "Common"), {}).get("price", 0)
 
-        message = (
-            f"🏪 <b>CHARACTER SHOP</b>\n\n"
-            f"{rarity_emoji} <b>{safe_name(card.get('name'))}</b>\n"
+# --------- INLINE SEARCH ----------
+INLINE_PAGE_SIZE = 50  # Telegram's limit per answer
+INLINE_RESULTS_SIZE = 1000  # recent queries whose matches stay cached
+inline_results = OrderedDict()  # (scope, user_key, query) -> (signature, matches), least recent first
+
+
+def inline_matches(scope: str, user_key: str, text: str):
+    """
+    Catalog cards (scope "catalog") or harem entries (scope "harem") matching
+    `text`, read with the /shop filter syntax. Paging through next_offset
+    repeats the same query, so matches are kept in a small LRU and reused
+    until the catalog or the harem changes.
+    """
+    search = catalog_search.of(data.get("cards", []))
+    harem = None
+    if scope == "harem":
+        # read-only: an inline query must not create (and persist) a user record
+        user = data["users"].get(user_key)
+        if user is None:
+            return []
+        compact_harem(user_key, user)
+        harem = user["harem"]
+    signature = search.version if harem is None else (search.version, id(harem), len(harem))
+    key = (scope, user_key if harem is not None else None, normalize(text))
+    cached = inline_results.get(key)
+    if cached is not None and cached[0] == signature:
+        inline_results.move_to_end(key)
+        return cached[1]
+
+    filters = shop_filters(text.split())
+    if harem is None:
+        matches = search.search(*filters)
+    elif any(filters):
+        ids = {card.get("id") for card in search.search(*filters)}
+        matches = [item for item in harem if item[0] in ids]
+    else:
+        matches = list(reversed(harem))  # newest first
+    inline_results[key] = (signature, matches)
+    if len(inline_results) > INLINE_RESULTS_SIZE:
+        inline_results.popitem(last=False)
+    return matches
+
+
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """@bot [rarity] <name> searches the catalog; @bot harem [rarity] <name> the caller's collection."""
+    query = update.inline_query
+    if query is None:
+        return
+    words = query.query.split(maxsplit=1)
+    scope, text = "catalog", query.query
+    if words and words[0].lower() == "harem":
+        scope, text = "harem", words[1] if len(words) > 1 else ""
+    matches = inline_matches(scope, uid_str(query.from_user.id), text)
+    offset = int(query.offset) if query.offset.isdigit() else 0
+
+    results = []
+    for n, item in enumerate(matches[offset:offset + INLINE_PAGE_SIZE], offset):
+        card = resolve(item) if scope == "harem" else item
+        if not card.get("photo"):
+            continue
+        rarity_info = RARITIES.get(card.get("rarity", "Common"), {})
+        caption = (
+            f"{rarity_info.get('emoji', '')} <b>{safe_name(card.get('name'))}</b>\n"
             f"🎬 {safe_name(card.get('movie'))}\n"
             f"✨ {safe_name(card.get('rarity'))}\n"
-            f"💰 ဈေးနှုန်း: <b>{price:,} coins</b>\n\n"
-            f"📦 Card {idx+1}/{len(data['cards'])}"
         )
-
-        buttons = [
-            InlineKeyboardButton("✅ ဝယ်မယ်", callback_data=f"buy_{idx}"),
-            InlineKeyboardButton("➡️ Next", callback_data=f"shop_{(idx+1)%len(data['cards'])}")
-        ]
-        if idx > 0:
-            buttons.insert(0, InlineKeyboardButton("⬅️ Prev", callback_data=f"shop_{idx-1}"))
-        reply_markup = InlineKeyboardMarkup([buttons])
-        await query.edit_message_text(message, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+        caption += (
+            f"🆔 <code>{safe_name(card.get('id'))}</code>" if scope == "harem"
+            else f"💰 {rarity_info.get('price', 0):,} coins"
+        )
+        results.append(InlineQueryResultCachedPhoto(
+            id=f"{n}:{card.get('id')}"[:64], photo_file_id=card["photo"], caption=caption, parse_mode=ParseMode.HTML,
+        ))
+
+    more = offset + INLINE_PAGE_SIZE < len(matches)
+    await query.answer(
+        results,
+        # a harem answer is personal and changes with every /slime
+        cache_time=INLINE_HAREM_CACHE_TIME if scope == "harem" else INLINE_CACHE_TIME,
+        is_personal=scope == "harem",
+        next_offset=str(offset + INLINE_PAGE_SIZE) if more else "",
+    )
 
 
 # --------- TOPS ----------
@@ -743,6 +4071,9 @@ async def tops(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("🏆 <b>LEADERBOARD</b>\n\nဘာကိုကြည့်ချင်ပါသလဲ?", reply_markup=reply_markup, parse_mode=ParseMode.HTML)
 
 
+tops_pages = {}  # board -> (top users it shows, rendered page)
+
+
 async def tops_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -752,13 +4083,18 @@ async def tops_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception:
         top_type = "coins"
 
-    if top_type == "coins":
-        sorted_users = sorted(data["users"].items(), key=lambda x: x[1].get("coins", 0), reverse=True)[:10]
+    board = leaderboards["coins" if top_type == "coins" else "harem"]
+    sorted_users = await global_top(board.by)
+    cached = tops_pages.get(board.by)
+    if cached and cached[0] == sorted_users:
+        await query.edit_message_text(cached[1], parse_mode=ParseMode.HTML)
+        return
+
+    if board.by == "coins":
         title = "💰 <b>TOP 10 - RICHEST PLAYERS</b>"
         value_key = "coins"
         emoji = "💵"
     else:
-        sorted_users = sorted(data["users"].items(), key=lambda x: len(x[1].get("harem", [])), reverse=True)[:10]
         title = "🎴 <b>TOP 10 - CARD COLLECTORS</b>"
         value_key = "harem"
         emoji = "🎴"
@@ -766,26 +4102,23 @@ async def tops_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message = f"{title}\n\n"
     medals = ["🥇", "🥈", "🥉"]
 
-    for i, (user_id_str, user_data) in enumerate(sorted_users):
-        try:
-            user_chat = await context.bot.get_chat(int(user_id_str))
-            name = user_chat.first_name or "Unknown"
-        except Exception:
-            name = "Unknown"
+    names = await display_names(context.bot, [user_id_str for user_id_str, _ in sorted_users])
+    for i, (user_id_str, value) in enumerate(sorted_users):
+        name = names[user_id_str]
         medal = medals[i] if i < 3 else f"{i+1}."
         if value_key == "coins":
-            value = int(user_data.get("coins", 0))
-            message += f"{medal} <b>{safe_name(name)}</b> - {emoji} {value:,}\n"
+            message += f"{medal} <b>{safe_name(name)}</b> - {emoji} {int(value):,}\n"
         else:
-            value = len(user_data.get("harem", []))
             message += f"{medal} <b>{safe_name(name)}</b> - {emoji} {value}\n"
 
     message += "\n━━━━━━━━━━━━━━━━\nCreate by : @Enoch_777"
+    tops_pages[board.by] = (sorted_users, message)
 
     await query.edit_message_text(message, parse_mode=ParseMode.HTML)
 
 
 # --------- MESSAGE COUNTER (card drops) ----------
+@serialized(chat_scope)
 async def message_counter(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message:
         return
@@ -793,20 +4126,20 @@ async def message_counter(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if chat.type == "private":
         return
 
+    # hot path: O(1) in memory, no disk I/O (see ChatCheckpoint)
     chat_id = str(chat.id)
-    if chat_id not in data["group_messages"]:
-        data["group_messages"][chat_id] = 0
-    data["group_messages"][chat_id] += 1
+    counts = data["group_messages"]
+    counts[chat_id] = counts.get(chat_id, 0) + 1
+    mark_dirty("group_messages", chat_id)
 
-    if data["group_messages"][chat_id] >= data.get("drop_count", DROP_COUNT):
-        data["group_messages"][chat_id] = 0
+    if counts[chat_id] >= data.get("drop_count", DROP_COUNT):
+        counts[chat_id] = 0
         if data.get("cards"):
-            card = random.choice(data["cards"]).copy()
-            card["id"] = f"{card['id']}_{random.randint(1000,9999)}"
-            if "dropped_cards" not in data:
-                data["dropped_cards"] = {}
-            data["dropped_cards"][chat_id] = card
-            await save_data_safe()
+            picked = drops.sample()
+            card = dict(picked, id=f"{picked['id']}_{random.randint(1000,9999)}", card_id=picked["id"])
+            # not journaled: a drop lost in a crash is harmless
+            _op_drop(chat_id, card)
+            metrics.inc("bot_drops_total", chat=chat_id)
 
             rarity_emoji = RARITIES.get(card.get("rarity", "Common"), {}).get("emoji", "")
             masked = "█" * len(card.get("name", ""))
@@ -824,6 +4157,188 @@ async def message_counter(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 # ----------------- ADMIN COMMANDS -----------------
+# Bulk import: /upload replied to an album, a CSV/JSON manifest or a zip
+# (manifest plus images). Every source becomes a list of entries
+# {"name", "movie", "rarity", "photo"}; photos are file_ids, image bytes or
+# URLs until upload_photos() turns them into file_ids. The batch lands in the
+# catalog as one change: one flush, one publish_globals.
+UPLOAD_FORMAT = "Character Name | Movie Name | Rarity"
+MANIFEST_FIELDS = ("name", "movie", "rarity", "photo")
+MAX_IMPORT_BYTES = 20 * 1024 * 1024  # Bot API download limit
+MAX_PHOTO_BYTES = 10 * 1024 * 1024  # Bot API photo upload limit
+ALBUM_BUFFER_SIZE = 50
+albums = OrderedDict()  # media_group_id -> [(file_id, caption)] of recent admin albums
+
+
+async def track_albums(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """An album arrives as one message per photo; keep it so /upload can import all of it."""
+    message = update.message
+    if not message or not message.media_group_id or not is_admin(message.from_user.id):
+        return
+    albums.setdefault(message.media_group_id, []).append((message.photo[-1].file_id, message.caption))
+    albums.move_to_end(message.media_group_id)
+    if len(albums) > ALBUM_BUFFER_SIZE:
+        albums.popitem(last=False)
+
+
+def allocate_card_id() -> str:
+    """Next catalog id from data["next_card"]; ids are never reused, even after /delete."""
+    number = max(data.get("next_card", 1), len(data.get("cards", [])) + 1)
+    while card_info(f"card_{number}") is not None:  # ids handed out before the counter existed
+        number += 1
+    data["next_card"] = number + 1
+    mark_dirty("next_card")
+    return f"card_{number}"
+
+
+def parse_caption(caption):
+    """Entry for an "Name | Movie | Rarity" caption, or None."""
+    parts = [p.strip() for p in (caption or "").split("|", maxsplit=2)]
+    if len(parts) != 3:
+        return None
+    return dict(zip(MANIFEST_FIELDS, parts))
+
+
+def read_manifest(filename: str, raw: bytes):
+    """Entries of a JSON list (or {"cards": [...]}) or a CSV with name,movie,rarity,photo columns."""
+    text = raw.decode("utf-8-sig")
+    if filename.lower().endswith(".json"):
+        rows = json.loads(text)
+        if isinstance(rows, dict):
+            rows = rows.get("cards", [])
+        return [dict(row) for row in rows if isinstance(row, dict)]
+    rows = [row for row in csv.reader(io.StringIO(text)) if any(cell.strip() for cell in row)]
+    header = MANIFEST_FIELDS
+    if rows and "name" in (cell.strip().lower() for cell in rows[0]):
+        header, rows = [cell.strip().lower() for cell in rows[0]], rows[1:]
+    return [dict(zip(header, (cell.strip() for cell in row))) for row in rows]
+
+
+def read_archive(raw: bytes):
+    """Entries of a zip holding one manifest; a photo naming a file in the zip gets its bytes."""
+    with zipfile.ZipFile(io.BytesIO(raw)) as archive:
+        members = {info.filename: info for info in archive.infolist() if not info.is_dir()}
+        manifest = next((name for name in members if name.lower().endswith((".csv", ".json"))), None)
+        if manifest is None:
+            raise ValueError("zip ထဲမှာ manifest (.csv / .json) မပါပါဘူး")
+        entries = read_manifest(manifest, archive.read(manifest))
+        base = os.path.dirname(manifest)
+        for entry in entries:
+            photo = str(entry.get("photo") or "")
+            info = members.get(os.path.join(base, photo)) or members.get(photo)
+            if info is None:
+                continue
+            if info.file_size > MAX_PHOTO_BYTES:
+                entry["error"] = "photo > 10MB"
+            else:
+                entry["photo"] = archive.read(info)
+    return entries
+
+
+def check_entry(entry, seen):
+    """Why `entry` cannot be imported, or None; also tidies its fields. `seen` holds the batch's keys."""
+    if entry.get("error"):
+        return entry["error"]
+    name, movie = str(entry.get("name") or "").strip(), str(entry.get("movie") or "").strip()
+    rarity = str(entry.get("rarity") or "").strip().title()
+    if not name or not movie:
+        return "name / movie မပါ"
+    if rarity not in RARITIES:
+        return f"rarity မှား ({rarity})"
+    photo = entry.get("photo")
+    if not photo:
+        return "photo မပါ"
+    if isinstance(photo, str) and not photo.startswith(("http://", "https://")) and os.path.splitext(photo)[1]:
+        return f"photo ဖိုင် မတွေ့ ({photo})"  # a file name with no matching file in the zip
+    key = (normalize(name), normalize(movie))
+    if key in seen or key in catalog_search.of(data.get("cards", [])).by_key:
+        return "duplicate"
+    seen.add(key)
+    entry.update(name=name, movie=movie, rarity=rarity)
+    return None
+
+
+async def upload_photos(bot, chat_id, entries):
+    """Send image bytes and URLs to `chat_id`, ten per call, and keep the file_ids Telegram assigns."""
+    pending = [e for e in entries if not isinstance(e["photo"], str) or e["photo"].startswith(("http://", "https://"))]
+    for start in range(0, len(pending), 10):
+        chunk = pending[start:start + 10]
+        while True:
+            try:
+                if len(chunk) == 1:
+                    sent = [await bot.send_photo(chat_id, chunk[0]["photo"], disable_notification=True)]
+                else:
+                    sent = await bot.send_media_group(
+                        chat_id, [InputMediaPhoto(e["photo"]) for e in chunk], disable_notification=True
+                    )
+                break
+            except RetryAfter as e:
+                await asyncio.sleep(float(e.retry_after))
+            except Exception as e:
+                logger.warning("Photo upload failed: %s", e)
+                sent = []
+                break
+        for entry, message in zip(chunk, sent):
+            entry["photo"] = message.photo[-1].file_id
+        for entry in chunk[len(sent):]:
+            entry["error"] = "photo upload မအောင်မြင်"
+
+
+def add_cards(entries):
+    """Append checked entries to the catalog as one change; returns the new cards."""
+    cards = data["cards"]
+    search = catalog_search.of(cards)
+    added = []
+    for entry in entries:
+        card = {k: entry[k] for k in MANIFEST_FIELDS}
+        if search.key_of(card) in search.by_key:  # uploaded meanwhile by another /upload
+            entry["error"] = "duplicate"
+            continue
+        card = {"id": allocate_card_id(), **card}
+        cards.append(card)
+        for index in (catalog_movies, catalog_ids, catalog_search, drops):
+            index.added(cards, card)
+        added.append(card)
+    if added:
+        mark_dirty("cards")
+    return added
+
+
+async def import_entries(bot, chat_id, entries):
+    """Check, upload photos, add and persist; returns (added cards, [(row, reason)])."""
+    seen = set()
+    skipped = []
+    ok = []
+    for row, entry in enumerate(entries, 1):
+        reason = check_entry(entry, seen)
+        if reason:
+            skipped.append((row, reason))
+        else:
+            ok.append((row, entry))
+    await upload_photos(bot, chat_id, [entry for _, entry in ok])
+    skipped += [(row, entry["error"]) for row, entry in ok if entry.get("error")]
+    ready = [(row, entry) for row, entry in ok if not entry.get("error")]
+    added = add_cards([entry for _, entry in ready])
+    skipped += [(row, entry["error"]) for row, entry in ready if entry.get("error")]
+    if added:
+        await persistence.flush()
+        await publish_globals("cards")
+    return added, sorted(skipped)
+
+
+async def read_document(bot, document):
+    """Entries of an uploaded manifest or zip."""
+    if document.file_size and document.file_size > MAX_IMPORT_BYTES:
+        raise ValueError("file > 20MB")
+    raw = bytes(await (await bot.get_file(document.file_id)).download_as_bytearray())
+    filename = (document.file_name or "").lower()
+    if filename.endswith(".zip") or zipfile.is_zipfile(io.BytesIO(raw)):
+        return read_archive(raw)
+    if filename.endswith((".csv", ".json")):
+        return read_manifest(filename, raw)
+    raise ValueError(".csv / .json / .zip ဖိုင်သာ လက်ခံပါတယ်")
+
+
 async def upload(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message:
         return
@@ -833,46 +4348,72 @@ async def upload(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     target_msg = update.message.reply_to_message or update.message
-    caption = target_msg.caption or update.message.caption
-    photo_obj = None
-    if target_msg.photo:
-        photo_obj = target_msg.photo[-1]
-    elif update.message.photo:
-        photo_obj = update.message.photo[-1]
-
-    if not caption or not photo_obj:
-        await update.message.reply_text(
-            "❌ အသုံးပြုနည်း:\nPhoto နဲ့ caption ပေးပို့ပါ:\n`Character Name | Movie Name | Rarity`"
-        )
-        return
+    if target_msg.document:
+        try:
+            entries = await read_document(context.bot, target_msg.document)
+        except Exception as e:
+            await update.message.reply_text(f"❌ ဖိုင်ဖတ်မရပါ: {safe_name(e)}", parse_mode=ParseMode.HTML)
+            return
+    elif target_msg.media_group_id and target_msg.media_group_id in albums:
+        entries = [
+            dict(parse_caption(caption) or {"error": "caption format မှား"}, photo=file_id)
+            for file_id, caption in albums.pop(target_msg.media_group_id)
+        ]
+    else:
+        caption = target_msg.caption or update.message.caption
+        photo_obj = None
+        if target_msg.photo:
+            photo_obj = target_msg.photo[-1]
+        elif update.message.photo:
+            photo_obj = update.message.photo[-1]
+
+        if not caption or not photo_obj:
+            await update.message.reply_text(
+                "❌ အသုံးပြုနည်း:\nPhoto နဲ့ caption ပေးပို့ပါ:\n`Character Name | Movie Name | Rarity`\n\n"
+                "Album, .csv / .json manifest (name,movie,rarity,photo) သို့မဟုတ် .zip ကို reply လုပ်ပြီး "
+                "အများကြီးတစ်ခါတည်း တင်နိုင်ပါတယ်။"
+            )
+            return
 
-    parts = [p.strip() for p in caption.split("|", maxsplit=2)]
-    if len(parts) != 3:
-        await update.message.reply_text("❌ Format မှားနေပါတယ်! အသုံးပြုနည်း: Character Name | Movie Name | Rarity")
-        return
+        entry = parse_caption(caption)
+        if entry is None:
+            await update.message.reply_text(f"❌ Format မှားနေပါတယ်! အသုံးပြုနည်း: {UPLOAD_FORMAT}")
+            return
+        if entry["rarity"].title() not in RARITIES:
+            await update.message.reply_text(f"❌ Rarity မှားနေပါတယ်! ရွေးချယ်နိုင်တာများ: {', '.join(RARITIES.keys())}")
+            return
+        entries = [dict(entry, photo=photo_obj.file_id)]
 
-    char_name, movie_name, rarity = parts
-    rarity = rarity.title()
-    if rarity not in RARITIES:
-        await update.message.reply_text(f"❌ Rarity မှားနေပါတယ်! ရွေးချယ်နိုင်တာများ: {', '.join(RARITIES.keys())}")
+    if not entries:
+        await update.message.reply_text("❌ တင်စရာ card မတွေ့ပါဘူး!")
         return
+    added, skipped = await import_entries(context.bot, update.effective_chat.id, entries)
 
-    card_id = f"card_{len(data.get('cards', [])) + 1}"
-    card = {"id": card_id, "name": char_name, "movie": movie_name, "rarity": rarity, "photo": photo_obj.file_id}
-    data["cards"].append(card)
-    await save_data_safe()
+    if len(entries) == 1 and added:
+        card = added[0]
+        rarity_emoji = RARITIES[card["rarity"]]["emoji"]
+        await update.message.reply_text(
+            (
+                f"✅ <b>Card တင်ပြီးပါပြီ!</b>\n\n"
+                f"{rarity_emoji} <b>{safe_name(card['name'])}</b>\n"
+                f"🎬 {safe_name(card['movie'])}\n"
+                f"🆔 <code>{safe_name(card['id'])}</code>\n"
+                f"✨ {safe_name(card['rarity'])}"
+            ),
+            parse_mode=ParseMode.HTML,
+        )
+        return
 
-    rarity_emoji = RARITIES[rarity]["emoji"]
-    await update.message.reply_text(
-        (
-            f"✅ <b>Card တင်ပြီးပါပြီ!</b>\n\n"
-            f"{rarity_emoji} <b>{safe_name(char_name)}</b>\n"
-            f"🎬 {safe_name(movie_name)}\n"
-            f"🆔 <code>{safe_name(card_id)}</code>\n"
-            f"✨ {safe_name(rarity)}"
-        ),
-        parse_mode=ParseMode.HTML,
-    )
+    message = f"✅ <b>Card {len(added)} ခု တင်ပြီးပါပြီ!</b>\n"
+    if added:
+        message += f"🆔 <code>{safe_name(added[0]['id'])}</code> … <code>{safe_name(added[-1]['id'])}</code>\n"
+    if skipped:
+        message += f"\n⏭ ကျော်ခဲ့တာ: {len(skipped)}\n"
+        for row, reason in skipped[:15]:
+            message += f"• #{row}: {safe_name(reason)}\n"
+        if len(skipped) > 15:
+            message += "…\n"
+    await update.message.reply_text(message, parse_mode=ParseMode.HTML)
 
 
 async def setdrop(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -890,10 +4431,13 @@ async def setdrop(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ အနည်းဆုံး 1 ဖြစ်ရပါမယ်!")
         return
     data["drop_count"] = count
-    await save_data_safe()
+    mark_dirty("drop_count")
+    await persistence.flush()
+    await publish_globals("drop_count")
     await update.message.reply_text(f"✅ Card drop count ကို <b>{count}</b> messages သတ်မှတ်ပြီးပါပြီ!", parse_mode=ParseMode.HTML)
 
 
+@serialized(transfer_scope(2))
 async def gift(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message:
         return
@@ -932,23 +4476,37 @@ async def gift(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if sub == "coin":
-        target_user = get_user(target_user_id)
-        target_user["coins"] += amount
-        await save_data_safe()
+        if not await gift_ops(update, target_user_id, [["coins", amount]]):
+            return
         await update.message.reply_text(f"✅ <b>{amount:,} coins ပေးပြီးပါပြီ!</b>\n👤 User ID: <code>{target_user_id}</code>", parse_mode=ParseMode.HTML)
     else:
         if not data.get("cards"):
             await update.message.reply_text("❌ Card များမရှိသေးပါဘူး!")
             return
-        target_user = get_user(target_user_id)
-        for _ in range(amount):
-            card = random.choice(data["cards"]).copy()
-            card["id"] = f"{card['id']}_{random.randint(1000,9999)}"
-            target_user["harem"].append(card)
-        await save_data_safe()
+        ops = []
+        for picked in drops.sample_many(amount):
+            ops.append(["harem", new_record(picked["id"])])
+        if not await gift_ops(update, target_user_id, ops):
+            return
         await update.message.reply_text(f"✅ <b>{amount} random cards ပေးပြီးပါပြီ!</b>\n👤 User ID: <code>{target_user_id}</code>", parse_mode=ParseMode.HTML)
 
 
+async def gift_ops(update: Update, target_user_id: int, ops) -> bool:
+    """Deliver an admin gift; on failure tell the admin whether it may still arrive (no blind retry)."""
+    try:
+        await deliver(uid_str(target_user_id), ops)
+        await commit()
+    except ShardUnreachable:
+        logger.exception("Gift to %s failed", target_user_id)
+        await update.message.reply_text("❌ ပေးရန် မအောင်မြင်ပါ! ထပ်ကြိုးစားပါ။")
+        return False
+    except Exception:
+        logger.exception("Gift to %s has an unknown outcome", target_user_id)
+        await update.message.reply_text("⚠️ ပေးမှု အခြေအနေ မသေချာပါ! User ရဲ့ balance ကို စစ်ပြီးမှ ထပ်ပေးပါ။")
+        return False
+    return True
+
+
 async def edit_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message:
         return
@@ -959,13 +4517,15 @@ async def edit_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     admin_commands = (
         "🔧 <b>ADMIN COMMANDS</b>\n\n"
-        "📤 /upload - Card အသစ်တင်ရန် (reply photo + caption)\n"
+        "📤 /upload - Card အသစ်တင်ရန် (reply photo + caption / album / .csv .json .zip)\n"
         "⚙️ /setdrop <number> - Card drop count သတ်မှတ်ရန်\n"
         "💰 /gift coin <amount> <user_id> - Coins ပေးရန်\n"
         "🎴 /gift card <amount> <user_id> - Cards ပေးရန်\n"
         "📢 /broadcast - Message ပို့ရန် (reply the message)\n"
         "📊 /stats - Statistics ကြည့်ရန်\n"
-        "💾 /backup - Data backup လုပ်ရန်\n"
+        "🔬 /profile [seconds] - Bot ကို profile လုပ်ရန်\n"
+        "🧠 /memory [N|trace|diff|stop] - Memory သုံးစွဲမှုကြည့်ရန်\n"
+        "💾 /backup [delta] - Data backup လုပ်ရန် (gzip)\n"
         "♻️ /restore - Data ပြန်ယူရန် (reply with file)\n"
         "🗑️ /allclear - Data အားလုံးဖျက်ရန်\n"
         "❌ /delete <card_id> - Card ဖျက်ရန်\n"
@@ -997,19 +4557,19 @@ async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
         text = " ".join(context.args)
         photo = None
 
-    success = 0
-    failed = 0
-    for group_id in list(data.get("groups", {}).keys()):
-        try:
-            if photo:
-                await context.bot.send_photo(chat_id=int(group_id), photo=photo, caption=text)
-            else:
-                await context.bot.send_message(chat_id=int(group_id), text=text)
-            success += 1
-        except Exception:
-            failed += 1
+    global broadcast_job
+    if broadcast_job is not None and broadcast_job.alive and not broadcast_job.task.done():
+        await update.message.reply_text("⏳ Broadcast တစ်ခု ပို့နေဆဲဖြစ်ပါတယ်!")
+        return
 
-    await update.message.reply_text(f"📢 <b>Broadcast ပြီးပါပြီ!</b>\n\n✅ အောင်မြင်: {success}\n❌ မအောင်မြင်: {failed}", parse_mode=ParseMode.HTML)
+    targets = [group_id for part in await shard_gather("groups") for group_id in part]
+    progress = await update.message.reply_text(
+        f"📢 <b>Broadcast စတင်ပါပြီ!</b>\n\n📨 0/{len(targets)}", parse_mode=ParseMode.HTML
+    )
+    broadcast_job = BroadcastJob.create(context.bot, targets, text, photo, update.effective_chat.id, progress.message_id)
+    # checkpoint the job before the first send so a crash cannot lose it
+    await persistence.flush()
+    broadcast_job.start()
 
 
 async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1020,20 +4580,145 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Admin ဖြစ်မှသာ အသုံးပြုနိုင်ပါတယ်!")
         return
 
-    total_users = len(data.get("users", {}))
-    total_groups = len(data.get("groups", {}))
+    totals = await shard_gather("totals")
+    total_users = sum(t["users"] for t in totals)
+    total_groups = sum(t["groups"] for t in totals)
     total_cards = len(data.get("cards", []))
     stats_text = (
         f"📊 <b>BOT STATISTICS</b>\n\n"
         f"👥 Total Users: <b>{total_users}</b>\n"
         f"👥 Total Groups: <b>{total_groups}</b>\n"
         f"🎴 Total Cards: <b>{total_cards}</b>\n"
-        f"👑 Sudos: <b>{len(data.get('sudos', []))}</b>\n\n"
+        f"👑 Sudos: <b>{len(data.get('sudos', []))}</b>\n"
+        f"💾 Last save: <b>{persist_stats['snapshot_ms']:.1f}</b> ms snapshot, "
+        f"<b>{persist_stats['write_ms']:.1f}</b> ms write, <b>{persist_stats['bytes']:,}</b> bytes "
+        f"({persist_stats['saves']} saves)\n\n"
         "━━━━━━━━━━━━━━━━\nCreate by : @Enoch_777"
     )
     await update.message.reply_text(stats_text, parse_mode=ParseMode.HTML)
 
 
+# --------- PROFILE ----------
+profiling = False  # one /profile at a time
+
+
+async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    global profiling
+    if not update.message:
+        return
+    caller = update.effective_user.id
+    if not is_admin(caller):
+        await update.message.reply_text("❌ Admin ဖြစ်မှသာ အသုံးပြုနိုင်ပါတယ်!")
+        return
+
+    # /profile [seconds]: sample this process, then send the report and a folded-stack dump
+    try:
+        seconds = float(context.args[0]) if context.args else 10.0
+    except ValueError:
+        await update.message.reply_text("❌ ဥပမာ: /profile 30")
+        return
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        await update.message.reply_text(f"❌ စက္ကန့် 1 မှ {PROFILE_MAX_SECONDS} အထိသာ ရပါတယ်!")
+        return
+    if profiling:
+        await update.message.reply_text("❌ Profile လုပ်နေဆဲ ဖြစ်ပါတယ်၊ ခဏစောင့်ပါ!")
+        return
+
+    profiling = True
+    try:
+        await update.message.reply_text(f"🔬 {seconds:g} စက္ကန့် profile လုပ်နေပါတယ်...")
+        stacks, rounds = await asyncio.to_thread(sample_threads, seconds)
+    finally:
+        profiling = False
+    where = f" (shard {SHARD_INDEX})" if SHARD_INDEX is not None else ""
+    report = profile_report(stacks, rounds)[:3500]
+    folded = "\n".join(f"{stack} {count}" for stack, count in stacks.most_common()) + "\n"
+    await update.message.reply_text(f"🔬 <b>PROFILE</b>{where}\n\n<pre>{safe_name(report)}</pre>", parse_mode=ParseMode.HTML)
+    await update.message.reply_document(
+        document=folded.encode(),
+        filename=f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.folded.txt",
+        caption="🔥 Folded stacks (flamegraph.pl / speedscope)",
+    )
+
+
+# --------- MEMORY ----------
+def size_text(size) -> str:
+    if size < 1 << 20:
+        return f"{size / 1024:,.1f} KiB"
+    return f"{size / (1 << 20):,.1f} MB"
+
+
+async def memory(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not update.message:
+        return
+    caller = update.effective_user.id
+    if not is_admin(caller):
+        await update.message.reply_text("❌ Admin ဖြစ်မှသာ အသုံးပြုနိုင်ပါတယ်!")
+        return
+
+    # /memory [top N users] | /memory trace | /memory diff | /memory stop
+    action = context.args[0].lower() if context.args else ""
+    where = f" (shard {SHARD_INDEX})" if SHARD_INDEX is not None else ""
+    if action == "trace":
+        await memory_trace.start()
+        await update.message.reply_text(
+            "🧪 tracemalloc စတင်ပြီးပါပြီ! /memory diff နဲ့ ပြောင်းလဲမှုကြည့်ပါ၊ /memory stop နဲ့ ရပ်ပါ။"
+        )
+        return
+    if action == "stop":
+        if memory_trace.active:
+            memory_trace.stop()
+        await update.message.reply_text("✅ tracemalloc ရပ်ပြီးပါပြီ!")
+        return
+    if action == "diff":
+        if not memory_trace.active or memory_trace.snapshot is None:
+            await update.message.reply_text("❌ /memory trace နဲ့ အရင်စတင်ပါ!")
+            return
+        since, total, stats = await memory_trace.diff()
+        lines = [f"{since:.0f} s, total {total / 1024:+,.1f} KiB"]
+        for stat in stats:
+            frame = stat.traceback[0]
+            lines.append(
+                f"{stat.size_diff / 1024:+10,.1f} KiB {stat.count_diff:+8,} "
+                f"{os.path.basename(frame.filename)}:{frame.lineno}"
+            )
+        table = "\n".join(lines)
+        await update.message.reply_text(
+            f"🧪 <b>ALLOCATION DIFF</b>{where}\n\n<pre>{safe_name(table)}</pre>",
+            parse_mode=ParseMode.HTML,
+        )
+        return
+
+    try:
+        top = min(max(int(action), 1), 50) if action else MEMORY_TOP_USERS
+    except ValueError:
+        await update.message.reply_text("❌ ဥပမာ: /memory 10 | /memory trace | /memory diff | /memory stop")
+        return
+    await update.message.reply_text("🧠 Memory တွက်နေပါတယ်...")
+    started = time.perf_counter()
+    sizes, users = await memory_breakdown(top)
+    current, peak = memory_usage()
+    lines = [f"{kind:<24}{size_text(size):>12}" for kind, size in sorted(sizes.items(), key=lambda item: -item[1])]
+    lines.append(f"{'total':<24}{size_text(sum(sizes.values())):>12}")
+    if isinstance(data["users"], LazyUsers):
+        lines.append(f"(users: {len(data['users'].loaded_items()):,} loaded of {len(data['users']):,})")
+    table = "\n".join(lines)
+    ranking = "\n".join(
+        f"{i}. <code>{safe_name(user_key)}</code> - {size / 1024:,.1f} KiB "
+        f"({len((data['users'].get(user_key) or {}).get('harem', []))} cards)"
+        for i, (size, user_key) in enumerate(users, 1)
+    )
+    tracing = "on" if memory_trace.active else "off"
+    await update.message.reply_text(
+        f"🧠 <b>MEMORY</b>{where}\n\n"
+        f"RSS: <b>{size_text(current) if current is not None else '?'}</b> (peak {size_text(peak)})\n"
+        f"<pre>{safe_name(table)}</pre>\n"
+        f"👥 <b>Top {len(users)} users</b>\n{ranking or '-'}\n\n"
+        f"tracemalloc: {tracing} · {time.perf_counter() - started:.1f} s",
+        parse_mode=ParseMode.HTML,
+    )
+
+
 async def backup(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message:
         return
@@ -1041,17 +4726,33 @@ async def backup(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(caller):
         await update.message.reply_text("❌ Admin ဖြစ်မှသာ အသုံးပြုနိုင်ပါတယ်!")
         return
+    if SHARDS > 1:
+        # each worker holds only its own partition
+        await update.message.reply_text("❌ Shard mode မှာ ဒီ command ကို အသုံးမပြုနိုင်ပါ!")
+        return
 
-    await save_data_safe()
+    # /backup: full backup; /backup delta: only the changes since the last backup
+    delta = bool(context.args) and context.args[0].lower() == "delta"
     try:
-        with open(DATA_FILE, "rb") as f:
+        entry = await backups.backup(full=not delta)
+        if entry is None:
+            await update.message.reply_text("✅ နောက်ဆုံး backup ကတည်းက ပြောင်းလဲမှု မရှိပါဘူး!")
+            return
+        if entry["bytes"] > 50 * 1024 * 1024:  # Bot API upload limit
+            await update.message.reply_text(
+                f"💾 Backup ပြီးပါပြီ! ဖိုင်ကြီးလွန်းလို့ server မှာပဲ သိမ်းထားပါတယ်:\n<code>{safe_name(entry['path'])}</code>",
+                parse_mode=ParseMode.HTML,
+            )
+            return
+        with open(entry["path"], "rb") as f:
             await update.message.reply_document(
                 document=f,
-                filename=f"backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
-                caption="💾 <b>Data Backup</b>\n\nBackup ပြီးပါပြီ!",
+                filename=f"backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{entry['type']}.json.gz",
+                caption=f"💾 <b>Data Backup</b> ({entry['type']}, {entry['bytes']:,} bytes)\n\nBackup ပြီးပါပြီ!",
                 parse_mode=ParseMode.HTML,
             )
     except Exception:
+        logger.exception("Backup failed")
         await update.message.reply_text("❌ Backup ဖိုင်ပေးပို့ရန် မအောင်မြင်ပါ!")
 
 
@@ -1062,23 +4763,91 @@ async def restore(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(caller):
         await update.message.reply_text("❌ Admin ဖြစ်မှသာ အသုံးပြုနိုင်ပါတယ်!")
         return
+    if SHARDS > 1:
+        # each worker holds only its own partition
+        await update.message.reply_text("❌ Shard mode မှာ ဒီ command ကို အသုံးမပြုနိုင်ပါ!")
+        return
 
     if not update.message.reply_to_message or not update.message.reply_to_message.document:
         await update.message.reply_text("❌ Backup file ကို reply လုပ်ပါ!")
         return
 
     doc = update.message.reply_to_message.document
+    staged = DATA_FILE + ".restore"
+    loop = asyncio.get_running_loop()
     try:
         file = await doc.get_file()
-        await file.download_to_drive(DATA_FILE)
-        global data
-        data = load_data()
+        await file.download_to_drive(staged)
+        # checked on a worker thread; the live data file is untouched until it passes
+        problems = await loop.run_in_executor(None, check_restore, staged)
+    except Exception:
+        logger.exception("Restore download failed")
+        problems = ["download failed"]
+    if problems:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(staged)
+        details = "\n".join(f"• {safe_name(problem)}" for problem in problems[:5])
+        await update.message.reply_text(
+            f"❌ Restore မအောင်မြင်ပါ! လက်ရှိ data ကို မပြောင်းပါဘူး။\n\n{details}", parse_mode=ParseMode.HTML
+        )
+        return
+
+    global data, catalog_movies, catalog_ids, catalog_search, drops
+    try:
+        async with data_lock:
+            # no save can run while the lock is held; handlers keep going on the old state
+            obj, indexes = await loop.run_in_executor(persist_executor, restore_state, staged)
+            # the swap itself has no await, so no update ever sees half of it
+            data = obj
+            # new records must number after the document's, or a replay would skip them
+            journal.seq = max(journal.seq, int(obj.get("journal_seq", 0)))
+            catalog_movies, catalog_ids, catalog_search, drops = indexes
+            for cache in (harem_movies, harem_ids, inline_results, tops_pages):
+                cache.clear()
+            persistence.discard()
+        # the stored file already is the new state: only record that older
+        # journal records are obsolete, no full snapshot on the loop
+        mark_dirty("journal_seq")
+        backups.mark()
+        await persistence.flush()
         await update.message.reply_text("♻️ <b>Data Restore ပြီးပါပြီ!</b>", parse_mode=ParseMode.HTML)
     except Exception:
         logger.exception("Restore failed")
         await update.message.reply_text("❌ Restore မအောင်မြင်ပါ!")
 
 
+def check_restore(path: str):
+    """Problems that make the uploaded document unusable (worker thread)."""
+    try:
+        unpack_backup(path)
+    except (OSError, ValueError) as e:
+        return [str(e)]
+    return validate_json(path)
+
+
+def restore_state(path: str):
+    """
+    Load the checked document at `path` with fresh catalog indexes, then
+    install it as the stored state (persistence thread), ready to be swapped
+    in on the loop. Anything that fails before the install leaves the stored
+    state as it was.
+    """
+    obj, staged = bulk_load(storage.stage_restore, path)
+    fill_defaults(obj)
+    cards = obj.get("cards", [])
+    indexes = (MovieCounts(), IdIndex(lambda card: card.get("id")), CatalogSearch(), DropEngine(RARITY_WEIGHTS))
+    for index in indexes:
+        index.of(cards)
+    storage.install_restore(path, staged, obj)
+    # the records on disk belong to the replaced state: replayed onto this one
+    # after a crash (before the next flush) they would bring it back
+    journal.discard()
+    chat_checkpoint.discard()
+    chat_checkpoint.load(obj)  # no checkpoint now: keeps the document's chat kinds, saves them next
+    storage.adopt(obj)
+    return obj, indexes
+
+
 async def allclear(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message:
         return
@@ -1086,6 +4855,10 @@ async def allclear(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(caller):
         await update.message.reply_text("❌ Admin ဖြစ်မှသာ အသုံးပြုနိုင်ပါတယ်!")
         return
+    if SHARDS > 1:
+        # each worker holds only its own partition
+        await update.message.reply_text("❌ Shard mode မှာ ဒီ command ကို အသုံးမပြုနိုင်ပါ!")
+        return
 
     keyboard = [
         [
@@ -1106,18 +4879,9 @@ async def allclear_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     if query.data == "confirm_clear":
         global data
-        data = {
-            "users": {},
-            "groups": {},
-            "cards": [],
-            "sudos": [],
-            "drop_count": DROP_COUNT,
-            "group_messages": {},
-            "vote_options": [],
-            "votes": {},
-            "dropped_cards": {},
-        }
-        await save_data_safe()
+        data = default_data()
+        mark_dirty()
+        await persistence.flush()
         await query.edit_message_text("🗑️ <b>Data အားလုံး ဖျက်ပြီးပါပြီ!</b>", parse_mode=ParseMode.HTML)
     else:
         await query.edit_message_text("❌ ပယ်ဖျက်ပါတယ်။", parse_mode=ParseMode.HTML)
@@ -1134,12 +4898,19 @@ async def delete_card(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Card ID ထည့်ပါ!\nအသုံးပြုနည်း: /delete <card_id>")
         return
     card_id = context.args[0]
-    card = next((c for c in data.get("cards", []) if c.get("id") == card_id), None)
+    card = catalog_ids.of(data.get("cards", [])).get(card_id)
     if not card:
         await update.message.reply_text("❌ ဒီ Card ID မရှိပါဘူး!")
         return
     data["cards"].remove(card)
-    await save_data_safe()
+    catalog_movies.removed(data["cards"], card)
+    catalog_ids.removed(data["cards"], card)
+    catalog_search.removed(data["cards"], card)
+    drops.removed(data["cards"], card)
+    retire_card(card_id, card)  # owned copies still render
+    mark_dirty("cards")
+    await persistence.flush()
+    await publish_globals("cards", "retired_cards")
     await update.message.reply_text(f"✅ <b>Card ဖျက်ပြီးပါပြီ!</b>\n🆔 <code>{card_id}</code>", parse_mode=ParseMode.HTML)
 
 
@@ -1162,7 +4933,9 @@ async def addsudo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ ဒီ user က sudo ဖြစ်နေပြီးပါပြီ!")
         return
     data["sudos"].append(int(target_user_id))
-    await save_data_safe()
+    mark_dirty("sudos")
+    await persistence.flush()
+    await publish_globals("sudos")
     await update.message.reply_text(f"✅ <b>Sudo ထည့်ပြီးပါပြီ!</b>\n👤 User ID: <code>{target_user_id}</code>", parse_mode=ParseMode.HTML)
 
 
@@ -1177,12 +4950,9 @@ async def sudolist(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("📋 Sudo list ထဲမှာ ဘယ်သူမှမရှိသေးပါဘူး!")
         return
     message = "👑 <b>SUDO LIST</b>\n\n"
+    names = await display_names(context.bot, data.get("sudos", []))
     for i, sudo_id in enumerate(data.get("sudos", []), 1):
-        try:
-            user_chat = await context.bot.get_chat(int(sudo_id))
-            name = user_chat.first_name or "Unknown"
-        except Exception:
-            name = "Unknown"
+        name = names[uid_str(sudo_id)]
         message += f"{i}. <b>{safe_name(name)}</b> (<code>{sudo_id}</code>)\n"
     message += "\n━━━━━━━━━━━━━━━━\nCreate by : @Enoch_777"
     await update.message.reply_text(message, parse_mode=ParseMode.HTML)
@@ -1206,7 +4976,9 @@ async def evote(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     data["vote_options"] = options
     data["votes"] = {opt: [] for opt in options}
-    await save_data_safe()
+    mark_dirty("vote_options")
+    mark_dirty("votes")
+    await persistence.flush()
     keyboard = [[InlineKeyboardButton(f"🗳️ {opt}", callback_data=f"vote_{opt}")] for opt in options]
     reply_markup = InlineKeyboardMarkup(keyboard)
     await update.message.reply_text("🗳️ <b>VOTING POLL</b>\n\nသင်ကြိုက်နှစ်သက်တဲ့သူကို ရွေးချယ်ပါ!", reply_markup=reply_markup, parse_mode=ParseMode.HTML)
@@ -1228,23 +5000,15 @@ async def vote(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(message, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
 
 
+@serialized(votes_scope)
 async def vote_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     option = query.data.replace("vote_", "")
     user_id = query.from_user.id
 
-    for opt, voters in data.get("votes", {}).items():
-        if user_id in voters:
-            try:
-                data["votes"][opt].remove(user_id)
-            except ValueError:
-                pass
-
-    if option not in data["votes"]:
-        data["votes"][option] = []
-    data["votes"][option].append(user_id)
-    await save_data_safe()
+    apply_op("vote", user_id, option)
+    await commit()
     await query.answer(f"✅ {option} ကိုမဲပေးပြီးပါပြီ!", show_alert=True)
 
     message = "🗳️ <b>VOTE RESULTS</b>\n\n"
@@ -1269,7 +5033,8 @@ async def track_groups(update: Update, context: ContextTypes.DEFAULT_TYPE):
         chat_id = str(chat.id)
         if chat_id not in data.get("groups", {}):
             data["groups"][chat_id] = {"name": chat.title, "joined": datetime.now().isoformat()}
-            await save_data_safe()
+            mark_dirty("groups", chat_id)
+            await persistence.flush()
 
 
 # --------- ERROR HANDLER ----------
@@ -1277,15 +5042,602 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
     logger.exception("Exception while handling update: %s", context.error)
 
 
-# ----------------- MAIN -----------------
-def main():
-    if not BOT_TOKEN:
-        logger.error("BOT_TOKEN is not set. Export BOT_TOKEN environment variable and restart.")
+# ----------------- WEBHOOK -----------------
+class WebhookServer:
+    """
+    Minimal asyncio HTTP/1.1 server for Telegram webhooks (no extra dependencies).
+
+    POST `path` with an Update JSON body is decoded and put on the
+    Application's update_queue; the request is answered as soon as it is
+    queued. GET /healthz reports liveness. Requests must carry the
+    X-Telegram-Bot-Api-Secret-Token header when a secret is configured.
+    Connections are kept alive and capped at `max_connections`. Without a
+    `path` it only serves the GET routes (see start_metrics).
+    """
+
+    MAX_BODY = 1 << 20
+
+    def __init__(self, application, listen: str, port: int, path: str = "", secret: str = "", max_connections: int = 40,
+                 forward=None):
+        self.application = application
+        self.forward = forward  # async callable taking the raw update dict instead of queueing it
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.secret = secret
+        self.max_connections = max_connections
+        self.connections = set()  # open client writers
+        self.received = 0
+        self.server = None
+        self.routes = {}  # (method, path) -> async handler(body) -> (status, payload); extended by other sections
+        if path:
+            self.route("POST", path, self._update)
+        self.route("GET", "/healthz", self._health)
+
+    def route(self, method: str, path: str, handler):
+        self.routes[(method, path)] = handler
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._serve, self.listen, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        logger.info("HTTP server listening on %s:%d%s", self.listen, self.port, self.path)
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            # idle keep-alive connections end their read loop once closed
+            for writer in list(self.connections):
+                writer.close()
+            await self.server.wait_closed()
+            while self.connections:
+                await asyncio.sleep(0.01)
+            self.server = None
+
+    async def _update(self, headers, body):
+        if self.secret and headers.get("x-telegram-bot-api-secret-token") != self.secret:
+            return 403, {"ok": False}
+        try:
+            raw = json.loads(body)
+            if not isinstance(raw, dict):
+                raise ValueError("an update is a JSON object")
+            update = None if self.forward else Update.de_json(raw, self.application.bot)
+        except (ValueError, TypeError, KeyError):
+            return 400, {"ok": False}
+        if self.forward:
+            await self.forward(raw)
+        else:
+            await self.application.update_queue.put(update)
+        self.received += 1
+        return 200, {"ok": True}
+
+    async def _health(self, headers, body):
+        queued = self.application.update_queue.qsize() if self.application else 0
+        return 200, {"ok": True, "received": self.received, "queued": queued}
+
+    async def _serve(self, reader, writer):
+        if len(self.connections) >= self.max_connections:
+            writer.close()
+            return
+        self.connections.add(writer)
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    return
+                request_line, *lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, target, version = request_line.split(" ", 2)
+                except ValueError:
+                    return
+                headers = {}
+                for line in lines:
+                    name, sep, value = line.partition(":")
+                    if sep:
+                        headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length") or 0)
+                if length > self.MAX_BODY:
+                    await self._respond(writer, 413, {"ok": False}, close=True)
+                    return
+                body = await reader.readexactly(length) if length else b""
+                handler = self.routes.get((method, target.split("?", 1)[0]))
+                if handler is None:
+                    status, payload = 404, {"ok": False}
+                else:
+                    try:
+                        status, payload = await handler(headers, body)
+                    except Exception:
+                        logger.exception("Webhook handler failed")
+                        status, payload = 500, {"ok": False}
+                close = headers.get("connection", "").lower() == "close" or version == "HTTP/1.0"
+                await self._respond(writer, status, payload, close)
+                if close:
+                    return
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.connections.discard(writer)
+            writer.close()
+
+    @staticmethod
+    async def _respond(writer, status: int, payload, close: bool):
+        if isinstance(payload, (bytes, str)):
+            body, kind = (payload.encode() if isinstance(payload, str) else payload), "text/plain; charset=utf-8"
+        else:
+            body, kind = json.dumps(payload).encode(), "application/json"
+        reason = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 413: "Payload Too Large"}.get(status, "Error")
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\nContent-Type: {kind}\r\nContent-Length: {len(body)}\r\n"
+            f"Connection: {'close' if close else 'keep-alive'}\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+
+
+async def run_webhook(application: Application):
+    """Serve updates through WebhookServer until SIGINT/SIGTERM (replaces run_polling)."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+    server = WebhookServer(
+        application, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_MAX_CONNECTIONS
+    )
+    await application.initialize()
+    await on_startup(application)
+    await application.start()
+    await server.start()
+    await application.bot.set_webhook(
+        WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET or None,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+        allowed_updates=Update.ALL_TYPES,
+    )
+    try:
+        await stop.wait()
+    finally:
+        await server.stop()
+        await application.stop()
+        await application.shutdown()
+        await on_shutdown(application)
+
+
+# ----------------- SHARDING -----------------
+# With SHARDS > 1 a front process receives updates (polling or webhook) and
+# routes each one over a unix socket to one of SHARDS worker processes. Users
+# and chats are partitioned by a stable hash of their key: a worker owns the
+# records of its users and the counters/drops of its chats. Commands run on
+# the caller's shard, plain group traffic on the chat's shard, and admin
+# commands that change global state (catalog, sudos, drop count, votes) on
+# shard 0, which replicates them to the others. Work on a key owned elsewhere
+# goes through shard_rpc().
+GLOBAL_KINDS = ("cards", "retired_cards", "sudos", "drop_count")  # replicated from shard 0 to every worker
+COORDINATOR_COMMANDS = {
+    "upload", "setdrop", "gift", "edit", "broadcast", "stats", "backup", "restore",
+    "allclear", "delete", "addsudo", "sudolist", "evote", "vote",
+}
+SHARD_LINE_LIMIT = 1 << 26  # max bytes of one IPC message (a replicated catalog)
+SHARD_CALLS = {}
+
+
+def shard_of(key) -> int:
+    """Owning shard of a user or chat key (stable across processes, unlike hash())."""
+    return zlib.crc32(str(key).encode()) % SHARDS if SHARDS > 1 else 0
+
+
+def owns(key) -> bool:
+    return SHARD_INDEX is None or shard_of(key) == SHARD_INDEX
+
+
+def shard_socket(index: int) -> str:
+    return shard_file(index) + ".sock"
+
+
+def shard_call(name):
+    """Register a function other shards may invoke through shard_rpc()."""
+    def register(fn):
+        SHARD_CALLS[name] = fn
+        return fn
+    return register
+
+
+class ShardUnreachable(ConnectionError):
+    """A call that never left this process: the other shard certainly did not run it."""
+
+
+class ShardLink:
+    """
+    Connection to a worker's socket: fire-and-forget updates and request/response calls.
+    A call that fails with ShardUnreachable was not sent; after any other failure
+    (timeout, lost connection, an error reply) the other shard may have run it.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.writer = None
+        self.pending = {}  # request id -> future
+        self.next_id = 0
+        self._connecting = asyncio.Lock()
+
+    async def connect(self, attempts: int = 300):
+        async with self._connecting:
+            if self.writer is not None:
+                return
+            for _ in range(attempts):
+                try:
+                    reader, self.writer = await asyncio.open_unix_connection(self.path, limit=SHARD_LINE_LIMIT)
+                    break
+                except (FileNotFoundError, ConnectionRefusedError):
+                    await asyncio.sleep(0.1)  # the worker is still starting
+            else:
+                raise ConnectionError(f"shard socket {self.path} is not accepting connections")
+            asyncio.create_task(self._read(reader))
+
+    async def _read(self, reader):
+        try:
+            async for line in reader:
+                message = json.loads(line)
+                future = self.pending.pop(message["id"], None)
+                if future is None or future.done():
+                    continue
+                if "error" in message:
+                    future.set_exception(RuntimeError(message["error"]))
+                else:
+                    future.set_result(message["result"])
+        finally:
+            self.writer = None
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError(f"lost connection to {self.path}"))
+            self.pending.clear()
+
+    async def send(self, message):
+        if self.writer is None:
+            await self.connect()
+        self.writer.write(json.dumps(message, ensure_ascii=False).encode() + b"\n")
+        await self.writer.drain()
+
+    async def call(self, fn: str, *args):
+        self.next_id += 1
+        request_id = self.next_id
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        try:
+            if self.writer is None:
+                try:
+                    await self.connect()
+                except OSError as e:
+                    raise ShardUnreachable(str(e)) from e
+            await self.send({"id": request_id, "call": fn, "args": args})
+            return await asyncio.wait_for(future, SHARD_RPC_TIMEOUT)
+        finally:
+            self.pending.pop(request_id, None)
+
+
+shard_links = {}  # shard index -> ShardLink (peers of this worker)
+
+
+async def shard_rpc(index: int, fn: str, *args):
+    """Run SHARD_CALLS[fn] on shard `index` (directly when that is this process)."""
+    if index == SHARD_INDEX or SHARD_INDEX is None:
+        return await SHARD_CALLS[fn](*args)
+    link = shard_links.get(index)
+    if link is None:
+        link = shard_links[index] = ShardLink(shard_socket(index))
+    return await link.call(fn, *args)
+
+
+async def shard_gather(fn: str, *args):
+    """Results of `fn` from every shard, in shard order."""
+    if SHARD_INDEX is None:
+        return [await SHARD_CALLS[fn](*args)]
+    return await asyncio.gather(*(shard_rpc(i, fn, *args) for i in range(SHARDS)))
+
+
+async def deliver(user_key: str, ops):
+    """
+    Apply user ops ([op, *args] lists) on the shard that owns `user_key`.
+    Local ops are applied but left for the caller's commit(); remote ones
+    are durable when this returns. Raises ShardUnreachable when nothing was
+    applied; any other error leaves the outcome unknown (see ShardLink).
+    """
+    if owns(user_key):
+        for op, *args in ops:
+            apply_op(op, user_key, *args)
+    else:
+        await shard_rpc(shard_of(user_key), "apply", user_key, ops)
+
+
+@shard_call("apply")
+async def _call_apply(user_key, ops):
+    for op, *args in ops:
+        if op not in ("coins", "harem"):
+            raise ValueError(f"op {op} cannot be delivered")
+        apply_op(op, user_key, *args)
+    if not await commit():
+        raise OSError("journal write failed")  # the caller cannot count on the ops surviving a crash
+
+
+@shard_call("drop")
+async def _call_drop(chat_id):
+    return data.get("dropped_cards", {}).get(chat_id)
+
+
+@shard_call("take_drop")
+async def _call_take_drop(chat_id, card_id):
+    """Remove the chat's drop if it is still `card_id`; True when the caller won it."""
+    async with stripes.hold(("chat", int(chat_id))):
+        card = data.get("dropped_cards", {}).get(chat_id)
+        if not card or card.get("id") != card_id:
+            return False
+        apply_op("undrop", chat_id)
+        await commit()
+        return True
+
+
+@shard_call("top")
+async def _call_top(by):
+    return await leaderboards[by].top()
+
+
+@shard_call("totals")
+async def _call_totals():
+    return {"users": len(data.get("users", {})), "groups": len(data.get("groups", {}))}
+
+
+@shard_call("groups")
+async def _call_groups():
+    return list(data.get("groups", {}).keys())
+
+
+@shard_call("globals")
+async def _call_globals(values):
+    for kind, value in values.items():
+        if kind == "retired_cards":
+            # workers also retire cards while migrating old harems; keep theirs
+            data.setdefault(kind, {}).update(value)
+        else:
+            data[kind] = value
+        mark_dirty(kind)
+
+
+@shard_call("sync")
+async def _call_sync():
+    await publish_globals(*GLOBAL_KINDS)
+
+
+async def publish_globals(*kinds):
+    """Push shard 0's copy of global state to the other workers."""
+    if SHARD_INDEX is None:
         return
+    values = {kind: data[kind] for kind in kinds}
+    await asyncio.gather(*(shard_rpc(i, "globals", values) for i in range(SHARDS) if i != SHARD_INDEX))
 
-    print("🤖 Bot စတင်နေပါသည်...")
 
-    application = Application.builder().token(BOT_TOKEN).build()
+async def global_top(by: str):
+    """Top users across all shards."""
+    if SHARD_INDEX is None:
+        return await leaderboards[by].top()
+    merged = [tuple(entry) for part in await shard_gather("top", by) for entry in part]
+    return heapq.nlargest(LEADERBOARD_SIZE, merged, key=lambda kv: kv[1])
+
+
+async def serve_shard(application, clients, reader, writer):
+    """Worker side of a ShardLink: queue routed updates, answer calls."""
+    clients.add(writer)
+
+    async def answer(message):
+        try:
+            reply = {"id": message["id"], "result": await SHARD_CALLS[message["call"]](*message["args"])}
+        except Exception as e:
+            logger.exception("Shard call %s failed", message.get("call"))
+            reply = {"id": message["id"], "error": str(e)}
+        writer.write(json.dumps(reply, ensure_ascii=False).encode() + b"\n")
+        await writer.drain()
+
+    try:
+        async for line in reader:
+            message = json.loads(line)
+            if "update" in message:
+                await application.update_queue.put(Update.de_json(message["update"], application.bot))
+            else:
+                asyncio.create_task(answer(message))
+    except ConnectionError:
+        pass
+    finally:
+        clients.discard(writer)
+        writer.close()
+
+
+def route_update(raw) -> int:
+    """Shard that should handle a raw update (see the section comment)."""
+    query = raw.get("callback_query")
+    if query:
+        if query.get("data", "").startswith(("vote_", "confirm_clear", "cancel_clear")):
+            return 0
+        return shard_of(query["from"]["id"])
+    message = raw.get("message") or raw.get("edited_message") or {}
+    text = message.get("text") or message.get("caption") or ""
+    if text.startswith("/") and message.get("from"):
+        command = text[1:].split(maxsplit=1)[0].split("@", 1)[0].lower() if len(text) > 1 else ""
+        return 0 if command in COORDINATOR_COMMANDS else shard_of(message["from"]["id"])
+    if message.get("media_group_id") and message.get("chat", {}).get("type") == "private":
+        return 0  # album photos for a bulk /upload, which runs on shard 0
+    if message.get("chat"):
+        return shard_of(message["chat"]["id"])
+    for value in raw.values():
+        if isinstance(value, dict):
+            chat = value.get("chat") or value.get("from")
+            if isinstance(chat, dict) and "id" in chat:
+                return shard_of(chat["id"])
+    return 0
+
+
+def split_into_shards():
+    """First sharded start: partition the single-process data into one file per worker."""
+    paths = [shard_file(i) for i in range(SHARDS)]
+    if any(os.path.exists(path) for path in paths):
+        return
+    replay_journal()
+    parts = []
+    for i in range(SHARDS):
+        part = {kind: ({} if kind in KEYED_KINDS else value) for kind, value in data.items()}
+        part["journal_seq"] = 0
+        if i:
+            part["broadcast"] = None
+        parts.append(part)
+    for kind in KEYED_KINDS:
+        for key in data.get(kind, {}):
+            parts[shard_of(key)][kind][key] = data[kind][key]
+    for path, part in zip(paths, parts):
+        store = SqliteStorage(path) if STORAGE_BACKEND == "sqlite" else JsonStorage(path)
+        store.save(part, dict.fromkeys(part), full=True)
+        store.close()
+    logger.info("Split %s into %d shard files; it is left untouched", DATA_FILE, SHARDS)
+
+
+async def run_shard():
+    """Worker process: run the handlers for updates routed here by the front."""
+    application = build_application()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    path = shard_socket(SHARD_INDEX)
+    if os.path.exists(path):
+        os.remove(path)
+    await application.initialize()
+    await on_startup(application)
+    await application.start()
+    clients = set()
+    server = await asyncio.start_unix_server(
+        functools.partial(serve_shard, application, clients), path, limit=SHARD_LINE_LIMIT
+    )
+    logger.info("Shard %d/%d serving %s", SHARD_INDEX, SHARDS, DATA_FILE)
+    try:
+        await stop.wait()
+    finally:
+        server.close()
+        for writer in list(clients):
+            writer.close()
+        await application.stop()
+        await application.shutdown()
+        await on_shutdown(application)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+async def run_front():
+    """Front process: start the workers and route every incoming update to one of them."""
+    split_into_shards()
+    workers = [
+        subprocess.Popen([sys.executable, os.path.abspath(__file__)], env={**os.environ, "SHARD_INDEX": str(i)})
+        for i in range(SHARDS)
+    ]
+    links = [ShardLink(shard_socket(i)) for i in range(SHARDS)]
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    async def forward(raw):
+        await links[route_update(raw)].send({"update": raw})
+
+    bot = Bot(BOT_TOKEN)
+    server = poller = None
+    try:
+        for link in links:
+            await link.connect()
+        await links[0].call("sync")
+        await bot.initialize()
+        if WEBHOOK_URL:
+            server = WebhookServer(
+                None, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_MAX_CONNECTIONS, forward=forward
+            )
+            await server.start()
+            await bot.set_webhook(
+                WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET or None,
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+                allowed_updates=Update.ALL_TYPES,
+            )
+        else:
+            await bot.delete_webhook()
+            poller = asyncio.create_task(poll_updates(bot, forward))
+        await stop.wait()
+    finally:
+        if poller is not None:
+            poller.cancel()
+        if server is not None:
+            await server.stop()
+        for worker in workers:
+            worker.terminate()
+        # workers flush their state on SIGTERM
+        await asyncio.gather(*(asyncio.to_thread(worker.wait) for worker in workers))
+        await bot.shutdown()
+
+
+async def poll_updates(bot, forward):
+    """getUpdates long polling for the front process."""
+    offset = None
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=Update.ALL_TYPES)
+        except RetryAfter as e:
+            await asyncio.sleep(float(e.retry_after))
+            continue
+        except Exception:
+            logger.exception("getUpdates failed")
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            await forward(update.to_dict())
+            offset = update.update_id + 1
+
+
+# ----------------- LIFECYCLE -----------------
+async def on_startup(application: Application):
+    replay_journal()
+    migrate_harems()
+    persistence.start()
+    backups.start()
+    await start_metrics(application)
+    resume_broadcast(application.bot)
+
+
+async def on_shutdown(application: Application):
+    if broadcast_job is not None and broadcast_job.task and not broadcast_job.task.done():
+        broadcast_job.task.cancel()
+        if broadcast_job.alive:
+            mark_dirty("broadcast")  # save the cursor; the next start resumes from it
+    await backups.stop()
+    await stop_metrics()
+    # final flush so nothing inside the durability window is lost on a clean stop
+    await persistence.stop()
+    await asyncio.get_running_loop().run_in_executor(persist_executor, storage.close)
+
+
+# ----------------- MAIN -----------------
+def build_application(bot=None):
+    """The Application with every handler registered; `bot` replaces the real Bot (see bench.py)."""
+    builder = Application.builder()
+    if bot is None:
+        builder.token(BOT_TOKEN).request(MeteredRequest(connection_pool_size=256)).get_updates_request(MeteredRequest())
+    else:
+        builder.bot(bot)
+    application = (
+        builder
+        .concurrent_updates(MeteredProcessor(max(1, CONCURRENT_UPDATES)))
+        .update_queue(UpdateQueue())
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
+
+    # Name directory (runs ahead of every other handler)
+    application.add_handler(TypeHandler(Update, track_names), group=-1)
 
     # User commands
     application.add_handler(CommandHandler("start", start))
@@ -1300,6 +5652,7 @@ def main():
     application.add_handler(CommandHandler("daily", daily))
     application.add_handler(CommandHandler("shop", shop))
     application.add_handler(CallbackQueryHandler(shop_callback, pattern="^(shop_|buy_)"))
+    application.add_handler(InlineQueryHandler(inline_query))
     application.add_handler(CommandHandler("tops", tops))
     application.add_handler(CallbackQueryHandler(tops_callback, pattern="^tops_"))
 
@@ -1310,6 +5663,8 @@ def main():
     application.add_handler(CommandHandler("edit", edit_admin))
     application.add_handler(CommandHandler("broadcast", broadcast))
     application.add_handler(CommandHandler("stats", stats))
+    application.add_handler(CommandHandler("profile", profile))
+    application.add_handler(CommandHandler("memory", memory))
     application.add_handler(CommandHandler("backup", backup))
     application.add_handler(CommandHandler("restore", restore))
     application.add_handler(CommandHandler("allclear", allclear))
@@ -1324,17 +5679,72 @@ def main():
     # Message handlers
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, message_counter))
     application.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, track_groups))
+    application.add_handler(MessageHandler(filters.PHOTO & filters.ChatType.PRIVATE, track_albums), group=1)
 
     # Error handler
     application.add_error_handler(error_handler)
+    instrument(application)
+    return application
+
+
+def main():
+    if not BOT_TOKEN:
+        logger.error("BOT_TOKEN is not set. Export BOT_TOKEN environment variable and restart.")
+        return
+
+    global data
+    data = load_data()
+
+    if SHARD_INDEX is not None:
+        # a worker started by the front process (see run_front)
+        asyncio.run(run_shard())
+        return
+
+    print("🤖 Bot စတင်နေပါသည်...")
+
+    if SHARDS > 1:
+        print(f"✅ Bot စတင်ပြီးပါပြီ! ({SHARDS} shards)")
+        asyncio.run(run_front())
+        return
+
+    application = build_application()
 
     print("✅ Bot စတင်ပြီးပါပြီ!")
     print("━━━━━━━━━━━━━━━━")
     print("Create by : @Enoch_777")
     print("━━━━━━━━━━━━━━━━")
 
-    application.run_polling()
+    if WEBHOOK_URL:
+        asyncio.run(run_webhook(application))
+    else:
+        application.run_polling()
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Character collection Telegram bot")
+    parser.add_argument(
+        "--migrate-sqlite",
+        nargs=2,
+        metavar=("JSON_FILE", "DB_FILE"),
+        help="import a data.json into a SQLite database (one-shot) and exit",
+    )
+    parser.add_argument("--validate", metavar="JSON_FILE", help="check a data.json file and exit")
+    parser.add_argument(
+        "--restore-backup",
+        nargs="?",
+        const="",
+        metavar="BACKUP_FILE",
+        help="rebuild DATA_FILE from BACKUP_DIR (the newest backup, or the chain ending at BACKUP_FILE) and exit",
+    )
+    args = parser.parse_args()
+    if args.migrate_sqlite:
+        migrate_json_to_sqlite(*args.migrate_sqlite)
+    elif args.restore_backup is not None:
+        restore_backup(args.restore_backup or None)
+    elif args.validate:
+        problems = validate_json(args.validate)
+        for problem in problems:
+            print(problem)
+        raise SystemExit(1 if problems else 0)
+    else:
+        main()
@@ -0,0 +1,106 @@
+import asyncio
+import os
+import sys
+import tempfile
+
+import pytest
+
+# bot.py reads its settings at import time: point everything at a scratch directory first
+SCRATCH = tempfile.mkdtemp(prefix="bot-tests-")
+os.environ.update({
+    "DATA_FILE": os.path.join(SCRATCH, "data.json"),
+    "STORAGE_BACKEND": "json",
+    "LAZY_LOAD": "false",
+    "JOURNAL": "true",
+    "JOURNAL_SYNC_MS": "0",
+    "BACKUP_DIR": os.path.join(SCRATCH, "backups"),
+    "BACKUP_INTERVAL": "0",
+    "METRICS_PORT": "0",
+    "SLOW_UPDATE_MS": "0",
+    "SHARDS": "1",
+    "ADMIN_IDS": "1",
+})
+os.environ.pop("SHARD_INDEX", None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+import bench  # noqa: E402
+
+
+def fresh_state(monkeypatch, directory, storage):
+    """Give one test its own storage, `data`, journal, backups and loop-bound locks."""
+    monkeypatch.setattr(bot, "storage", storage)
+    monkeypatch.setattr(bot, "data", bot.default_data())
+    monkeypatch.setattr(bot, "data_lock", asyncio.Lock())
+    monkeypatch.setattr(bot, "persistence", bot.WriteBehind(60, 10 ** 9))
+    monkeypatch.setattr(bot, "journal", bot.Journal(os.path.join(directory, "data.journal"), True, 0))
+    monkeypatch.setattr(bot, "chat_checkpoint", bot.ChatCheckpoint(os.path.join(directory, "data.chats")))
+    monkeypatch.setattr(bot, "backups", bot.Backups(os.path.join(directory, "backups"), 0, 24, 7))
+
+
+@pytest.fixture
+def json_state(tmp_path, monkeypatch):
+    storage = bot.JsonStorage(str(tmp_path / "data.json"))
+    fresh_state(monkeypatch, str(tmp_path), storage)
+    yield storage
+    storage.close()
+
+
+@pytest.fixture
+def sqlite_state(tmp_path, monkeypatch):
+    storage = bot.SqliteStorage(str(tmp_path / "data.db"))
+    fresh_state(monkeypatch, str(tmp_path), storage)
+    yield storage
+    storage.close()
+
+
+class Replies(bench.RecordingRequest):
+    """The benchmark's stand-in request, also keeping every call for assertions."""
+
+    def __init__(self):
+        super().__init__()
+        self.sent = []  # (method, parameters)
+
+    def result(self, method, params):
+        self.sent.append((method, params))
+        return super().result(method, params)
+
+    def texts(self):
+        return [params.get("text") or params.get("caption") for _, params in self.sent if "text" in params or "caption" in params]
+
+
+class Handlers:
+    """Drive the real handlers with synthetic updates through Application.process_update."""
+
+    def __init__(self):
+        self.request = Replies()
+        self.bot = bench.ExtBot("123456:TEST", request=self.request, get_updates_request=bench.RecordingRequest())
+        self.updates = bench.Updates(self.bot)
+
+    def message(self, user_id, text, chat_id=None):
+        return self.updates.message(user_id, user_id if chat_id is None else chat_id, text)
+
+    def callback(self, user_id, payload, chat_id=None):
+        return self.updates.callback(user_id, user_id if chat_id is None else chat_id, payload)
+
+    def run(self, *updates, concurrent=False):
+        async def go():
+            application = bot.build_application(self.bot)
+            await application.initialize()
+            try:
+                if concurrent:
+                    # as the polling loop does: through the update processor and its concurrency limit
+                    processor = application.update_processor
+                    await asyncio.gather(*(processor.process_update(update, application.process_update(update))
+                                           for update in updates))
+                else:
+                    for update in updates:
+                        await application.process_update(update)
+            finally:
+                await application.shutdown()
+        asyncio.run(go())
+
+
+@pytest.fixture
+def handlers(json_state):
+    return Handlers()
@@ -0,0 +1,95 @@
+import asyncio
+import json
+
+import bot
+
+
+def user(coins, *cards):
+    return {"coins": coins, "harem": [list(card) for card in cards], "fav_card": None,
+            "last_daily": None, "last_slime": None}
+
+
+def live_state():
+    """`data` as a backup document holds it."""
+    state = json.loads(json.dumps(bot.data, default=dict))
+    state.pop("journal_seq", None)
+    return state
+
+
+def rebuilt_state(upto=None):
+    state = bot.backups.rebuild(upto)
+    state.pop("journal_seq", None)
+    return state
+
+
+def test_full_and_delta_backups_rebuild_the_live_state(json_state):
+    data = bot.data
+    data["cards"] = [{"id": "card_1", "name": "One", "movie": "M", "rarity": "Common", "photo": "p"}]
+    data["users"].update({"1": user(100, ("card_1", 10001, 0)), "2": user(200), "3": user(300)})
+    data["groups"]["-100"] = {"title": "Group"}
+    bot.mark_dirty()
+    # chat counters and drops only reach the chat checkpoint, never a save of their own
+    data["group_messages"].update({"-100": 7, "-200": 3})
+    bot.mark_dirty("group_messages", "-100")
+    bot.mark_dirty("group_messages", "-200")
+    data["dropped_cards"]["-200"] = {"id": "card_1", "name": "One"}
+    bot.mark_dirty("dropped_cards", "-200")
+
+    async def run():
+        await bot.persistence.flush()
+        full = await bot.backups.backup()
+        assert full["type"] == "full"
+        assert await bot.backups.backup() is None  # nothing changed since
+
+        data["users"]["1"]["coins"] = 50
+        data["users"]["1"]["harem"].append(["card_2", 10002, 1])
+        bot.mark_dirty("users", "1")
+        del data["users"]["2"]
+        bot.mark_dirty("users", "2")
+        data["users"]["4"] = user(400)
+        bot.mark_dirty("users", "4")
+        data["cards"].append({"id": "card_2", "name": "Two", "movie": "M", "rarity": "Rare", "photo": "q"})
+        bot.mark_dirty("cards")
+        data["votes"]["A"] = [3]
+        bot.mark_dirty("votes")
+        data["group_messages"]["-100"] = 8
+        bot.mark_dirty("group_messages", "-100")
+        data["dropped_cards"]["-100"] = {"id": "card_2", "name": "Two"}
+        bot.mark_dirty("dropped_cards", "-100")
+        first = await bot.backups.backup()
+        assert first["type"] == "delta"
+        after_first = live_state()
+
+        data["users"]["3"]["fav_card"] = "card_1"
+        bot.mark_dirty("users", "3")
+        del data["groups"]["-100"]
+        bot.mark_dirty("groups", "-100")
+        del data["dropped_cards"]["-200"]  # claimed
+        data["group_messages"]["-200"] = 0
+        bot.mark_dirty("dropped_cards", "-200")
+        bot.mark_dirty("group_messages", "-200")
+        second = await bot.backups.backup()
+        assert second["type"] == "delta" and second["base"] == full["file"]
+        return full, first, after_first
+
+    full, first, after_first = asyncio.run(run())
+    assert rebuilt_state() == live_state()
+    assert rebuilt_state(first["file"]) == after_first
+    assert "2" not in rebuilt_state()["users"] and "-100" not in rebuilt_state()["groups"]
+    assert rebuilt_state(full["file"])["dropped_cards"] == {"-200": {"id": "card_1", "name": "One"}}
+    assert rebuilt_state()["group_messages"] == {"-100": 8, "-200": 0}
+
+
+def test_a_restored_backup_keeps_drop_progress(sqlite_state, tmp_path):
+    bot.data["group_messages"]["-100"] = 99
+    bot.data["dropped_cards"]["-100"] = {"id": "card_1", "name": "One"}
+    bot.mark_dirty("group_messages", "-100")
+    bot.mark_dirty("dropped_cards", "-100")
+    entry = asyncio.run(bot.backups.backup(full=True))
+    staged = str(tmp_path / "data.restore")
+    with open(entry["path"], "rb") as src, open(staged, "wb") as out:
+        out.write(src.read())
+    bot.unpack_backup(staged)
+    obj, _ = bot.restore_state(staged)
+    assert obj["group_messages"] == {"-100": 99}
+    assert obj["dropped_cards"] == {"-100": {"id": "card_1", "name": "One"}}
@@ -0,0 +1,104 @@
+import asyncio
+import time
+
+import pytest
+from telegram.error import RetryAfter
+
+import bot
+
+
+class StubBot:
+    """Records broadcast sends; `hang_after` sends, further sends block until cancelled."""
+
+    def __init__(self, hang_after=None, retry_after=None):
+        self.sent = []  # chat ids, one per attempt
+        self.edits = []
+        self.hang_after = hang_after
+        self.retry_after = dict(retry_after or {})  # chat id -> seconds, raised once
+
+    async def send_message(self, chat_id, text):
+        if self.hang_after is not None and len(self.sent) >= self.hang_after:
+            await asyncio.Event().wait()
+        self.sent.append(chat_id)
+        if chat_id in self.retry_after:
+            raise RetryAfter(self.retry_after.pop(chat_id))
+
+    async def edit_message_text(self, text, **kwargs):
+        self.edits.append(text)
+
+
+@pytest.fixture
+def broadcast(json_state, monkeypatch):
+    monkeypatch.setattr(bot, "BROADCAST_RATE", 1000.0)
+    monkeypatch.setattr(bot, "BROADCAST_WORKERS", 3)
+    monkeypatch.setattr(bot, "broadcast_job", None)
+
+    def create(stub, count):
+        targets = [str(-100 - i) for i in range(count)]
+        return bot.BroadcastJob.create(stub, targets, "hello", None, 1, 99)
+    return create
+
+
+def test_token_bucket_paces_after_the_burst():
+    async def go():
+        bucket = bot.TokenBucket(50, 2)
+        started = time.monotonic()
+        for _ in range(2):
+            await bucket.acquire()
+        assert time.monotonic() - started < 0.02
+        for _ in range(5):
+            await bucket.acquire()
+        paced = time.monotonic() - started
+        bucket.pause(0.1)
+        await bucket.acquire()
+        return paced, time.monotonic() - started - paced
+    paced, paused = asyncio.run(go())
+    assert paced >= 5 / 50 * 0.9
+    assert paused >= 0.1 * 0.9
+
+
+def test_a_restarted_broadcast_resumes_from_its_cursor(broadcast, monkeypatch):
+    first = StubBot(hang_after=6)
+    job = broadcast(first, 20)
+
+    async def interrupted():
+        job.start()
+        while len(first.sent) < 6:
+            await asyncio.sleep(0.01)
+        job.task.cancel()  # what on_shutdown does, followed by its final flush
+        with pytest.raises(asyncio.CancelledError):
+            await job.task
+        bot.mark_dirty("broadcast")
+        await bot.persistence.flush()
+    asyncio.run(interrupted())
+
+    monkeypatch.setattr(bot, "data", bot.load_data(strict=True))
+    cursor = bot.data["broadcast"]["cursor"]
+    assert cursor == 6 and bot.data["broadcast"]["success"] == 6
+
+    second = StubBot()
+
+    async def resumed():
+        bot.resume_broadcast(second)
+        await bot.broadcast_job.task
+    asyncio.run(resumed())
+    targets = job.state["targets"]
+    assert second.sent == [int(chat) for chat in targets[cursor:]]
+    assert bot.broadcast_job.state["success"] == 20 and bot.broadcast_job.state["failed"] == 0
+    assert bot.data["broadcast"] is None
+    assert "Broadcast ပြီးပါပြီ" in second.edits[-1]
+
+
+def test_retry_after_pauses_and_resends(broadcast):
+    stub = StubBot(retry_after={-102: 0.1})
+    job = broadcast(stub, 5)
+
+    async def go():
+        started = time.monotonic()
+        await job.start().task
+        return time.monotonic() - started
+    elapsed = asyncio.run(go())
+    assert elapsed >= 0.1 * 0.9
+    assert stub.sent.count(-102) == 2
+    assert sorted(set(stub.sent)) == sorted(int(chat) for chat in job.state["targets"])
+    assert job.state["success"] == 5 and job.state["failed"] == 0
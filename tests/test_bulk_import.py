@@ -0,0 +1,66 @@
+import json
+import zipfile
+
+import bot
+
+MANIFEST = """﻿Name,Movie,Rarity,Photo
+Aung,Film One,rare,a.jpg
+Aung , film  one,Rare,https://example.com/a.jpg
+
+Mya,Film One,Shiny,b.jpg
+Hla,Film Two,Epic,missing.jpg
+Old,Film Zero,Common,https://example.com/o.jpg
+Big,Film Two,Common,big.jpg
+"""
+
+
+def archive(tmp_path):
+    path = tmp_path / "cards.zip"
+    with zipfile.ZipFile(path, "w") as z:
+        z.writestr("cards/manifest.csv", MANIFEST)
+        z.writestr("cards/a.jpg", b"JPEG")
+        z.writestr("cards/b.jpg", b"JPEG")
+        z.writestr("cards/big.jpg", b"JPEG" * 4)
+    return path.read_bytes()
+
+
+def test_manifests_read_as_csv_or_json():
+    rows = bot.read_manifest("cards.csv", "Aung,Film One,Rare,a.jpg\n".encode())
+    assert rows == [{"name": "Aung", "movie": "Film One", "rarity": "Rare", "photo": "a.jpg"}]
+    document = {"cards": [{"name": "Aung", "movie": "Film One", "rarity": "Rare", "photo": "x"}, "junk"]}
+    assert bot.read_manifest("cards.JSON", json.dumps(document).encode()) == document["cards"][:1]
+
+
+def test_archive_photos_are_read_from_the_zip(tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, "MAX_PHOTO_BYTES", 8)
+    entries = bot.read_archive(archive(tmp_path))
+    assert [entry["name"] for entry in entries] == ["Aung", "Aung", "Mya", "Hla", "Old", "Big"]
+    assert entries[0]["photo"] == b"JPEG"
+    assert entries[1]["photo"] == "https://example.com/a.jpg"
+    assert entries[3]["photo"] == "missing.jpg"
+    assert entries[5]["error"] == "photo > 10MB"
+
+
+def test_checks_reject_duplicates_and_bad_rows(json_state, tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, "MAX_PHOTO_BYTES", 8)
+    bot.data["cards"] = [{"id": "card_1", "name": "Old", "movie": "Film Zero", "rarity": "Common", "photo": "p"}]
+    seen = set()
+    reasons = [bot.check_entry(entry, seen) for entry in bot.read_archive(archive(tmp_path))]
+    assert reasons == [None, "duplicate", "rarity မှား (Shiny)", "photo ဖိုင် မတွေ့ (missing.jpg)",
+                       "duplicate", "photo > 10MB"]
+
+
+def test_added_cards_get_fresh_ids(json_state):
+    bot.data["cards"] = [{"id": "card_1", "name": "Old", "movie": "Film Zero", "rarity": "Common", "photo": "p"}]
+    bot.data["retired_cards"] = {"card_2": {"name": "Gone", "movie": "Film Zero", "rarity": "Common", "photo": "p"}}
+    entries = [
+        {"name": "Aung", "movie": "Film One", "rarity": "Rare", "photo": "f1"},
+        {"name": "Mya", "movie": "Film One", "rarity": "Rare", "photo": "f2"},
+        {"name": "Old", "movie": "Film Zero", "rarity": "Common", "photo": "f3"},  # added meanwhile
+    ]
+    added = bot.add_cards(entries)
+    assert [card["id"] for card in added] == ["card_3", "card_4"]  # a deleted card's id is not reused
+    assert entries[2]["error"] == "duplicate"
+    assert bot.data["next_card"] == 5
+    assert bot.card_info("card_4")["name"] == "Mya"
+    assert "cards" in bot.persistence.pending
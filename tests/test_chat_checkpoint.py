@@ -0,0 +1,66 @@
+import asyncio
+import os
+
+import bot
+
+DROP = ["card_1", 10001, None]
+
+
+def drop_in(chat_id, count):
+    bot.data["group_messages"][chat_id] = count
+    bot.data["dropped_cards"][chat_id] = DROP
+    bot.mark_dirty("group_messages", chat_id)
+    bot.mark_dirty("dropped_cards", chat_id)
+
+
+def test_checkpoint_round_trip(json_state):
+    drop_in("-100", 3)
+    asyncio.run(bot.chat_checkpoint.save())
+    assert not bot.chat_checkpoint.dirty
+    obj = {"group_messages": {"-100": 1}, "dropped_cards": {}}
+    bot.chat_checkpoint.load(obj)
+    assert obj == {"group_messages": {"-100": 3}, "dropped_cards": {"-100": DROP}}
+
+    # nothing changed since: no rewrite
+    os.remove(bot.chat_checkpoint.path)
+    asyncio.run(bot.chat_checkpoint.save())
+    assert not os.path.exists(bot.chat_checkpoint.path)
+
+
+def test_without_a_checkpoint_the_main_data_is_adopted(json_state):
+    drop_in("-100", 3)
+    asyncio.run(bot.chat_checkpoint.save())
+    bot.chat_checkpoint.discard()
+    obj = {"group_messages": {"-100": 1}, "dropped_cards": {}}
+    bot.chat_checkpoint.load(obj)
+    assert obj == {"group_messages": {"-100": 1}, "dropped_cards": {}}
+    assert bot.chat_checkpoint.dirty  # written out at the next save
+
+    with open(bot.chat_checkpoint.path, "w", encoding="utf-8") as f:
+        f.write('{"group_messages": {"-1')
+    bot.chat_checkpoint.dirty = False
+    bot.chat_checkpoint.load(obj)
+    assert obj["group_messages"] == {"-100": 1} and bot.chat_checkpoint.dirty
+
+
+def test_chat_changes_do_not_force_full_snapshots(json_state, monkeypatch):
+    saves = []
+    save = json_state.save
+
+    def recording(snapshot, dirty, full):
+        saves.append((dirty, full))
+        return save(snapshot, dirty, full)
+    monkeypatch.setattr(json_state, "save", recording)
+
+    drop_in("-100", 3)
+    assert bot.persistence.dirty == 0
+    assert asyncio.run(bot.persistence.flush()) and saves == []
+
+    bot.get_user(5)["coins"] = 1
+    bot.mark_dirty("users", "5")
+    drop_in("-200", 4)
+    asyncio.run(bot.persistence.flush())
+    (dirty, full), = saves
+    assert not full
+    assert dirty["users"] == {"5"}
+    assert not set(bot.CHAT_KINDS) & set(dirty)
@@ -0,0 +1,63 @@
+import asyncio
+import json
+
+import pytest
+
+import bot
+
+
+def legacy_copy(instance, name, movie, rarity="Common"):
+    return {"id": instance, "name": name, "movie": movie, "rarity": rarity, "photo": "p"}
+
+
+@pytest.fixture
+def legacy(json_state, tmp_path, monkeypatch):
+    """A data file written before harems held [card_id, serial, acquired_at] records."""
+    document = {
+        "cards": [{"id": "card_1", "name": "One", "movie": "M", "rarity": "Rare", "photo": "p1"}],
+        "users": {"7": {"coins": 0, "fav_card": None, "last_daily": None, "last_slime": None, "harem": [
+            legacy_copy("card_1_42", "One", "M", "Rare"),
+            legacy_copy("card_1_ab12", "One", "M", "Rare"),
+            legacy_copy("card_9_5", "Gone", "Old"),  # deleted before retired_cards existed
+            legacy_copy("odd", "Odd", "Old"),
+        ]}},
+    }
+    with open(str(tmp_path / "data.json"), "w", encoding="utf-8") as f:
+        json.dump(document, f)
+    monkeypatch.setattr(bot, "data", bot.load_data(strict=True))
+    monkeypatch.setattr(bot, "harem_movies", bot.OrderedDict())
+    monkeypatch.setattr(bot, "harem_ids", bot.OrderedDict())
+    bot.migrate_harems()
+    return tmp_path
+
+
+def test_legacy_copies_become_compact_records(legacy):
+    harem = bot.data["users"]["7"]["harem"]
+    assert harem == [["card_1", 42, None], ["card_1", "ab12", None], ["card_9", 5, None], ["odd", None, None]]
+    assert [bot.instance_id(item) for item in harem] == ["card_1_42", "card_1_ab12", "card_9_5", "odd"]
+    # the catalog card is referenced; copies of unknown cards were retired with their metadata
+    assert bot.resolve(harem[0]) == {"id": "card_1_42", "name": "One", "movie": "M", "rarity": "Rare", "photo": "p1"}
+    assert bot.card_info("card_9") == {"name": "Gone", "movie": "Old", "rarity": "Common", "photo": "p"}
+    assert bot.resolve(harem[3])["name"] == "Odd"
+    assert bot.find_instance("7", bot.data["users"]["7"], "card_9_5") is harem[2]
+
+
+def test_saved_form_is_compact(legacy):
+    asyncio.run(bot.persistence.flush())
+    with open(str(legacy / "data.json"), encoding="utf-8") as f:
+        stored = json.load(f)
+    assert all(isinstance(item, list) for item in stored["users"]["7"]["harem"])
+    assert set(stored["retired_cards"]) == {"card_9", "odd"}
+
+
+def test_harem_and_deleted_cards_still_render(legacy, handlers):
+    handlers.run(handlers.message(7, "/harem"))
+    page = handlers.request.texts()[-1]
+    for shown in ("One", "card_1_ab12", "Gone", "card_9_5", "Odd"):
+        assert shown in page
+    handlers.run(handlers.message(1, "/delete card_1"))
+    assert bot.data["cards"] == []
+    assert bot.card_info("card_1")["name"] == "One"  # retired, not lost
+    handlers.run(handlers.message(7, "/harem"))
+    page = handlers.request.texts()[-1]
+    assert "One" in page and "card_1_42" in page
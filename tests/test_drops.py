@@ -0,0 +1,68 @@
+import random
+from collections import Counter
+
+import pytest
+
+import bot
+
+WEIGHTS = {"Common": 50, "Rare": 30, "Epic": 12, "Legendary": 6, "Mythic": 2}
+
+
+def catalog(counts):
+    return [{"id": f"{rarity}_{i}", "rarity": rarity} for rarity, count in counts.items() for i in range(count)]
+
+
+def table_distribution(engine):
+    """Exact rarity probabilities encoded by the alias table."""
+    n = len(engine._rarities)
+    chances = Counter()
+    for i, rarity in enumerate(engine._rarities):
+        chances[rarity] += engine._prob[i] / n
+        chances[engine._rarities[engine._alias[i]]] += (1 - engine._prob[i]) / n
+    return chances
+
+
+def expected(weights, present):
+    total = sum(weights[r] for r in present)
+    return {r: weights[r] / total for r in present}
+
+
+@pytest.mark.parametrize("counts", [
+    {"Common": 400, "Rare": 30, "Epic": 5, "Legendary": 2, "Mythic": 1},
+    {"Common": 1, "Mythic": 1},
+    {"Rare": 3, "Epic": 3, "Legendary": 3},
+    {"Epic": 10},
+])
+def test_alias_table_matches_the_weights(counts):
+    engine = bot.DropEngine(WEIGHTS).of(catalog(counts))
+    assert table_distribution(engine) == pytest.approx(expected(WEIGHTS, counts))
+
+
+def test_draws_follow_the_weights_not_the_bucket_sizes(monkeypatch):
+    monkeypatch.setattr(bot, "random", random.Random(1234))
+    engine = bot.DropEngine(WEIGHTS).of(catalog({"Common": 1000, "Rare": 10, "Epic": 10, "Legendary": 10, "Mythic": 1}))
+    draws = 200_000
+    seen = Counter(engine.rarity() for _ in range(draws))
+    for rarity, share in expected(WEIGHTS, WEIGHTS).items():
+        assert seen[rarity] / draws == pytest.approx(share, abs=0.005)
+
+
+def test_table_follows_buckets_that_empty_and_fill():
+    cards = catalog({"Common": 2, "Mythic": 1})
+    engine = bot.DropEngine(WEIGHTS).of(cards)
+    mythic = cards.pop()
+    engine.removed(cards, mythic)
+    assert table_distribution(engine) == pytest.approx({"Common": 1.0})
+    epic = {"id": "Epic_0", "rarity": "Epic"}
+    cards.append(epic)
+    engine.added(cards, epic)
+    assert table_distribution(engine) == pytest.approx(expected(WEIGHTS, ["Common", "Epic"]))
+    assert engine.buckets["Epic"] == [epic]
+
+
+def test_unweighted_rarities_are_never_drawn_unless_alone():
+    weights = dict(WEIGHTS, Rare=0)
+    engine = bot.DropEngine(weights).of(catalog({"Common": 1, "Rare": 50}))
+    assert table_distribution(engine) == pytest.approx({"Common": 1.0})
+    engine = bot.DropEngine(weights).of(catalog({"Rare": 2, "Special": 2}))
+    assert table_distribution(engine) == pytest.approx({"Rare": 0.5, "Special": 0.5})
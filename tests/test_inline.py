@@ -0,0 +1,15 @@
+import bot
+
+
+def test_harem_query_of_an_unknown_user_creates_nothing(json_state):
+    bot.data["cards"] = [{"id": "card_1", "name": "One", "movie": "M", "rarity": "Common", "photo": "p"}]
+    assert bot.inline_matches("harem", "404", "") == []
+    assert "404" not in bot.data["users"]
+    assert not bot.persistence.dirty
+    assert [card["id"] for card in bot.inline_matches("catalog", "404", "One")] == ["card_1"]
+
+
+def test_harem_query_lists_the_newest_entries_first(json_state):
+    bot.data["cards"] = [{"id": "card_1", "name": "One", "movie": "M", "rarity": "Common", "photo": "p"}]
+    bot.data["users"]["7"] = {"coins": 0, "harem": [["card_1", 10001, 0], ["card_1", 10002, 1]]}
+    assert [item[1] for item in bot.inline_matches("harem", "7", "")] == [10002, 10001]
@@ -0,0 +1,123 @@
+import asyncio
+import json
+import os
+import threading
+
+import pytest
+
+import bot
+
+
+def write_segment(prefix, first, records, tail=""):
+    path = f"{prefix}.{first:012d}"
+    with open(path, "w", encoding="utf-8") as f:
+        f.writelines(json.dumps(record) + "\n" for record in records)
+        f.write(tail)
+    return path
+
+
+def test_replay_skips_a_torn_final_record_and_keeps_appending(tmp_path):
+    prefix = str(tmp_path / "data.journal")
+    write_segment(prefix, 1, [[1, "coins", "5", 10], [2, "coins", "5", 20]], tail='[3,"coins","5",4')
+    applied = []
+    journal = bot.Journal(prefix, True, 0)
+    assert journal.replay(0, lambda op, *args: applied.append((op, *args))) == 2
+    assert applied == [("coins", "5", 10), ("coins", "5", 20)]
+    assert journal.seq == journal.synced == 2
+
+    # the next record gets the torn one's number, in a segment of its own
+    journal.append("coins", ["5", 7])
+    journal._write(journal._buffer, journal.seq)
+    journal._seal()
+    assert len(journal.segments()) == 2
+
+    applied.clear()
+    assert bot.Journal(prefix, True, 0).replay(1, lambda op, *args: applied.append((op, *args))) == 2
+    assert applied == [("coins", "5", 20), ("coins", "5", 7)]
+
+
+def test_compaction_waits_for_a_running_replay(tmp_path):
+    prefix = str(tmp_path / "data.journal")
+    for first in (1, 3, 5):
+        write_segment(prefix, first, [[first, "coins", "1", 1], [first + 1, "coins", "1", 1]])
+    journal = bot.Journal(prefix, True, 0)
+    reading, release = threading.Event(), threading.Event()
+    applied = []
+
+    def apply(op, *args):
+        applied.append(op)
+        if len(applied) == 1:
+            reading.set()
+            release.wait(5)
+
+    replay = threading.Thread(target=lambda: journal.replay(0, apply))
+    replay.start()
+    assert reading.wait(5)
+    prune = threading.Thread(target=journal._prune, args=(4,))
+    prune.start()
+    prune.join(0.2)
+    assert prune.is_alive()  # held back until the replay has read (and listed) every segment
+    release.set()
+    replay.join(5)
+    prune.join(5)
+
+    assert len(applied) == 6
+    assert [os.path.basename(path) for path in journal.segments()] == ["data.journal.000000000005"]
+    assert journal._closed == [[f"{prefix}.000000000005", 6]]
+
+
+def failing_fsync(monkeypatch, times):
+    fsync = os.fsync
+    left = [times]
+
+    def flaky(fd):
+        if left[0]:
+            left[0] -= 1
+            raise OSError("disk full")
+        fsync(fd)
+    monkeypatch.setattr(bot.os, "fsync", flaky)
+
+
+def test_a_failed_write_is_retried_in_a_new_segment_and_replayed_once(tmp_path, monkeypatch):
+    prefix = str(tmp_path / "data.journal")
+    journal = bot.Journal(prefix, True, 0)
+    journal.append("coins", ["5", 1])
+    asyncio.run(journal.commit())
+
+    failing_fsync(monkeypatch, 1)
+    journal.append("coins", ["5", 2])
+    with pytest.raises(OSError):
+        asyncio.run(journal.commit())  # record 2 reached the file, but was not acknowledged
+    journal.append("coins", ["5", 3])
+    asyncio.run(journal.commit())
+    assert len(journal.segments()) == 2
+
+    applied = []
+    bot.Journal(prefix, True, 0).replay(0, lambda op, user_key, delta: applied.append(delta))
+    assert applied == [1, 2, 3]
+
+
+def test_a_failed_first_write_leaves_no_segment_behind(tmp_path, monkeypatch):
+    prefix = str(tmp_path / "data.journal")
+    journal = bot.Journal(prefix, True, 0)
+    failing_fsync(monkeypatch, 1)
+    journal.append("coins", ["5", 1])
+    with pytest.raises(OSError):
+        asyncio.run(journal.commit())
+    assert journal.segments() == []
+    asyncio.run(journal.commit())
+    applied = []
+    bot.Journal(prefix, True, 0).replay(0, lambda op, user_key, delta: applied.append(delta))
+    assert applied == [1]
+
+
+def test_a_handler_replies_when_the_journal_cannot_be_written(handlers, monkeypatch):
+    def broken(lines, upto):
+        raise OSError("disk full")
+    monkeypatch.setattr(bot.journal, "_write", broken)
+    failures = bot.metrics.series["bot_journal_failures_total"].get((), 0)
+    handlers.run(handlers.message(5, "/daily"))
+    assert "နေ့စဉ်ဆုလာဘ်!" in handlers.request.texts()[-1]
+    assert bot.data["users"]["5"]["last_daily"] is not None
+    assert "5" in bot.persistence.pending["users"]  # the flush saves what the journal could not
+    assert bot.metrics.series["bot_journal_failures_total"][()] == failures + 1
@@ -0,0 +1,23 @@
+import os
+
+import bot
+
+
+def open_files():
+    return len(os.listdir("/proc/self/fd"))
+
+
+def test_lazy_saves_close_the_reader_they_replace(tmp_path):
+    storage = bot.JsonStorage(str(tmp_path / "data.json"), lazy=True)
+    users = {str(i): {"coins": i, "harem": []} for i in range(5)}
+    storage.save({"users": users, "cards": []}, {"users": None, "cards": None}, full=True)
+    first = storage._view[0]
+    before = open_files()
+    for coins in range(20):
+        storage.save({"users": {"1": {"coins": coins, "harem": []}}}, {"users": {"1"}})
+    assert first.closed
+    assert open_files() == before
+    assert storage.load_user("1") == {"coins": 19, "harem": []}
+    assert storage.load_user("4") == {"coins": 4, "harem": []}
+    storage.close()
+    assert storage._view[0] is None and first.closed
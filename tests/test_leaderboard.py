@@ -0,0 +1,55 @@
+import asyncio
+
+import bot
+
+
+def add_users(count):
+    users = bot.data["users"]
+    for i in range(count):
+        users[str(i)] = {"coins": i, "harem": [], "fav_card": None, "last_daily": None, "last_slime": None}
+    bot.mark_dirty("users")
+
+
+def test_concurrent_tops_share_one_rebuild(sqlite_state, monkeypatch):
+    add_users(60)
+    board = bot.Leaderboard("coins", 10)
+    scans = []
+    real_top_users = bot.top_users
+
+    async def counting_top_users(by, limit):
+        scans.append(by)
+        return await real_top_users(by, limit)
+
+    monkeypatch.setattr(bot, "top_users", counting_top_users)
+
+    async def bump():
+        # lands while the rebuild waits for the SQLite flush
+        while not board._listeners:
+            await asyncio.sleep(0)
+        user = bot.data["users"]["7"]
+        user["coins"] = 1_000_000
+        board.update("7", user)
+
+    async def run():
+        return await asyncio.gather(board.top(), board.top(), bump())
+
+    first, second, _ = asyncio.run(run())
+    assert scans == ["coins"]
+    assert first == second
+    assert first[0] == ("7", 1_000_000)
+    assert [value for _, value in first[1:]] == list(range(59, 50, -1))
+    assert board._listeners == [] and board._rebuilding is None
+
+
+def test_rebuild_after_a_finished_one_scans_again(sqlite_state):
+    add_users(20)
+    board = bot.Leaderboard("coins", 5)
+
+    async def run():
+        await board._rebuild()
+        bot.data["users"]["3"]["coins"] = 500
+        bot.mark_dirty("users", "3")
+        await board._rebuild()
+        return await board.top()
+
+    assert asyncio.run(run())[0] == ("3", 500)
@@ -0,0 +1,20 @@
+import asyncio
+
+import bot
+
+
+def test_breakdown_sizes_every_kind_and_the_biggest_users(json_state):
+    bot.data["cards"] = [{"id": f"card_{i}", "name": f"N{i}", "movie": "M", "rarity": "Common", "photo": "p"}
+                         for i in range(1, 20)]
+    for user_id, cards in ((5, 1), (6, 300), (7, 40), (8, 0)):
+        user = bot.get_user(user_id)
+        user["harem"] = [["card_1", 10000 + n, 0] for n in range(cards)]
+
+    sizes, users = asyncio.run(bot.memory_breakdown(top=2, chunk=2))
+    assert set(bot.data) <= set(sizes)
+    assert {f"index:{name}" for name in bot.INDEX_NAMES} <= set(sizes)
+    assert all(size >= 0 for size in sizes.values())
+    assert sizes["cards"] > sizes["sudos"] > 0
+    assert [key for _, key in users] == ["6", "7"]
+    assert users[0][0] > users[1][0]
+    assert sizes["users"] >= sum(size for size, _ in users)
@@ -0,0 +1,47 @@
+import bot
+
+
+def rendered(metrics):
+    return metrics.render().splitlines()
+
+
+def test_histogram_buckets_are_cumulative():
+    metrics = bot.Metrics()
+    metrics.histogram("t_seconds", "Test latency.", buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        metrics.observe("t_seconds", value, method="send")
+    assert rendered(metrics) == [
+        "# HELP t_seconds Test latency.",
+        "# TYPE t_seconds histogram",
+        't_seconds_bucket{method="send",le="0.1"} 2',  # a bound's own value falls in its bucket
+        't_seconds_bucket{method="send",le="1.0"} 3',
+        't_seconds_bucket{method="send",le="+Inf"} 4',
+        't_seconds_sum{method="send"} 3.650000',
+        't_seconds_count{method="send"} 4',
+    ]
+
+
+def test_counters_gauges_and_label_escaping():
+    metrics = bot.Metrics()
+    metrics.counter("t_total", "Test counter.")
+    metrics.inc("t_total", chat='say "hi"\\\n')
+    metrics.inc("t_total", 2, chat='say "hi"\\\n')
+    metrics.inc("t_total")
+    metrics.gauge("t_users", "Test gauge.", lambda: 7)
+    metrics.gauge("t_shards", "Test labelled gauge.", lambda: {(("shard", 0),): 1, (("shard", 1),): 2})
+    metrics.gauge("t_broken", "Raises.", lambda: 1 / 0)
+    assert rendered(metrics) == [
+        "# HELP t_total Test counter.",
+        "# TYPE t_total counter",
+        't_total{chat="say \\"hi\\"\\\\\\n"} 3',
+        "t_total 1",
+        "# HELP t_users Test gauge.",
+        "# TYPE t_users gauge",
+        "t_users 7",
+        "# HELP t_shards Test labelled gauge.",
+        "# TYPE t_shards gauge",
+        't_shards{shard="0"} 1',
+        't_shards{shard="1"} 2',
+        "# HELP t_broken Raises.",
+        "# TYPE t_broken gauge",
+    ]
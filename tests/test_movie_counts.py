@@ -0,0 +1,53 @@
+from collections import Counter
+
+import bot
+
+
+def recount(cards, movie_of):
+    return Counter(movie_of(card) for card in cards)
+
+
+def assert_in_step(user):
+    """The incrementally kept counts (read without .of(), which would rebuild) match a recount."""
+    owned, catalog = bot.harem_movies["5"], bot.catalog_movies
+    assert owned._cards is user["harem"] and owned._size == len(user["harem"])
+    assert +Counter(owned.counts) == recount(user["harem"], bot.card_movie)
+    assert catalog._cards is bot.data["cards"] and catalog._size == len(bot.data["cards"])
+    assert +Counter(catalog.counts) == recount(bot.data["cards"], lambda card: card.get("movie"))
+
+
+def test_counts_follow_claims_purchases_gifts_uploads_and_deletes(handlers, monkeypatch):
+    monkeypatch.setattr(bot, "harem_movies", bot.OrderedDict())
+    monkeypatch.setattr(bot, "catalog_movies", bot.MovieCounts())
+    bot.data["cards"] = [
+        {"id": "card_1", "name": "One", "movie": "Film A", "rarity": "Common", "photo": "p"},
+        {"id": "card_2", "name": "Two", "movie": "Film B", "rarity": "Common", "photo": "p"},
+    ]
+    bot.data["next_card"] = 3
+    user = bot.get_user(5)
+    user["harem"].append(bot.new_record("card_1"))
+    handlers.run(handlers.message(5, "/harem"))  # builds both indexes
+    assert_in_step(user)
+
+    bot.data["dropped_cards"]["-100"] = dict(bot.data["cards"][1], id="card_2_1234", card_id="card_2")
+    handlers.run(handlers.message(5, "/slime Two", chat_id=-100))
+    assert len(user["harem"]) == 2
+    assert_in_step(user)
+
+    handlers.run(handlers.callback(5, "buy_card_1"))
+    assert len(user["harem"]) == 3
+    assert_in_step(user)
+
+    handlers.run(handlers.message(1, "/gift card 4 5"))
+    assert len(user["harem"]) == 7
+    assert_in_step(user)
+
+    added = bot.add_cards([{"name": "Three", "movie": "Film C", "rarity": "Rare", "photo": "p"}])
+    assert [card["id"] for card in added] == ["card_3"]
+    assert_in_step(user)
+
+    handlers.run(handlers.message(1, "/delete card_1"))
+    assert bot.catalog_ids.of(bot.data["cards"]).get("card_1") is None
+    assert_in_step(user)  # owned copies keep counting under their (retired) movie
+    assert bot.harem_movies["5"].counts["Film A"] == recount(user["harem"], bot.card_movie)["Film A"] >= 2
+    assert "Film A" not in +Counter(bot.catalog_movies.counts)
@@ -0,0 +1,28 @@
+import asyncio
+
+import bot
+
+
+def test_name_cache_drops_the_least_recently_seen(json_state, monkeypatch):
+    monkeypatch.setattr(bot, "name_cache", bot.OrderedDict())
+    monkeypatch.setattr(bot, "NAME_CACHE_SIZE", 2)
+    bot.remember_name(1, "One")
+    bot.remember_name(2, "Two")
+    assert bot._name_entry("1")[0] == "One"  # seen again: now the most recent
+    bot.remember_name(3, "Three")
+    assert list(bot.name_cache) == ["1", "3"]
+
+
+def test_lazy_users_names_do_not_load_records(sqlite_state, monkeypatch):
+    monkeypatch.setattr(bot, "name_cache", bot.OrderedDict())
+    bot.data["users"]["5"] = {"coins": 1, "harem": [["card_1", 10001, 0]], "fav_card": None,
+                              "last_daily": None, "last_slime": None}
+    bot.mark_dirty("users", "5")
+    bot.remember_name(5, "Five")
+    asyncio.run(bot.persistence.flush())
+    users = bot.LazyUsers(sqlite_state)
+    monkeypatch.setitem(bot.data, "users", users)
+    bot.remember_name(5, "Five")
+    assert bot._name_entry("5")[0] == "Five"
+    assert users.loaded_keys() == set()
+    assert bot._name_entry("6") is None
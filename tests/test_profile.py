@@ -0,0 +1,43 @@
+import threading
+from collections import Counter
+
+import bot
+
+
+def test_report_of_synthetic_stacks():
+    stacks = Counter({
+        "MainThread;bot.py:main;bot.py:handler;bot.py:freeze": 3,
+        "MainThread;bot.py:main;bot.py:handler": 1,
+        "MainThread;bot.py:main;selectors.py:EpollSelector.select": 4,
+        "persist;threading.py:Thread.run;thread.py:_worker": 8,
+    })
+    lines = bot.profile_report(stacks, 8, interval=0.01, top=2).splitlines()
+    assert lines == [
+        "8 samples, 10 ms apart",
+        "MainThread: busy 50% (~0.04 s)",
+        "persist: busy 0% (~0.00 s)",
+        "",
+        "self    total   function",
+        " 75.0%   75.0%  bot.py:freeze",
+        " 25.0%  100.0%  bot.py:handler",
+    ]
+
+
+def spin(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_report_of_a_sampled_busy_thread():
+    stop = threading.Event()
+    worker = threading.Thread(target=spin, args=(stop,), name="spinner")
+    worker.start()
+    try:
+        stacks, rounds = bot.sample_threads(0.1, interval=0.002)
+    finally:
+        stop.set()
+        worker.join()
+    report = bot.profile_report(stacks, rounds, interval=0.002)
+    assert rounds > 0
+    assert "spinner: busy" in report
+    assert "test_profile.py:spin" in report
@@ -0,0 +1,79 @@
+import asyncio
+import json
+
+import pytest
+
+import bot
+
+
+def save_live(coins):
+    bot.data["users"]["1"] = {"coins": coins, "harem": [], "fav_card": None, "last_daily": None, "last_slime": None}
+    bot.data["cards"] = [{"id": "c1", "name": "Live", "movie": "M", "rarity": "Common", "photo": "p"}]
+    bot.mark_dirty("users")
+    bot.mark_dirty("cards")
+    asyncio.run(bot.persistence.flush())
+
+
+def stage(tmp_path, document):
+    path = str(tmp_path / "data.restore")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(document)
+    return path
+
+
+def stored_coins():
+    return bot.storage.load()["users"]["1"]["coins"]
+
+
+@pytest.mark.parametrize("state", ["json_state", "sqlite_state"])
+def test_failed_restore_keeps_the_stored_state(state, request, tmp_path):
+    request.getfixturevalue(state)
+    save_live(5)
+    path = stage(tmp_path, '{"users": {"1": {"coins": 9, "harem": []}}, "cards": [')
+    with pytest.raises(ValueError):
+        bot.restore_state(path)
+    assert stored_coins() == 5
+    # the live storage's own encoded state survived too: the next save still has the user
+    bot.data["cards"].append({"id": "c2", "name": "New", "movie": "M", "rarity": "Common", "photo": "p"})
+    bot.mark_dirty("cards")
+    asyncio.run(bot.persistence.flush())
+    assert stored_coins() == 5
+
+
+@pytest.mark.parametrize("state", ["json_state", "sqlite_state"])
+def test_restore_installs_the_staged_document(state, request, tmp_path):
+    request.getfixturevalue(state)
+    save_live(5)
+    document = {
+        "users": {"2": {"coins": 9, "harem": [], "fav_card": None, "last_daily": None, "last_slime": None}},
+        "cards": [{"id": "c9", "name": "Restored", "movie": "R", "rarity": "Common", "photo": "p"}],
+        "group_messages": {"-100": 4},
+    }
+    obj, (movies, ids, search, drops) = bot.restore_state(stage(tmp_path, json.dumps(document)))
+    assert obj["users"]["2"]["coins"] == 9
+    assert "1" not in obj["users"]
+    assert obj["group_messages"] == {"-100": 4}
+    # built on the very list that gets swapped in, so it is not rebuilt on first use
+    assert ids._items is obj["cards"] and ids.by_id["c9"]["name"] == "Restored"
+    stored = bot.storage.load()
+    assert "1" not in stored["users"] and stored["users"]["2"]["coins"] == 9
+    assert [card["id"] for card in stored["cards"]] == ["c9"]
+
+
+@pytest.mark.parametrize("state", ["json_state", "sqlite_state"])
+def test_records_of_the_replaced_state_are_not_replayed(state, request, tmp_path):
+    request.getfixturevalue(state)
+    save_live(5)
+
+    async def earn():
+        bot.apply_op("coins", "1", 100)
+        await bot.commit()
+
+    asyncio.run(earn())
+    assert bot.journal.segments()
+    document = {"users": {"1": {"coins": 1, "harem": []}}, "cards": [], "journal_seq": 0}
+    bot.restore_state(stage(tmp_path, json.dumps(document)))
+    # a crash before the next flush: the new process replays the journal over the stored state
+    assert bot.journal.segments() == []
+    replayed = bot.Journal(bot.journal.prefix, True, 0).replay(0, lambda *args: pytest.fail("replayed"))
+    assert replayed == 0 and stored_coins() == 1
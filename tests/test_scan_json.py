@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+import bot
+
+DOCUMENT = {
+    "users": {
+        "1": {"coins": 5, "name": "quote \" backslash \\ brace } bracket ]", "harem": [["card_1", 10001, 0]]},
+        "say \"hi\"": {"coins": 0, "name": "မြန်မာ 😀 é", "harem": []},
+        "3": {"coins": 7, "harem": [], "nested": {"a": [{"b": {"c": []}}, "}"], "d": {}}},
+    },
+    "cards": [{"id": "card_1", "name": "{\"not\": \"an object\"}", "movie": "M\\N"}],
+    "empty": {},
+    "votes": {"opt \\\"": [1, 2]},
+    "drop_count": 10,
+}
+
+
+def write(tmp_path, text):
+    path = tmp_path / "data.json"
+    path.write_bytes(text.encode("utf-8"))
+    return str(path)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 64, 1 << 22])
+@pytest.mark.parametrize("indent", [None, 2])
+def test_spans_and_entries_survive_escapes_and_nesting(tmp_path, chunk_size, indent):
+    text = json.dumps(DOCUMENT, ensure_ascii=False, indent=indent)
+    raw = text.encode("utf-8")
+    entries = {}
+
+    def on_entry(kind, key, start, end, value):
+        assert json.loads(raw[start:end]) == value
+        entries[key] = value
+
+    spans = bot.scan_json(write(tmp_path, text), on_entry=on_entry, chunk_size=chunk_size)
+    assert list(spans) == list(DOCUMENT)
+    for kind, (start, end) in spans.items():
+        assert json.loads(raw[start:end]) == DOCUMENT[kind]
+    assert entries == DOCUMENT["users"]
+
+
+def test_every_truncation_is_rejected(tmp_path):
+    text = json.dumps(DOCUMENT, ensure_ascii=False)
+    raw = text.encode("utf-8")
+    path = tmp_path / "data.json"
+    for cut in range(len(raw)):
+        path.write_bytes(raw[:cut])
+        with pytest.raises(ValueError):
+            bot.scan_json(str(path), chunk_size=5)
+
+
+@pytest.mark.parametrize("text", [
+    '{"users": {"1": {"coins": 1}}} trailing',
+    '{"users": {"1" {"coins": 1}}}',
+    '{"users": {"1": {"coins": 1},}}',
+    '["users"]',
+    '{"users": {"1": {"name": "bad \\x escape"}}}',
+])
+def test_malformed_documents_are_rejected(tmp_path, text):
+    with pytest.raises(ValueError):
+        bot.scan_json(write(tmp_path, text))
+
+
+def test_validate_json_reports_problems(tmp_path):
+    assert bot.validate_json(write(tmp_path, json.dumps(DOCUMENT))) == []
+    problems = bot.validate_json(write(tmp_path, json.dumps({"users": {"1": {"coins": "many"}}, "cards": [{}]})))
+    assert problems == ["user 1 at byte 16: unexpected record shape", "'cards' is not a list of cards"]
+    assert bot.validate_json(write(tmp_path, '{"cards": []}')) == ["missing top-level 'users' object"]
+    assert bot.validate_json(write(tmp_path, '{"users": {"1": {"coins": 1}')) != []
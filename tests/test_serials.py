@@ -0,0 +1,53 @@
+import json
+
+import bot
+
+
+def test_serials_are_unique_and_start_past_the_legacy_range(json_state):
+    serials = [bot.allocate_serial() for _ in range(50)]
+    assert len(set(serials)) == 50
+    assert min(serials) >= bot.SERIAL_START
+    assert bot.data["next_serial"] > max(serials)
+
+
+def test_shard_workers_interleave_serials(json_state, monkeypatch):
+    monkeypatch.setattr(bot, "SHARDS", 3)
+    issued = {}
+    for shard in range(3):
+        monkeypatch.setattr(bot, "SHARD_INDEX", shard)
+        bot.data["next_serial"] = bot.SERIAL_START + 7  # every worker starts from the same snapshot
+        issued[shard] = [bot.allocate_serial() for _ in range(20)]
+        assert {serial % 3 for serial in issued[shard]} == {shard}
+    everything = [serial for serials in issued.values() for serial in serials]
+    assert len(set(everything)) == len(everything)
+
+
+def test_replayed_records_move_the_allocator_past_their_serials(json_state):
+    bot.data["users"]["5"] = {"coins": 0, "harem": [], "fav_card": None, "last_daily": None, "last_slime": None}
+    records = [
+        [1, "harem", "5", ["card_1", bot.SERIAL_START + 40, 0]],
+        [2, "claim", "-100", "5", ["card_2", bot.SERIAL_START + 90, 0], "2024-01-01T00:00:00"],
+        [3, "harem", "5", ["card_1", 4321, 0]],  # a legacy serial does not move it back
+    ]
+    with open(f"{bot.journal.prefix}.{1:012d}", "w", encoding="utf-8") as f:
+        f.writelines(json.dumps(record) + "\n" for record in records)
+    bot.replay_journal()
+    assert len(bot.data["users"]["5"]["harem"]) == 3
+    assert bot.allocate_serial() > bot.SERIAL_START + 90
+
+
+def test_find_instance_follows_the_harem(json_state, monkeypatch):
+    monkeypatch.setattr(bot, "harem_ids", bot.OrderedDict())
+    user = bot.get_user(5)
+    user["harem"] += [["card_1", 10001, 0], ["card_1", None, None], ["card_2", "x7", None]]
+    assert bot.find_instance("5", user, "card_1_10001") is user["harem"][0]
+    assert bot.find_instance("5", user, "card_1") is user["harem"][1]
+    assert bot.find_instance("5", user, "card_2_x7") is user["harem"][2]
+    assert bot.find_instance("5", user, "card_1_10002") is None
+
+    # an entry appended by an op is found without rebuilding the index
+    by_id = bot.harem_ids["5"].by_id
+    record = bot.new_record("card_3")
+    bot.apply_op("harem", "5", record)
+    assert bot.find_instance("5", user, bot.instance_id(record)) is record
+    assert bot.harem_ids["5"].by_id is by_id
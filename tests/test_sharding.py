@@ -0,0 +1,86 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+from telegram import Chat, Message, Update, User
+
+import bot
+
+USER, CHAT = 5551234, -1009876543210
+
+
+def message(text, chat=CHAT, user=USER, kind="message", **extra):
+    chat_type = "private" if chat > 0 else "supergroup"
+    return {"update_id": 1, kind: dict({"message_id": 1, "date": 0, "text": text, "chat": {"id": chat, "type": chat_type},
+                                        "from": {"id": user, "is_bot": False, "first_name": "U"}}, **extra)}
+
+
+def callback(data, user=USER):
+    return {"update_id": 2, "callback_query": {"id": "1", "data": data, "chat_instance": "1",
+                                               "from": {"id": user, "is_bot": False, "first_name": "U"}}}
+
+
+UPDATES = [
+    message("/harem"),
+    message("/harem@SomeBot 2"),
+    message("/fav card_1", chat=USER),
+    message("/slime 100", kind="edited_message"),
+    callback("harem_2"),
+    callback("shop_buy"),
+    message("hello"),
+    message("hello", user=USER + 1),
+    message("/upload", chat=USER),
+    callback("vote_A"),
+]
+
+
+@pytest.fixture
+def shards(monkeypatch):
+    monkeypatch.setattr(bot, "SHARDS", 4)
+
+
+def test_a_user_and_a_chat_always_land_on_the_same_shard(shards):
+    routes = [bot.route_update(update) for update in UPDATES]
+    user_shard, chat_shard = bot.shard_of(USER), bot.shard_of(CHAT)
+    # every command and callback of the user goes to the user's shard, whatever chat it came from
+    assert routes[:6] == [user_shard] * 6
+    # plain group messages count towards the chat's drop, whoever sends them
+    assert routes[6:8] == [chat_shard] * 2
+    assert routes[8:] == [0, 0]  # coordinator work
+    assert bot.shard_of(str(USER)) == bot.shard_of(USER)
+    assert [bot.route_update(update) for update in UPDATES] == routes
+
+
+def test_routes_do_not_depend_on_the_process(shards):
+    expected = [bot.route_update(update) for update in UPDATES]
+    assert len(set(expected)) > 1
+    code = ("import json, sys; import bot; "
+            "print(json.dumps([bot.route_update(u) for u in json.loads(sys.stdin.read())]))")
+    for seed in ("1", "2"):
+        # str hashes are salted per process; the routing must not be
+        env = dict(os.environ, SHARDS="4", PYTHONHASHSEED=seed)
+        out = subprocess.run([sys.executable, "-c", code], input=json.dumps(UPDATES), capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(bot.__file__)), env=env, check=True).stdout
+        assert json.loads(out.strip().splitlines()[-1]) == expected
+
+
+def test_users_are_locked_before_chats_whatever_their_stripe():
+    stripes = bot.LockStripes(8)
+    keys = [("chat", CHAT), ("votes",), ("user", USER), ("user", USER + 1)]
+    order = stripes.stripes(keys)
+    assert [bot.LockStripes.KINDS[kind] for kind, _ in order] == ["user", "user", "chat", "votes"]
+    assert order[:2] == sorted(order[:2])
+
+
+def test_a_claim_does_not_lock_a_chat_owned_elsewhere(shards, monkeypatch):
+    def scope(chat_id):
+        chat = Chat(chat_id, "supergroup")
+        update = Update(1, message=Message(1, bot.datetime.now(), chat, from_user=User(USER, "U", False)))
+        return bot.claim_scope(update, None)
+
+    monkeypatch.setattr(bot, "SHARD_INDEX", bot.shard_of(CHAT))
+    assert scope(CHAT) == [("chat", CHAT), ("user", USER)]
+    monkeypatch.setattr(bot, "SHARD_INDEX", (bot.shard_of(CHAT) + 1) % 4)
+    assert scope(CHAT) == [("user", USER)]
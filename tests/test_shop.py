@@ -0,0 +1,34 @@
+import pytest
+
+import bot
+
+MOVIE = "ချစ်သူရဲ့ ကမ္ဘာ — The Very Long Director's Cut Edition " * 2
+NAME = "မင်းသမီး_ရွှေ" * 6
+
+
+@pytest.fixture
+def catalog(json_state):
+    bot.data["cards"] = [{"id": "card_1", "name": NAME, "movie": MOVIE, "rarity": "Mythic", "photo": "p"}]
+
+
+@pytest.mark.parametrize("page, rarity, movie, name", [
+    (0, None, None, None),
+    (12345, "Mythic", None, None),
+    (7, "Legendary", MOVIE, None),
+    (3, None, MOVIE.upper(), None),
+])
+def test_shop_data_round_trips_within_64_bytes(catalog, page, rarity, movie, name):
+    payload = bot.shop_data(page, rarity, movie, name)
+    assert len(payload.encode()) <= 64
+    assert payload.startswith("shop_")
+    assert bot.parse_shop_data(payload[len("shop_"):]) == (page, rarity, movie and MOVIE, name)
+
+
+def test_a_long_name_is_cut_to_a_prefix_on_a_character_boundary(catalog):
+    payload = bot.shop_data(99, "Common", None, NAME)
+    assert len(payload.encode()) <= 64
+    page, rarity, movie, name = bot.parse_shop_data(payload[len("shop_"):])
+    assert (page, rarity, movie) == (99, "Common", None)
+    assert name and NAME.startswith(name)
+    # the prefix still finds the card it was cut from
+    assert [card["id"] for card in bot.catalog_search.of(bot.data["cards"]).search(None, None, name)] == ["card_1"]
@@ -0,0 +1,116 @@
+import bot
+
+
+def user(coins, size, **extra):
+    return dict({"coins": coins, "harem": [["card_1", 10_000 + i, i] for i in range(size)], "fav_card": None,
+                 "last_daily": None, "last_slime": None}, **extra)
+
+
+def save_users(storage, users):
+    storage.save({"users": users}, {"users": set(users)})
+
+
+def test_unchanged_harem_rows_are_not_rewritten(tmp_path):
+    storage = bot.SqliteStorage(str(tmp_path / "data.db"))
+    try:
+        big = user(5, 1000)
+        save_users(storage, {"1": big})
+        changes = storage.writer.total_changes
+
+        big["coins"] = 6  # a coin change touches the users row alone
+        save_users(storage, {"1": big})
+        assert storage.writer.total_changes - changes <= 2
+        changes = storage.writer.total_changes
+
+        big["harem"].append(["card_2", 20_000, 0])  # a new card is one more row
+        save_users(storage, {"1": big})
+        assert storage.writer.total_changes - changes <= 3
+        assert storage.load_user("1") == big
+
+        del big["harem"][10]  # anything else rewrites the harem
+        big["harem"].append(["card_3", 30_000, 0])
+        save_users(storage, {"1": big})
+        assert storage.load_user("1") == big
+        assert storage.writer.execute("SELECT COUNT(*) FROM harem").fetchone()[0] == 1001
+    finally:
+        storage.close()
+
+
+def test_rows_without_a_digest_are_rewritten_once(tmp_path):
+    storage = bot.SqliteStorage(str(tmp_path / "data.db"))
+    try:
+        save_users(storage, {"1": user(5, 3)})
+        storage.writer.execute("UPDATE users SET harem_digest = NULL")  # as written by an older version
+        fresh = user(5, 4)
+        save_users(storage, {"1": fresh})
+        assert storage.load_user("1") == fresh
+    finally:
+        storage.close()
+
+
+STATE = {
+    "users": {
+        "1": user(100, 3, name="Ko Ko"),
+        "2": user(0, 0),
+        "3": user(7, 2, fav_card="card_1", last_daily="2026-01-01T00:00:00"),
+    },
+    "cards": [
+        {"id": "card_1", "name": "One", "movie": "M", "rarity": "Common", "photo": "p1"},
+        {"id": "card_2", "name": "နှစ်", "movie": "N", "rarity": "Mythic", "photo": "p2", "uploader": 9},
+    ],
+    "groups": {"-100": {"title": "Group"}},
+    "group_messages": {"-100": 4},
+    "dropped_cards": {"-100": {"id": "card_1", "name": "One"}},
+    "votes": {"A": [1, 3], "B": []},
+    "vote_options": ["A", "B"],
+    "sudos": [5],
+    "drop_count": 10,
+    "next_serial": 30_000,
+}
+
+
+def plain(obj):
+    return {kind: dict(value.items()) if isinstance(value, bot.LazyUsers) else value for kind, value in obj.items()}
+
+
+def test_save_and_load_roundtrip(tmp_path):
+    storage = bot.SqliteStorage(str(tmp_path / "data.db"))
+    try:
+        storage.save(STATE, dict.fromkeys(STATE), full=True)
+    finally:
+        storage.close()
+    storage = bot.SqliteStorage(str(tmp_path / "data.db"))
+    try:
+        assert plain(storage.load()) == STATE
+    finally:
+        storage.close()
+
+
+def test_lazy_users_read_only_what_is_asked(tmp_path):
+    storage = bot.SqliteStorage(str(tmp_path / "data.db"))
+    try:
+        storage.save(STATE, dict.fromkeys(STATE), full=True)
+        users = storage.load()["users"]
+        assert isinstance(users, bot.LazyUsers) and len(users) == 3
+        assert "3" in users and "4" not in users
+        assert users.loaded_keys() == set()
+        assert users["3"] == STATE["users"]["3"]
+        assert users.peek("1") == STATE["users"]["1"]
+        assert users.loaded_keys() == {"3"}  # peek does not cache
+        users["4"] = user(1, 0)
+        del users["2"]
+        assert sorted(users) == ["1", "3", "4"] and len(users) == 3
+        assert users.name_of("1") == ("Ko Ko", None)
+    finally:
+        storage.close()
+
+
+def test_migrate_json_to_sqlite(tmp_path):
+    source = tmp_path / "data.json"
+    bot.JsonStorage(str(source)).save(STATE, dict.fromkeys(STATE), full=True)
+    bot.migrate_json_to_sqlite(str(source), str(tmp_path / "data.db"))
+    storage = bot.SqliteStorage(str(tmp_path / "data.db"))
+    try:
+        assert plain(storage.load()) == STATE
+    finally:
+        storage.close()
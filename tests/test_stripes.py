@@ -0,0 +1,36 @@
+import asyncio
+import itertools
+
+import bot
+
+
+def test_concurrent_bets_and_transfers_never_overspend(handlers, monkeypatch):
+    monkeypatch.setattr(bot, "CONCURRENT_UPDATES", 8)
+    # every spin and throw loses, and the basket's pause only yields to the other updates
+    spins = itertools.count()
+    monkeypatch.setattr(bot.random, "choice", lambda seq: seq[next(spins) % 2])
+    monkeypatch.setattr(bot.random, "randint", lambda a, b: 1)
+    real_sleep = asyncio.sleep
+    monkeypatch.setattr(bot.asyncio, "sleep", lambda delay, *args, **kwargs: real_sleep(0, *args, **kwargs))
+
+    balances = []
+    apply_op = bot.apply_op
+
+    def watched(op, *args):
+        apply_op(op, *args)
+        balances.append(bot.data["users"]["5"]["coins"])
+    monkeypatch.setattr(bot, "apply_op", watched)
+
+    bot.get_user(5)
+    bot.get_user(6)
+    start = bot.data["users"]["5"]["coins"]
+    bet = start * 2 // 5  # two of them fit, a third does not
+    commands = [f"/basket {bet}", f"/slots {bet}", f"/givecoin 6 {bet}"] * 2
+    handlers.run(*(handlers.message(5, text) for text in commands), concurrent=True)
+
+    refused = sum("Coins မလောက်ပါဘူး" in text for text in handlers.request.texts())
+    assert refused == len(commands) - 2
+    assert min(balances) >= 0
+    assert bot.data["users"]["5"]["coins"] == start - 2 * bet
+    given = bot.data["users"]["6"]["coins"] - start
+    assert given in (0, bet, 2 * bet)
@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+import bot
+
+SENDER, TARGET = 1001, 2002
+
+
+@pytest.mark.parametrize("failure, refunded", [
+    (bot.ShardUnreachable("shard socket is not accepting connections"), True),
+    (asyncio.TimeoutError(), False),
+    (ConnectionError("lost connection"), False),
+])
+def test_givecoin_refunds_only_a_transfer_that_was_never_sent(handlers, monkeypatch, failure, refunded):
+    async def failing_deliver(user_key, ops):
+        raise failure
+
+    monkeypatch.setattr(bot, "deliver", failing_deliver)
+    handlers.run(handlers.message(SENDER, f"/givecoin {TARGET} 300"))
+    coins = bot.data["users"][str(SENDER)]["coins"]
+    reply = handlers.request.texts()[-1]
+    if refunded:
+        assert coins == 10_000 and reply.startswith("❌")
+    else:
+        # the other shard may still credit the target: refunding could create the coins twice
+        assert coins == 9_700 and reply.startswith("⚠️")
+
+
+def test_givecoin_moves_the_coins(handlers):
+    handlers.run(handlers.message(SENDER, f"/givecoin {TARGET} 300"))
+    assert bot.data["users"][str(SENDER)]["coins"] == 9_700
+    assert bot.data["users"][str(TARGET)]["coins"] == 10_300
+
+
+def test_givecoin_to_another_shard_stops_when_the_debit_is_not_durable(handlers, monkeypatch):
+    delivered = []
+
+    async def remote_deliver(user_key, ops):
+        delivered.append(user_key)
+
+    def broken(lines, upto):
+        raise OSError("disk full")
+    monkeypatch.setattr(bot, "owns", lambda key: key != str(TARGET))
+    monkeypatch.setattr(bot, "deliver", remote_deliver)
+    monkeypatch.setattr(bot.journal, "_write", broken)
+    handlers.run(handlers.message(SENDER, f"/givecoin {TARGET} 300"))
+    assert delivered == []
+    assert bot.data["users"][str(SENDER)]["coins"] == 10_000
+    assert handlers.request.texts()[-1].startswith("❌")
@@ -0,0 +1,83 @@
+import asyncio
+import json
+import types
+
+from telegram import Bot
+
+import bot
+
+# a group message as Telegram posts it to the webhook
+RECORDED_UPDATE = {
+    "update_id": 900001,
+    "message": {
+        "message_id": 42,
+        "date": 1700000000,
+        "chat": {"id": -1001234567890, "type": "supergroup", "title": "Test group"},
+        "from": {"id": 777, "is_bot": False, "first_name": "Tester"},
+        "text": "/harem",
+        "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+    },
+}
+
+
+async def post(port, body: bytes, headers=None, length=None):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    head = ["POST /hook HTTP/1.1", "Host: localhost", f"Content-Length: {len(body) if length is None else length}",
+            "Connection: close"]
+    head += [f"{name}: {value}" for name, value in (headers or {}).items()]
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    status = int(response.split(b" ", 2)[1])
+    return status, json.loads(response.split(b"\r\n\r\n", 1)[1])
+
+
+def serve(check):
+    async def run():
+        application = types.SimpleNamespace(update_queue=asyncio.Queue(), bot=Bot("123456:TEST"))
+        server = bot.WebhookServer(application, "127.0.0.1", 0, "/hook", secret="s3cret")
+        await server.start()
+        try:
+            await check(server, application)
+        finally:
+            await server.stop()
+    asyncio.run(run())
+
+
+def test_recorded_update_is_queued():
+    async def check(server, application):
+        status, payload = await post(server.port, json.dumps(RECORDED_UPDATE).encode(),
+                                     {"X-Telegram-Bot-Api-Secret-Token": "s3cret"})
+        assert (status, payload) == (200, {"ok": True})
+        update = application.update_queue.get_nowait()
+        assert update.update_id == 900001 and update.message.text == "/harem"
+        assert server.received == 1
+    serve(check)
+
+
+def test_wrong_or_missing_secret_is_forbidden():
+    async def check(server, application):
+        body = json.dumps(RECORDED_UPDATE).encode()
+        assert (await post(server.port, body, {"X-Telegram-Bot-Api-Secret-Token": "wrong"}))[0] == 403
+        assert (await post(server.port, body))[0] == 403
+        assert application.update_queue.empty()
+    serve(check)
+
+
+def test_oversized_body_is_refused_before_reading_it():
+    async def check(server, application):
+        # only the header is sent: the server must answer from Content-Length alone
+        status, _ = await post(server.port, b"", {"X-Telegram-Bot-Api-Secret-Token": "s3cret"},
+                               length=bot.WebhookServer.MAX_BODY + 1)
+        assert status == 413
+    serve(check)
+
+
+def test_malformed_body_is_a_bad_request():
+    async def check(server, application):
+        secret = {"X-Telegram-Bot-Api-Secret-Token": "s3cret"}
+        assert (await post(server.port, b'{"update_id": ', secret))[0] == 400
+        assert (await post(server.port, b"[1, 2]", secret))[0] == 400
+        assert application.update_queue.empty()
+    serve(check)
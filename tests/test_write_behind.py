@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+import bot
+
+
+@pytest.fixture
+def saves(json_state, monkeypatch):
+    """The `dirty` argument of every storage save."""
+    calls = []
+    save = json_state.save
+
+    def recording(snapshot, dirty, full):
+        calls.append(dirty)
+        return save(snapshot, dirty, full)
+    monkeypatch.setattr(json_state, "save", recording)
+    return calls
+
+
+def change(coins):
+    bot.get_user(5)["coins"] = coins
+    bot.mark_dirty("users", "5")
+
+
+def run(persistence, monkeypatch, scenario):
+    monkeypatch.setattr(bot, "persistence", persistence)
+
+    async def go():
+        persistence.start()
+        try:
+            await scenario()
+        finally:
+            await persistence.stop()
+    asyncio.run(go())
+
+
+def test_enough_changes_flush_before_the_interval(saves, monkeypatch):
+    async def scenario():
+        change(1)
+        change(2)
+        await asyncio.sleep(0.05)
+        assert saves == []
+        change(3)
+        await asyncio.sleep(0.05)
+        assert len(saves) == 1 and saves[0]["users"] == {"5"}
+        assert bot.persistence.dirty == 0
+    run(bot.WriteBehind(60, 3), monkeypatch, scenario)
+    assert bot.storage.load()["users"]["5"]["coins"] == 3
+
+
+def test_a_single_change_is_flushed_after_the_interval(saves, monkeypatch):
+    async def scenario():
+        change(1)
+        await asyncio.sleep(0.05)
+        assert saves == []
+        await asyncio.sleep(0.2)
+        assert len(saves) == 1
+    run(bot.WriteBehind(0.1, 10 ** 9), monkeypatch, scenario)
+
+
+def test_stop_flushes_what_is_still_pending(saves, monkeypatch):
+    async def scenario():
+        change(7)
+        await asyncio.sleep(0.05)
+        assert saves == []
+    run(bot.WriteBehind(60, 10 ** 9), monkeypatch, scenario)
+    assert len(saves) == 1
+    assert bot.persistence.dirty == 0 and bot.persistence._task is None
+    assert bot.storage.load()["users"]["5"]["coins"] == 7